@@ -0,0 +1,79 @@
+"""
+Measures the throughput of a sms listing for every baud rate.
+
+The emulator paces its answers with the baud rate that is set with AT+IPR, because a pseudo-terminal ignores
+the baud rate. Pass --unpaced to measure only the processing overhead or the port of a real module to measure
+the link itself.
+
+Run from the gatewayw directory with: python -m benchmark.baudrates [--port /dev/serial0]
+"""
+
+import argparse
+import asyncio
+import time
+
+from gateway.io.sim800 import Sim800
+from gateway.io.sim800.emulator import Emulator
+from gateway.utils import logger, Level
+
+
+SMS = [
+    '+CMGL: {},"REC READ","+436501234567",""',
+    'The quick brown fox jumps over the lazy dog. The quick brown fox jumps over the lazy dog.'
+]
+
+
+def response_size(event):
+    # Every line is framed by \r\n...\r\n and the response ends with \r\nOK\r\n
+    return sum(len(line.encode()) + 4 for line in event.content) + 6
+
+
+async def measure(sim, baudrates, count):
+    results = []
+    for baudrate in baudrates:
+        used = await sim.negotiate_baudrate([baudrate])
+
+        size = 0
+        start = time.perf_counter()
+        for _ in range(count):
+            size += response_size(await sim.request_all_sms())
+        results.append((used, size / (time.perf_counter() - start)))
+    return results
+
+
+def run(port, baudrates, count, messages, paced=True):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    modem = None
+    if port is None:
+        listing = [line.format(index) for index in range(messages) for line in SMS]
+        modem = Emulator(responses={'AT+CMGL="ALL"': listing}, baudrate=9600 if paced else None)
+        modem.start()
+        port = modem.port
+
+    sim = Sim800(serial_port=port, loop=loop, backend='asyncio')
+    try:
+        return loop.run_until_complete(measure(sim, baudrates, count))
+    finally:
+        sim.close()
+        if modem is not None:
+            modem.close()
+        loop.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sms listing throughput per baud rate.')
+    parser.add_argument('--port', '-p', default=None, help='serial port of a real module')
+    parser.add_argument('--count', '-n', type=int, default=20)
+    parser.add_argument('--messages', '-m', type=int, default=30, help='number of sms in the emulated listing')
+    parser.add_argument('--unpaced', action='store_true', help='emulator answers without the baud rate')
+    args = parser.parse_args()
+
+    # Printing every line would dominate the measurement
+    logger.level = Level.LOG
+
+    for baudrate, throughput in run(args.port, sorted(Sim800.BAUDRATES), args.count, args.messages,
+                                      not args.unpaced):
+        # 8N1 needs 10 bits per byte
+        print('{:>7} baud   {:10.0f} B/s   line limit {:8.0f} B/s'.format(baudrate, throughput, baudrate / 10))
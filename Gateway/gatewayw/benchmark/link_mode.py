@@ -0,0 +1,85 @@
+"""
+Compares the verbose link mode with echo and the low overhead mode without echo and with numeric result codes.
+
+For every command the bytes on the link, the resulting transmission time at the baud rate and the measured
+round trip on the emulator are reported. A pseudo-terminal ignores the baud rate, so the transmission time
+is calculated with 10 bits per byte.
+
+Run from the gatewayw directory with: python -m benchmark.link_mode
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from gateway.io.sim800 import Sim800, ATCommand
+from gateway.io.sim800.emulator import Emulator
+from gateway.utils import logger, Level
+
+
+RESPONSES = {
+    'AT+CSQ': ['+CSQ: 15,0'],
+    'AT+CREG?': ['+CREG: 0,1'],
+    'AT+CPIN?': ['+CPIN: READY'],
+    'AT+GSN': ['861234567890123']
+}
+
+
+def link_bytes(modem, command):
+    # The command is written with a carriage return and answered with echo, response lines and result code
+    return len(command) + 1 + len(modem._answer(command.encode()))
+
+
+async def measure(sim, count):
+    latencies = {}
+    for command in RESPONSES:
+        latencies[command] = []
+        for _ in range(count):
+            start = time.perf_counter()
+            await sim.write(ATCommand(command + '\r\n', name=command))
+            latencies[command].append(time.perf_counter() - start)
+    return latencies
+
+
+def run(low_overhead, count):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    modem = Emulator(responses=RESPONSES)
+    modem.start()
+
+    # The cache would answer the commands without the link
+    sim = Sim800(serial_port=modem.port, loop=loop, backend='asyncio', cache_ttls={command: 0 for command in RESPONSES})
+    if low_overhead:
+        loop.run_until_complete(sim.set_link_mode(True))
+
+    latencies = loop.run_until_complete(measure(sim, count))
+    sizes = {command: link_bytes(modem, command) for command in RESPONSES}
+
+    sim.close()
+    modem.close()
+    loop.close()
+    return sizes, latencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Link mode overhead benchmark.')
+    parser.add_argument('--count', '-n', type=int, default=500)
+    parser.add_argument('--baudrate', '-b', type=int, default=9600)
+    args = parser.parse_args()
+
+    # Printing every line would dominate the measurement
+    logger.level = Level.LOG
+
+    verbose = run(False, args.count)
+    low_overhead = run(True, args.count)
+
+    print('{:<10} {:>14} {:>14} {:>12} {:>14} {:>14}'.format(
+        'command', 'bytes', 'line ms', 'saved ms', 'pty ms', 'pty saved ms'))
+    for command in RESPONSES:
+        sizes = verbose[0][command], low_overhead[0][command]
+        line = [size * 10 / args.baudrate * 1000 for size in sizes]
+        pty = [statistics.median(result[1][command]) * 1000 for result in (verbose, low_overhead)]
+        print('{:<10} {:>6} -> {:<5} {:>6.2f} -> {:<5.2f} {:>12.2f} {:>6.3f} -> {:<5.3f} {:>14.3f}'.format(
+            command, sizes[0], sizes[1], line[0], line[1], line[0] - line[1], pty[0], pty[1], pty[0] - pty[1]))
@@ -0,0 +1,43 @@
+"""
+Measures the cost of recording a finished command in the metrics and of taking a snapshot.
+
+Run from the gatewayw directory with: python -m benchmark.metrics
+"""
+
+import argparse
+import time
+
+from gateway.io.sim800.at_command import ATCommand, Priority
+from gateway.io.sim800.at_event import ATEvent
+from gateway.io.sim800.metrics import Metrics
+
+
+def measure(function, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Command metrics benchmark.')
+    parser.add_argument('--count', '-n', type=int, default=100000)
+    parser.add_argument('--names', type=int, default=20, help='number of distinct command names')
+    args = parser.parse_args()
+
+    metrics = Metrics()
+    events = []
+    for i in range(args.names):
+        event = ATEvent('Command{}'.format(i), ATCommand('AT+C{}\r\n'.format(i)), threadsafe=False)
+        event.written_at = event.created + 0.001 * i
+        event.first_byte_at = event.written_at + 0.01
+        events.append(event)
+
+    index = iter(range(args.count))
+    record = measure(lambda: metrics.record(events[next(index) % args.names]), args.count)
+    gauge = measure(lambda: metrics.queue_depth(Priority.Interactive, 3), args.count)
+    snapshot = measure(metrics.snapshot, 100)
+
+    print('record     {:8.3f} us'.format(record / args.count * 1e6))
+    print('gauge      {:8.3f} us'.format(gauge / args.count * 1e6))
+    print('snapshot   {:8.3f} ms   ({} command names)'.format(snapshot / 100 * 1e3, args.names))
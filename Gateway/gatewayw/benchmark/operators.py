@@ -0,0 +1,60 @@
+"""
+Compares the operator lookup in the memory-mapped index with loading apn-conf.json for every imsi, like the imsi
+parser did before.
+
+Run from the gatewayw directory with: python -m benchmark.operators
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import timeit
+
+from gateway.io.sim800.operators import OperatorIndex, write_index
+
+
+IMSIS = ['232011234567890', '310260123456789', '262011234567890', '999991234567890']
+
+
+def lookup_json(path, imsi):
+    """
+    The previous lookup, which reads the whole file.
+    """
+
+    with open(path) as f:
+        data = json.load(f)
+
+    mcc = imsi[:3]
+    mnc = imsi[3:5]
+    if mcc in data:
+        return data[mcc].get(mnc), data[mcc]['country'], data[mcc]['iso']
+    return None, None, None
+
+
+def per_lookup(function, count):
+    return timeit.timeit(lambda: [function(imsi) for imsi in IMSIS], number=count) / (count * len(IMSIS)) * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Operator lookup benchmark.')
+    parser.add_argument('--apnfile', default=os.path.join('..', 'etc', 'apn-conf.json'))
+    parser.add_argument('--count', '-n', type=int, default=200)
+    args = parser.parse_args()
+
+    with open(args.apnfile) as f:
+        apns = json.load(f)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'apn-conf.idx')
+        write_index(apns, path)
+
+        index = OperatorIndex.open(path)
+        print('{:<10} {:>12} {:>16}'.format('lookup', 'size KiB', 'us/lookup'))
+        print('{:<10} {:>12.1f} {:>16.3f}'.format('json', os.path.getsize(args.apnfile) / 1024,
+                                                  per_lookup(lambda imsi: lookup_json(args.apnfile, imsi),
+                                                             args.count)))
+        print('{:<10} {:>12.1f} {:>16.3f}'.format('index', os.path.getsize(path) / 1024,
+                                                  per_lookup(lambda imsi: index.lookup(imsi[:3], imsi[3:5]),
+                                                             args.count * 100)))
+        index.close()
@@ -0,0 +1,67 @@
+"""
+Measures the sustained number of sms per minute the outbox sends with different concurrencies.
+
+The emulator confirms every sms after the send latency, that the network needs on the real module.
+While one sms waits for the network, the outbox already hands the next one to the serial loop. The module
+sends one sms at a time, so a higher concurrency mainly keeps the serial loop busy while other sms are paced.
+
+Run from the gatewayw directory with: python -m benchmark.outbox
+"""
+
+import argparse
+import asyncio
+import time
+
+from gateway.io.sim800 import Sim800
+from gateway.io.sim800.outbox import Outbox
+from gateway.io.sim800.emulator import Emulator
+from gateway.utils import logger, Level
+
+
+async def measure(outbox, count, numbers):
+    start = time.perf_counter()
+    for i in range(count):
+        outbox.put('+43660{:07d}'.format(i % numbers), 'Message {}'.format(i))
+    await outbox.join()
+    return time.perf_counter() - start
+
+
+def run(concurrency, count, numbers, send_latency, pacing):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    modem = Emulator(echo=False, send_latency=send_latency)
+    modem.start()
+
+    sim = Sim800(serial_port=modem.port, loop=loop, backend='asyncio')
+    sim.serial_loop.echo = False
+
+    outbox = Outbox(sim, concurrency=concurrency, pacing=pacing)
+    outbox.start()
+
+    elapsed = loop.run_until_complete(measure(outbox, count, numbers))
+    loop.run_until_complete(outbox.stop())
+
+    sim.close()
+    modem.close()
+    loop.close()
+    return elapsed, outbox.stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Outbox throughput benchmark.')
+    parser.add_argument('--count', '-n', type=int, default=200)
+    parser.add_argument('--numbers', type=int, default=20, help='number of different recipients')
+    parser.add_argument('--send-latency', type=float, default=0.05, help='seconds the network needs per sms')
+    parser.add_argument('--pacing', type=float, default=0.2, help='seconds between two sms to the same number')
+    args = parser.parse_args()
+
+    # Printing every line would dominate the measurement
+    logger.level = Level.LOG
+
+    print('{:<12} {:>10} {:>12} {:>14} {:>14}'.format('concurrency', 'seconds', 'sms/min', 'p50 latency s',
+                                                     'p95 latency s'))
+    for concurrency in (1, 2, 4):
+        elapsed, stats = run(concurrency, args.count, args.numbers, args.send_latency, args.pacing)
+        print('{:<12} {:>10.2f} {:>12.0f} {:>14.3f} {:>14.3f}'.format(
+            concurrency, elapsed, stats.sent / elapsed * 60, stats.latency(50), stats.latency(95)))
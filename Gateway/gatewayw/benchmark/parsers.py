@@ -0,0 +1,92 @@
+"""
+Measures the parse cost per line of the response parsers and the memory per SMS object.
+
+The field splitters of the parsers are compared with the splitting the parsers used before: searching the
+colon and splitting with split_str() or split_str_python(). The memory of the slotted SMS class is compared
+with the same attrs class with a __dict__.
+
+Run from the gatewayw directory with: python -m benchmark.parsers
+"""
+
+import argparse
+import timeit
+import tracemalloc
+
+import attr
+
+from gateway.io.sim800.at_parser import SMSListParser, SignalQualityParser, NetworkStatusParser, FieldSplitter
+from gateway.io.sim800.at_response import SMS
+from gateway.utils import split_str
+from gateway.utils.string_utils import split_str_python
+
+
+LINES = {
+    '+CSQ': '+CSQ: 15,0',
+    '+CREG': '+CREG: 0,1,"00C1","1A2B"',
+    '+CMGL': '+CMGL: 1,"REC READ","+436501234567","","19/03/14,12:30:45+04"'
+}
+
+PARSERS = {
+    '+CSQ': SignalQualityParser,
+    '+CREG': NetworkStatusParser,
+    '+CMGL': SMSListParser
+}
+
+
+@attr.s
+class DictSMS:
+    """
+    The SMS class without slots like before.
+    """
+
+    index = attr.ib()
+    status = attr.ib(converter=SMS.Status)
+    address = attr.ib()
+    message = attr.ib()
+    address_name = attr.ib(default=None)
+    time = attr.ib(default=None)
+    indexes = attr.ib(default=None)
+    concatenation = attr.ib(default=None)
+
+
+def per_line(function, count):
+    return timeit.timeit(function, number=count) / count * 1e6
+
+
+def memory_per_object(cls, count):
+    # The messages are created before, so only the objects are measured
+    messages = ['Message {}'.format(i) for i in range(count)]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [cls(i, 'REC READ', '+436501234567', message) for i, message in enumerate(messages)]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    assert len(objects) == count
+    return size / count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parser micro-benchmark.')
+    parser.add_argument('--count', '-n', type=int, default=100000)
+    parser.add_argument('--objects', type=int, default=10000)
+    args = parser.parse_args()
+
+    print('{:<8} {:>16} {:>16} {:>16} {:>16}'.format('prefix', 'split_str us', 'python us', 'splitter us',
+                                                    'parse us'))
+    for prefix, line in LINES.items():
+        splitter = FieldSplitter(prefix)
+        content = [line, 'Hello'] if prefix == '+CMGL' else [line]
+        print('{:<8} {:>16.3f} {:>16.3f} {:>16.3f} {:>16.3f}'.format(
+            prefix,
+            per_line(lambda: split_str(line), args.count),
+            per_line(lambda: split_str_python(line[line.index(':') + 1:]), args.count),
+            per_line(lambda: splitter.split(line), args.count),
+            per_line(lambda: PARSERS[prefix].parse(content), args.count)))
+
+    print()
+    print('{:<8} {:>16} {:>16}'.format('class', 'bytes/object', 'total KiB'))
+    for cls in (DictSMS, SMS):
+        size = memory_per_object(cls, args.objects)
+        print('{:<8} {:>16.0f} {:>16.0f}'.format(cls.__name__, size, size * args.objects / 1024))
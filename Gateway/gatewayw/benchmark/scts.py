@@ -0,0 +1,70 @@
+"""
+Compares the fixed-width parser of the service centre timestamps with the previous strptime implementation.
+
+Both the single timestamps and the text mode listings that contain them are measured. For the listings
+the parser of the timestamps is swapped in the parser module.
+
+Run from the gatewayw directory with: python -m benchmark.scts
+"""
+
+import argparse
+import time
+from datetime import datetime
+from unittest.mock import patch
+
+from gateway.io.sim800.at_parser import SMSListParser
+from gateway.io.sim800.scts import parse_scts
+
+
+def parse_time_strptime(time_str):
+    """
+    The previous implementation, which drops the timezone.
+    """
+
+    try:
+        zone_index = time_str.index('-')
+    except ValueError:
+        try:
+            zone_index = time_str.index('+')
+        except ValueError:
+            zone_index = len(time_str) - 1
+
+    return datetime.strptime(time_str[0:zone_index], '%y/%m/%d,%H:%M:%S')
+
+
+def listing(size):
+    content = []
+    for i in range(size):
+        content.append('+CMGL: {},"REC READ","+436501234567","","19/03/{:02d},12:{:02d}:45+04"'.format(
+            i + 1, i % 28 + 1, i % 60))
+        content.append('Message {}'.format(i))
+    return content
+
+
+def measure(function, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Timestamp parser benchmark.')
+    parser.add_argument('--listings', '-n', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=10, help='number of sms per listing')
+    args = parser.parse_args()
+
+    timestamps = ['19/03/{:02d},12:{:02d}:45+04'.format(i % 28 + 1, i % 60) for i in range(args.size)]
+    content = listing(args.size)
+    count = args.listings * args.size
+
+    old = measure(lambda: [parse_time_strptime(timestamp) for timestamp in timestamps], args.listings)
+    new = measure(lambda: [parse_scts(timestamp) for timestamp in timestamps], args.listings)
+    print('timestamp  strptime {:8.3f} us   fixed-width {:8.3f} us   {:5.1f}x'.format(
+        old / count * 1e6, new / count * 1e6, old / new))
+
+    with patch('gateway.io.sim800.at_parser.parse_scts', parse_time_strptime):
+        old = measure(lambda: SMSListParser.parse(content), args.listings)
+    new = measure(lambda: SMSListParser.parse(content), args.listings)
+    print('listing    strptime {:8.3f} ms   fixed-width {:8.3f} ms   {:5.1f}x   ({} listings of {} sms)'.format(
+        old / args.listings * 1e3, new / args.listings * 1e3, old / new, args.listings, args.size))
@@ -0,0 +1,60 @@
+"""
+Compares the round trip latency of the thread and the asyncio serial backend.
+
+Run from the gatewayw directory with: python -m benchmark.serial_backends
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from gateway.io.sim800 import Sim800, ATCommand
+from gateway.io.sim800.emulator import Emulator
+from gateway.utils import logger, Level
+
+
+async def measure(sim, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await sim.write(ATCommand('AT\r\n', name='Attention'))
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_backend(backend, count):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    modem = Emulator()
+    modem.start()
+
+    sim = Sim800(serial_port=modem.port, loop=loop, backend=backend)
+    latencies = loop.run_until_complete(measure(sim, count))
+
+    sim.close()
+    modem.close()
+    loop.close()
+    return latencies
+
+
+def report(backend, latencies):
+    latencies = sorted(latencies)
+    print('{:<8} mean {:8.3f} ms   median {:8.3f} ms   p99 {:8.3f} ms'.format(
+        backend,
+        statistics.mean(latencies) * 1000,
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99) - 1] * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serial backend round trip benchmark.')
+    parser.add_argument('--count', '-n', type=int, default=1000)
+    args = parser.parse_args()
+
+    # Printing every line would dominate the measurement
+    logger.level = Level.LOG
+
+    for backend in ('thread', 'asyncio'):
+        report(backend, run_backend(backend, args.count))
@@ -0,0 +1,47 @@
+"""
+Measures the splitting of the fields of response lines with the c extension and the python implementation.
+
+split_str() encodes the str and decodes every field, split_fields_bytes() returns slices of the bytes or of the
+memoryview, like the lines are read from the serial port. The field splitter of the parsers is measured too.
+
+Run from the gatewayw directory with: python -m benchmark.split
+"""
+
+import argparse
+import timeit
+
+from gateway.io.sim800.at_parser import FieldSplitter
+from gateway.utils import split_str
+from gateway.utils.string_utils import split_str_python, split_fields_bytes
+
+
+LINES = {
+    '+CMGL': '+CMGL: 1,"REC READ","+436501234567","Doe, John","19/03/14,12:30:45+04"',
+    '+CLIP': '+CLIP: "+436501234567",145,"",0,"Doe, John",0'
+}
+
+
+def per_line(function, count):
+    return timeit.timeit(function, number=count) / count * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Field splitting micro-benchmark.')
+    parser.add_argument('--count', '-n', type=int, default=200000)
+    args = parser.parse_args()
+
+    print('{:<8} {:>12} {:>12} {:>12} {:>14} {:>12}'.format('prefix', 'python us', 'split_str us', 'bytes us',
+                                                            'memoryview us', 'splitter us'))
+    for prefix, line in LINES.items():
+        data = line.encode()
+        view = memoryview(data)
+        start = data.index(b':') + 1
+        splitter = FieldSplitter(prefix)
+
+        print('{:<8} {:>12.3f} {:>12.3f} {:>12.3f} {:>14.3f} {:>12.3f}'.format(
+            prefix,
+            per_line(lambda: split_str_python(line[line.index(':') + 1:]), args.count),
+            per_line(lambda: split_str(line), args.count),
+            per_line(lambda: split_fields_bytes(data, start), args.count),
+            per_line(lambda: split_fields_bytes(view, start), args.count),
+            per_line(lambda: splitter.split(line), args.count)))
@@ -0,0 +1,78 @@
+"""
+Measures the overhead of recording the serial trace and replays the recording as fast as possible.
+
+A session of sms listings is run against the emulator with and without the recorder. The recorded trace is
+then replayed without delays, which measures the throughput of the serial stack without the emulator.
+
+Run from the gatewayw directory with: python -m benchmark.trace
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from gateway.io.sim800 import Sim800
+from gateway.io.sim800.emulator import Emulator
+from gateway.io.sim800.trace import TraceReplayer
+from gateway.utils import logger, Level
+
+
+async def measure(sim, count):
+    await sim.setup()
+
+    start = time.perf_counter()
+    for _ in range(count):
+        event = await sim.request_all_sms()
+        assert not event.error
+    return time.perf_counter() - start
+
+
+def run(port, count, trace=None):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    sim = Sim800(serial_port=port, loop=loop, backend='asyncio', trace=trace)
+    elapsed = loop.run_until_complete(measure(sim, count))
+
+    sim.close()
+    loop.close()
+    return elapsed
+
+
+def emulated(count, messages, trace=None):
+    emulator = Emulator()
+    emulator.start()
+    for i in range(messages):
+        emulator.receive_sms('+436501234567', 'Message {}'.format(i))
+
+    elapsed = run(emulator.port, count, trace)
+    emulator.close()
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serial trace benchmark.')
+    parser.add_argument('--count', '-n', type=int, default=200)
+    parser.add_argument('--messages', '-m', type=int, default=20, help='number of sms in the listing')
+    args = parser.parse_args()
+
+    # Printing every line would dominate the measurement
+    logger.level = Level.LOG
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'serial.trace')
+
+        plain = emulated(args.count, args.messages)
+        recorded = emulated(args.count, args.messages, path)
+
+        replayer = TraceReplayer(path, speed=None)
+        replayer.start()
+        replayed = run(replayer.port, args.count)
+        replayer.close()
+
+        print('{:<10} {:>10} {:>14}'.format('session', 'seconds', 'ms/listing'))
+        for name, elapsed in (('emulator', plain), ('recorded', recorded), ('replayed', replayed)):
+            print('{:<10} {:>10.3f} {:>14.3f}'.format(name, elapsed, elapsed / args.count * 1e3))
+        print('trace {:.1f} KiB, {} mismatches'.format(os.path.getsize(path) / 1024, len(replayer.mismatches)))
@@ -5,7 +5,8 @@ import sys
 from functools import partial
 
 from gateway.core import get_config, set_config
-from gateway.io.sim800 import Sim800, Sim800Error, at_response
+from gateway.io.sim800 import Sim800, Sim800Error, Inbox, Outbox, Modem, ModemPool, Policy, PoolError, at_response
+from gateway.io.sim800.pdu import PDUError
 from gateway.networking import API, Caller, Role
 from gateway.utils import logger, use_config_file
 
@@ -14,18 +15,73 @@ config = None
 auth_config = None
 config_path = None
 
+# Modem that carries the call, which is bridged to the app
+call_modem = None
 
-async def check_pin_status(sim: Sim800, api: API):
-    event = await sim.request_pin_status()
-    if event.error_message:
-        return logger.error('Sim800', 'RequestPinStatusError({})'.format(event.error_message))
+# Prefix of the config sections of the modems, e.g. [Modem usb0]
+MODEM_SECTION = 'Modem '
 
-    if event.data != at_response.PINStatus.Ready:
-        logger.info('Sim800', 'Sim card locked with {}'.format(event.data))
-        api.put_gateway(pin_required=True)
-    else:
-        logger.info('Sim800', 'Sim card ready!')
-        api.put_gateway(pin_required=False)
+
+def create_modems():
+    """
+    Creates a modem per modem section of the config, the sections inherit the options of the DEFAULT section.
+    Without modem sections a single modem is created from the DEFAULT section.
+
+    :return: list of the config sections and the Modem objects
+    :rtype: list
+    """
+
+    sections = [section for section in config.sections() if section.startswith(MODEM_SECTION)] or ['DEFAULT']
+
+    modems = []
+    for section in sections:
+        options = config[section]
+        name = section[len(MODEM_SECTION):] if section != 'DEFAULT' else 'default'
+
+        # Every modem records to its own trace
+        trace = options.get('serialtrace') or None
+        if trace and len(sections) > 1:
+            trace = '{}.{}'.format(trace, name)
+
+        sim = Sim800(debug=options.getboolean('serialdebug'), serial_port=options['serialport'],
+                     backend=options.get('serialbackend', 'thread'),
+                     cache_ttls={'AT+CSQ': options.getfloat('signalcachettl', 5)},
+                     baudrate=options.getint('baudrate', 9600), cmux=options.getboolean('cmux', False), trace=trace)
+
+        prefixes = [prefix.strip() for prefix in options.get('prefixes', '').split(',') if prefix.strip()]
+        modems.append((section, Modem(name, sim, cost=options.getfloat('cost', 0), carrier=options.get('carrier'),
+                                      prefixes=prefixes, pin=options.get('pin', auth_config.get('pin')))))
+
+    return modems
+
+
+async def check_pin_status(pool: ModemPool, api: API):
+    pin_required = False
+    for modem in pool:
+        event = await modem.sim.request_pin_status()
+        if event.error_message:
+            logger.error('Sim800', 'RequestPinStatusError(Modem: {}, {})'.format(modem.name, event.error_message))
+            continue
+
+        if event.data != at_response.PINStatus.Ready:
+            logger.info('Sim800', 'Sim card of {} locked with {}'.format(modem.name, event.data))
+            pin_required = True
+        else:
+            logger.info('Sim800', 'Sim card of {} ready!'.format(modem.name))
+
+    api.put_gateway(pin_required=pin_required)
+    return pin_required
+
+
+async def negotiate_baudrate(sim, baudrates, section='DEFAULT'):
+    global config
+    try:
+        baudrate = await sim.negotiate_baudrate(baudrates)
+    except Sim800Error as e:
+        return logger.error('Sim800', 'NegotiateBaudrateError({})'.format(e.args[1]))
+
+    # Open the serial interface with the negotiated baud rate on the next start, the config is written by check_imei
+    config[section]['baudrate'] = str(baudrate)
 
 
 async def check_imei(sim):
@@ -52,50 +108,72 @@ async def main():
     API_HOST = config['Server']['apihost']
     SIGNALING_HOST = config['Server']['signalinghost']
     SERIAL_DEBUG = config['DEFAULT'].getboolean('serialdebug')
-    SERIAL_PORT = config['DEFAULT']['serialport']
+    BAUDRATES = [int(rate) for rate in config['DEFAULT'].get('baudrates', '9600').split(',')]
+    MODEM_POLICY = Policy(config['DEFAULT'].get('modempolicy', Policy.LeastBusy.value))
+    OUTBOX_FILE = config['DEFAULT'].get('outboxfile')
+    SMS_PACING = config['DEFAULT'].getfloat('smspacing', 5)
     PCM_DEBUG = config['DEFAULT'].getboolean('pcmdebug')
 
     logger.info('Gateway', 'Serial debug = {}'.format(SERIAL_DEBUG))
     logger.info('Gateway', 'PCM debug = {}'.format(PCM_DEBUG))
-    sim = Sim800(debug=SERIAL_DEBUG, serial_port=SERIAL_PORT)
+    modems = create_modems()
+    pool = ModemPool([modem for _, modem in modems], policy=MODEM_POLICY)
+    logger.info('Gateway', 'Modems: {}'.format(', '.join(modem.name for modem in pool)))
 
     if not SERIAL_DEBUG:
-        await check_imei(sim)
+        for section, modem in modems:
+            await negotiate_baudrate(modem.sim, BAUDRATES, section)
+        # The gateway is identified by the imei of its first modem
+        await check_imei(modems[0][1].sim)
 
     logger.info('Gateway', 'Connecting with user: {}'.format(auth_config['user']))
 
     api = API(auth_config['user'], auth_config['password'], auth_config['imei'], host=API_HOST)
 
     if not SERIAL_DEBUG:
-        pin = None
-        if 'pin' in auth_config:
-            pin = auth_config['pin']
         try:
-            await sim.setup(pin)
+            await pool.setup()
         except Sim800Error as e:
             logger.error('Sim800', 'SimSetupError(Name: {}, Message: {})'.format(*e.args))
-            logger.info('Gateway', 'Closing Program because Sim800 could not be initialized!')
+            logger.info('Gateway', 'Closing Program because no Sim800 could be initialized!')
             sys.exit(-1)
 
-        await check_pin_status(sim, api)
+        await check_pin_status(pool, api)
+
+        # Upload the sms that arrive from now on and those that were received while the gateway was not running
+        for modem in pool:
+            inbox = Inbox(modem.sim, partial(upload_sms, api))
+            inbox.start()
+            asyncio.ensure_future(inbox.sync())
 
     logger.set_error_handler(api.push_error)
 
     caller = Caller(auth_config['user'], auth_config['password'], auth_config['imei'], host=SIGNALING_HOST, debug=PCM_DEBUG)
 
-    sim.on('ring', partial(on_outgoing_call, api, caller))
+    # The pool emits the result codes of every modem with the modem that reported them
+    if SERIAL_DEBUG:
+        # Without caller identification only the ring event gets emitted
+        pool.on('ring', partial(on_outgoing_call, api, caller))
+    else:
+        pool.on('caller_identification', partial(on_outgoing_call, api, caller))
+    pool.on('call_ended', partial(on_call_ended, caller))
 
-    api.on('holdCall', partial(on_hold_call, sim))
-    api.on('resumeCall', partial(on_resume_call, sim))
-    api.on('playDTMF', partial(on_play_dtmf, sim))
+    api.on('holdCall', on_hold_call)
+    api.on('resumeCall', on_resume_call)
+    api.on('playDTMF', on_play_dtmf)
     api.on('hangUp', partial(on_hang_up, caller))  # Eventually not needed
-    api.on('dial', partial(on_dial, sim, caller))
-    api.on('clientDidAnswerCall', partial(on_answer_call, sim))
-    api.on('requestSignal', partial(on_request_signal, sim, api))
-    api.on('sendSMS', partial(on_send_sms, sim))
-    api.on('enterPIN', partial(on_enter_pin, sim, api))
-
-    caller.on('connectionClosed', partial(on_connection_closed, sim))
+    api.on('dial', partial(on_dial, pool, caller))
+    api.on('clientDidAnswerCall', on_answer_call)
+    api.on('requestSignal', partial(on_request_signal, pool, api))
+    # Sms of the app are sent in the background over the modems of the pool, so bulk sends do not block the call
+    # control
+    outbox = Outbox(pool, path=OUTBOX_FILE, pacing=SMS_PACING, concurrency=2 * len(pool))
+    outbox.start()
+
+    api.on('sendSMS', partial(on_send_sms, outbox))
+    api.on('enterPIN', partial(on_enter_pin, pool, api))
+
+    caller.on('connectionClosed', partial(on_connection_closed, pool))
     caller.on('signalingTimeout', on_signaling_timeout)
 
     api.start()
@@ -105,36 +183,75 @@ async def main():
 
 # Sim Callbacks
 
-async def on_outgoing_call(api, caller, data):
-    api.push_incoming_call("+436503333997")
+def get_call_sim():
+    """
+    :return: Sim800 object of the modem that carries the call or None
+    """
+
+    if call_modem is None:
+        logger.error('Gateway', 'NoActiveCallError')
+        return None
+    return call_modem.sim
+
+
+async def on_outgoing_call(api, caller, modem, number):
+    global call_modem
     if caller.is_ongoing():
         logger.info('WebRTC', "Already one call is active!")
         return
+    call_modem = modem
+    api.push_incoming_call(number)
     caller.start_call(Role.OFFER)
 
 
+async def on_call_ended(caller, modem, data):
+    global call_modem
+    logger.log('Sim800', 'Call of {} ended!'.format(modem.name))
+    if modem is not call_modem:
+        return
+    call_modem = None
+    if caller.is_ongoing():
+        caller.stop_call()
+
+
+async def upload_sms(api, sms):
+    return api.push_sms(sms)
+
+
 # API Callbacks
 
-async def on_resume_call(sim, data):
+async def on_resume_call(data):
+    sim = get_call_sim()
+    if sim is None:
+        return
+
     event = await sim.resume_call()
 
     if event.error:
         logger.error('Sim800', 'ResumeCallError({})'.format(event.error_message))
 
 
-async def on_hold_call(sim, data):
+async def on_hold_call(data):
+    sim = get_call_sim()
+    if sim is None:
+        return
+
     event = await sim.hold_call()
 
     if event.error:
         logger.error('Sim800', 'HoldCallError({})'.format(event.error_message))
 
 
-async def on_play_dtmf(sim, data):
+async def on_play_dtmf(data):
     if not data:
         return logger.error('SSE', 'ArgumentError(data)')
     if 'digits' not in data:
         return logger.error('SSE', 'ArgumentError(digits)')
 
+    sim = get_call_sim()
+    if sim is None:
+        return
+
     event = await sim.transmit_dtmf_tone(data['digits'])
 
     if event.error:
@@ -147,14 +264,18 @@ async def on_hang_up(caller, data):
         caller.stop_call()
 
 
-async def on_answer_call(sim, data):
+async def on_answer_call(data):
     logger.log('GATEWAY', 'Answer call!')
+    sim = get_call_sim()
+    if sim is None:
+        return
+
     event = await sim.answer_call()
     if event.error:
         logger.error('Sim800', 'AnswerCallError({})'.format(event.error_message))
 
 
-async def on_dial(sim, caller, data):
+async def on_dial(pool, caller, data):
     logger.log('GATEWAY', 'Initialize Call!')
 
     if not data:
@@ -163,13 +284,20 @@ async def on_dial(sim, caller, data):
         return logger.error('SSE', 'ArgumentError(number)')
 
     async def on_connection():
+        global call_modem
         logger.log('Sim800', 'Dial Number!')
 
-        event = await sim.dial_number(data['number'])
+        try:
+            modem, event = await pool.dial_number(data['number'])
+        except PoolError as e:
+            logger.error('Sim800', 'DialError({})'.format(e.args[1]))
+            return caller.stop_call()
 
         if event.error:
-            logger.error('Sim800', 'DialError({})'.format(event.error_message))
+            logger.error('Sim800', 'DialError(Modem: {}, {})'.format(modem.name, event.error_message))
             caller.stop_call()
+        else:
+            call_modem = modem
 
     if caller.is_ongoing():
         logger.info('WebRTC', "Already one call is active!")
@@ -179,15 +307,21 @@ async def on_dial(sim, caller, data):
     caller.start_call(Role.ANSWER)
 
 
-async def on_request_signal(sim, api, data):
-    event = await sim.request_signal_quality()
-    if not event.error:
-        api.put_gateway(signal_strength=event.data.rssi)
-    else:
-        logger.error('Sim800', 'RequestSignalQualityError({})'.format(event.error_message))
+async def on_request_signal(pool, api, data):
+    # The gateway reports the strongest signal of its modems, 99 is unknown
+    strengths = []
+    for modem in pool:
+        event = await modem.sim.request_signal_quality()
+        if event.error:
+            logger.error('Sim800', 'RequestSignalQualityError(Modem: {}, {})'.format(modem.name, event.error_message))
+        elif event.data.rssi != '99':
+            strengths.append(event.data.rssi)
 
+    if strengths:
+        api.put_gateway(signal_strength=max(strengths, key=int))
 
-async def on_send_sms(sim, data):
+
+async def on_send_sms(outbox, data):
     if not data:
         return logger.error('SSE', 'ArgumentError(data)')
     if 'recipient' not in data:
@@ -195,39 +329,63 @@ async def on_send_sms(sim, data):
     if 'message' not in data:
         return logger.error('SSE', 'ArgumentError(message)')
 
-    event = await sim.send_sms(data['recipient'], data['message'])
-    if event.error:
-        logger.error('Sim800', 'SendSMSError({})'.format(event.error_message))
+    try:
+        outbox.put(data['recipient'], data['message'])
+    except PDUError:
+        logger.error('SSE', 'ArgumentError(recipient)')
 
 
-async def on_enter_pin(sim: Sim800, api: API, data):
+async def on_enter_pin(pool: ModemPool, api: API, data):
     if not data:
         return logger.error('SSE', 'ArgumentError(data)')
     if 'pin' not in data:
         return logger.error('SSE', 'ArgumentError(pin)')
 
-    event = await sim.enter_pin(data['pin'])
-    if event.error:
-        return logger.error('Sim800', 'EnterPINError({})'.format(event.error_message))
+    if 'modem' in data and data['modem'] not in pool.modems:
+        return logger.error('SSE', 'ArgumentError(modem)')
 
-    event = await sim.request_pin_status()
-    if event.error:
-        return logger.error('Sim800', 'RequestPINStatusError({})'.format(event.error_message))
+    # The pin is entered on the given modem or on every locked modem
+    modems = [pool[data['modem']]] if 'modem' in data else list(pool)
+    for modem in modems:
+        event = await modem.sim.request_pin_status()
+        if event.error or event.data == at_response.PINStatus.Ready:
+            continue
 
-    if event.data == at_response.PINStatus.Ready:
-        logger.info('Gateway', 'PIN was entered successful!')
-        auth_config['pin'] = data['pin']
-        api.put_gateway(pin_required=False)
-    else:
+        event = await modem.sim.enter_pin(data['pin'])
+        if event.error:
+            logger.error('Sim800', 'EnterPINError(Modem: {}, {})'.format(modem.name, event.error_message))
+            continue
+
+        event = await modem.sim.request_pin_status()
+        if event.error:
+            logger.error('Sim800', 'RequestPINStatusError(Modem: {}, {})'.format(modem.name, event.error_message))
+            continue
+
+        if event.data == at_response.PINStatus.Ready:
+            logger.info('Gateway', 'PIN of {} was entered successful!'.format(modem.name))
+            auth_config['pin'] = modem.pin = data['pin']
+            # Modems that were locked during the start are set up now
+            if not modem.available:
+                try:
+                    await pool.setup([modem])
+                except Sim800Error:
+                    pass
+
+    if await check_pin_status(pool, api):
         logger.error('Gateway', 'WrongPINError')
         api.broadcast_notification('invalidPIN', silent=True, voip=True)
 
 
 # WebRTC Callbacks
 
-async def on_connection_closed(sim):
+async def on_connection_closed(pool):
+    global call_modem
     logger.log('WebRTC', 'Connection Closed!')
-    event = await sim.hang_up_call()
+    if call_modem is None:
+        return
+
+    event = await pool.hang_up_call(call_modem)
+    call_modem = None
 
     if event.error:
         logger.error('Sim800', 'HangUpError({})'.format(event.error_message))
@@ -1,6 +1,6 @@
-from gateway.io.sim800.at_command import ATCommand
+from gateway.io.sim800.at_command import ATCommand, Priority
 from gateway.io.sim800.at_event import ATEvent
 from gateway.io.sim800.at_response import SignalQuality, PINStatus, NetworkStatus, SMS, IMEI, IMSI, \
-    SubscriberNumber
+    SubscriberNumber, SMSIndication, SMSStatusReport
 from gateway.io.sim800.sim800 import Sim800, Sim800Error
 from gateway.io.pcm.pcm import PCM
@@ -1,5 +1,9 @@
-from gateway.io.sim800.at_command import ATCommand
+from gateway.io.sim800.at_command import ATCommand, Priority
 from gateway.io.sim800.at_event import ATEvent
 from gateway.io.sim800.at_response \
-import SignalQuality, PINStatus, NetworkStatus, SMS, IMEI, IMSI, SubscriberNumber
+import SignalQuality, PINStatus, NetworkStatus, SMS, IMEI, IMSI, SubscriberNumber, \
+    SMSIndication, SMSStatusReport
 from gateway.io.sim800.sim800 import Sim800, Sim800Error
+from gateway.io.sim800.inbox import Inbox
+from gateway.io.sim800.outbox import Outbox
+from gateway.io.sim800.pool import ModemPool, Modem, Policy, PoolError
@@ -0,0 +1,317 @@
+import os
+
+from gateway.io.sim800.at_tokenizer import TokenType
+from gateway.io.sim800.serial_loop import BaseSerialLoop, SerialError, ResponseTimeout, RESYNC_ATTEMPTS, \
+    RESYNC_QUIET, RESYNC_TIMEOUT
+from gateway.utils import logger
+
+# States of the resynchronisation
+_DRAIN = 1
+_CONFIRM = 2
+
+
+class AsyncSerialLoop(BaseSerialLoop):
+    """
+    AsyncSerialLoop communicates with the sim800 module from within the asyncio event loop.
+
+    Instead of a separate thread, the file descriptor of the serial interface is watched with
+    'loop.add_reader()', so a response is processed without crossing any thread boundaries.
+    """
+
+    threadsafe = False
+
+    def __init__(self, emitter, serial, debug, loop):
+        """
+        Construct a new 'AsyncSerialLoop' object.
+
+        :param emitter: Sim800 object
+        :param serial: serial object
+        :param debug: indicates debug mode
+        :param loop: asyncio event loop
+        :type emitter: object
+        :type serial: object
+        :type debug: bool
+        :return: returns nothing
+        """
+
+        super().__init__(emitter, serial, debug)
+
+        self.loop = loop
+        self.running = False
+
+        # Set while the consumer of a streamed response is behind
+        self.paused = False
+
+        self._awaiting_echo = False
+
+        # Timer for the deadline of the current command or the current step of the resynchronisation
+        self._timer = None
+
+        # State of the resynchronisation, None if the module is in sync
+        self._resync_state = None
+        self._resync_attempts = 0
+
+    def start(self):
+        """
+        Starts watching the serial interface.
+
+        :return: nothing
+        """
+
+        self.loop.add_reader(self._fileno(), self._on_readable)
+        self.running = True
+        logger.info('Sim800', 'Started Service!')
+
+    def stop(self):
+        """
+        Stops watching the serial interface.
+
+        :return: nothing
+        """
+
+        if self.running:
+            if not self.paused:
+                self.loop.remove_reader(self._fileno())
+            self._cancel_timer()
+            self.running = False
+            self.paused = False
+
+    def pause_reading(self):
+        """
+        Stops reading from the serial interface until 'resume_reading()' is called.
+
+        The received data stays in the buffers of the serial interface meanwhile,
+        so the current command does not time out.
+
+        :return: nothing
+        """
+
+        if self.running and not self.paused:
+            self.loop.remove_reader(self._fileno())
+            self.paused = True
+            self._cancel_timer()
+
+    def resume_reading(self):
+        """
+        Continues reading from the serial interface and restarts the timeout of the current command.
+
+        :return: nothing
+        """
+
+        if self.paused:
+            self.paused = False
+            self.loop.add_reader(self._fileno(), self._on_readable)
+
+            if self._event is not None and self._timer is None:
+                self._timer = self.loop.call_later(self._event.command.timeout, self._on_timeout)
+
+    def put(self, event):
+        """
+        Queues the event and writes it immediately if no other command is processed.
+
+        :param event: event that should be written to the serial interface
+        :return: nothing
+        """
+
+        self.command_queue.put_nowait(event)
+        self._queue_changed(event.command.priority)
+
+        if self._event is None and self._resync_state is None:
+            self._next_event()
+
+    def _next_event(self):
+        """
+        Writes the next queued command to the serial interface.
+
+        :return: nothing
+        """
+
+        self._event = None
+
+        while not self.command_queue.empty():
+            event, command = self._get_event_from_queue(self.command_queue)
+            self._queue_changed(command.priority)
+
+            # Skip commands that nobody waits for anymore
+            if event.cancelled:
+                continue
+
+            self._event = event
+            self._awaiting_echo = self.echo
+
+            # Write the command to the serial interface
+            self._timer = self.loop.call_later(command.timeout, self._on_timeout)
+            self._write_command(command)
+            return
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _on_timeout(self):
+        """
+        Gets called by the event loop when the current command is not answered within its timeout.
+
+        :return: nothing
+        """
+
+        self._timer = None
+        logger.error('Sim800', 'SerialError(Timeout)')
+        self._fail(ResponseTimeout('No response within the deadline'))
+
+    def _fail(self, error):
+        """
+        Sets the current event with the error and resynchronizes the module before the next command.
+
+        :param error: error that caused the failure
+        :return: nothing
+        """
+
+        self._cancel_timer()
+
+        event, self._event = self._event, None
+        self._fail_event(event, error)
+
+        self._resync()
+
+    def _resync(self):
+        """
+        Drains the serial interface and confirms with a bare AT command, that the module is in sync again.
+
+        The steps are driven by the timers and the data of the event loop, the next command is written
+        once the module answered or all attempts failed.
+
+        :return: nothing
+        """
+
+        if self.debug:
+            self._next_event()
+            return
+
+        logger.info('Sim800', 'Resynchronizing serial interface...')
+
+        self.tokenizer.reset()
+        self.tokenizer.responses = set()
+        self.tokenizer.expect_prompt = False
+
+        self._resync_attempts = RESYNC_ATTEMPTS
+        self._resync_drain()
+
+    def _resync_drain(self):
+        """
+        Starts the next attempt of the resynchronisation by waiting until the serial interface is quiet.
+
+        :return: nothing
+        """
+
+        self._cancel_timer()
+
+        if self._resync_attempts == 0:
+            logger.error('Sim800', 'SerialError(Resync failed)')
+            self._resync_state = None
+            self._next_event()
+            return
+
+        self._resync_attempts -= 1
+        self._resync_state = _DRAIN
+        self._timer = self.loop.call_later(RESYNC_QUIET, self._resync_confirm)
+
+    def _resync_confirm(self):
+        """
+        Writes the bare AT command once the serial interface is quiet.
+
+        :return: nothing
+        """
+
+        self.tokenizer.reset()
+        self._resync_state = _CONFIRM
+        self._timer = self.loop.call_later(RESYNC_TIMEOUT, self._resync_drain)
+        self._write('AT\r')
+
+    def _on_readable(self):
+        """
+        Gets called by the event loop when the serial interface has data.
+
+        :return: nothing
+        """
+
+        try:
+            data = os.read(self._fileno(), 1024)
+        except BlockingIOError:
+            return
+
+        if not data:
+            return
+
+        logger.debug('Sim800', 'Received data from serial interface: ' + str(data))
+
+        self._received(data)
+
+        # Discard everything until the line is quiet, e.g. the rest of a late response
+        if self._resync_state == _DRAIN:
+            self._cancel_timer()
+            self._timer = self.loop.call_later(RESYNC_QUIET, self._resync_confirm)
+            return
+
+        for token in self.tokenizer.feed(data):
+            self._on_token(token)
+
+    def _on_token(self, token):
+        """
+        Processes a token from the serial interface.
+
+        :param token: token from the serial interface
+        :return: nothing
+        """
+
+        if self._resync_state == _CONFIRM:
+            self._on_resync_token(token)
+            return
+
+        event = self._event
+
+        # If no command is processed, just check the data for an event
+        if event is None:
+            self._process_unsolicited(token)
+            return
+
+        # Verify the echo of the command if activated, result codes can arrive between the write and the echo
+        if self._awaiting_echo:
+            if token.type is TokenType.Unsolicited:
+                self._process_unsolicited(token)
+                return
+
+            self._awaiting_echo = False
+            try:
+                self._check_echo(event.command, token)
+            except SerialError as e:
+                self._fail(e)
+            return
+
+        try:
+            finished = self._process_token(event, token)
+        except SerialError as e:
+            self._fail(e)
+            return
+
+        if finished:
+            self._cancel_timer()
+            self._finish_event(event)
+            self._next_event()
+
+    def _on_resync_token(self, token):
+        """
+        Processes a token while the module is resynchronized.
+
+        :param token: token from the serial interface
+        :return: nothing
+        """
+
+        if token.type is TokenType.Ok:
+            logger.info('Sim800', 'Serial interface is in sync!')
+            self._cancel_timer()
+            self._resync_state = None
+            self._next_event()
+        elif token.type is TokenType.Unsolicited:
+            self._process_unsolicited(token)
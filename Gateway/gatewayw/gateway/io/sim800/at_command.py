@@ -1,4 +1,22 @@
-from gateway.io.sim800.at_parser import ATParser
+from enum import IntEnum
+
+from gateway.io.sim800.at_parser import PARSERS
+
+
+# Time in seconds the module has to answer a command
+DEFAULT_TIMEOUT = 10
+
+
+class Priority(IntEnum):
+    """
+    Enum for the priority class of a command.
+
+    Commands with a lower value are written first.
+    """
+
+    CallControl = 0
+    Interactive = 1
+    Background = 2
 
 
 class ATCommand:
@@ -6,23 +24,31 @@ class ATCommand:
     Represents an AT-Command that gets send to the sim module.
     """
 
-    def __init__(self, command, name='', data=None, parser=ATParser()):
+    def __init__(self, command, name='', data=None, parser=None, priority=Priority.Interactive,
+                 timeout=DEFAULT_TIMEOUT):
         """
         Construct a new 'Command' object.
 
         :param command: actual at-command
         :param name: name of the event that gets emitted
         :param data: additional data that gets send if prompted
+        :param parser: parser of the response, defaults to the registered parser of the response prefix
+        :param priority: priority class of the command
+        :param timeout: time in seconds the module has to answer the command
         :type command: str
         :type name: str
         :type data: str
+        :type priority: Priority
+        :type timeout: float
         :return: returns nothing
         """
 
         self.command = command
         self.name = name
         self.data = data
-        self.parser = parser
+        self.parser = parser or PARSERS.for_command(command)
+        self.priority = priority
+        self.timeout = timeout
 
     def __str__(self):
         """
@@ -32,4 +58,5 @@ class ATCommand:
         :rtype: str
         """
 
-        return 'Name: {}\nCommand: {}\nData: {}'.format(self.name, self.command, self.data)
+        return 'Name: {}\nCommand: {}\nData: {}\nPriority: {}'.format(self.name, self.command, self.data,
+                                                                     self.priority.name)
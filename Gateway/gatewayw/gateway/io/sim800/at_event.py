@@ -1,4 +1,5 @@
 import asyncio
+import time
 
 
 class ATEvent(asyncio.Event):
@@ -6,16 +7,24 @@ class ATEvent(asyncio.Event):
     Event encapsulates an error and a content list.
     """
 
-    def __init__(self, name, command, error=False):
+    def __init__(self, name, command, error=False, loop=None, threadsafe=True, created=None):
         """
         Construct a new 'Event' object.
 
         :param error: error of event
+        :param loop: event loop of the tasks that are waiting for the event
+        :param threadsafe: indicates if the event gets set from another thread than the event loop
+        :param created: monotonic time the command was enqueued, defaults to now
         :type error: bool
+        :type threadsafe: bool
+        :type created: float
         :return: returns nothing
         """
         super().__init__()
 
+        self._event_loop = loop or asyncio.get_event_loop()
+        self.threadsafe = threadsafe
+
         self.error = error
         self.error_message = ''
         self.name = name
@@ -23,6 +32,20 @@ class ATEvent(asyncio.Event):
         self.content = []
         self.data = None
 
+        # Callback that gets every line of the response instead of the content, e.g. to parse a long listing
+        self.stream = None
+
+        # Monotonic times when the command was enqueued, its command was written and the first byte of the
+        # response (or the echo) was received
+        self.created = time.monotonic() if created is None else created
+        self.written_at = None
+        self.first_byte_at = None
+
+        # Number of tasks that wait for the event
+        self.waiters = 0
+        # Set if no task waits for the event anymore
+        self.cancelled = False
+
     def set(self):
         """
         Override to set the event threadsafe in the event loop.
@@ -30,7 +53,10 @@ class ATEvent(asyncio.Event):
         :return: nothing
         """
 
-        self._loop.call_soon_threadsafe(super().set)
+        if self.threadsafe:
+            self._event_loop.call_soon_threadsafe(super().set)
+        else:
+            super().set()
 
     def clear(self):
         """
@@ -39,7 +65,10 @@ class ATEvent(asyncio.Event):
         :return: nothing
         """
 
-        self._loop.call_soon_threadsafe(super().clear)
+        if self.threadsafe:
+            self._event_loop.call_soon_threadsafe(super().clear)
+        else:
+            super().clear()
 
     def __str__(self):
         """
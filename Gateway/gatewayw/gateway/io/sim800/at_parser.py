@@ -1,9 +1,45 @@
-import json
-from datetime import datetime
-
-import gateway.utils as utils
+from gateway.io.sim800 import pdu, operators
+from gateway.io.sim800.scts import parse_scts
 from gateway.io.sim800.at_response import *
-from gateway.core.config import get_config
+from gateway.utils import split_str
+
+
+class FieldSplitter:
+    """
+    Splits the fields of the lines of a response with a known prefix, e.g. +CSQ: 15,0
+
+    The prefix is cut off by its length instead of searching the colon and the fields are split by comma with
+    split_str(), which respects commas within double quotes. Create the splitter once per prefix and reuse it.
+    """
+
+    __slots__ = ('prefix', '_head', '_offset')
+
+    def __init__(self, prefix):
+        """
+        Construct a new 'FieldSplitter' object.
+
+        :param prefix: prefix of the lines without the colon e.g. +CSQ
+        :type prefix: str
+        :return: returns nothing
+        """
+
+        self.prefix = prefix
+        self._head = prefix + ': '
+        self._offset = len(self._head)
+
+    def split(self, line):
+        """
+        Splits a line into its fields.
+
+        :param line: line of the response
+        :type line: str
+        :return: list of fields, quoted fields keep their quotes
+        :rtype: list
+        """
+
+        if line.startswith(self._head):
+            return split_str(line, self._offset)
+        return split_str(line[line.index(':') + 1:].lstrip(), 0)
 
 
 class ATParser:
@@ -13,6 +49,9 @@ class ATParser:
     All custom parser should extend this class.
     """
 
+    # Splitter for the lines of the response, if the lines have a prefix
+    fields = None
+
     @staticmethod
     def parse(content):
         """
@@ -24,42 +63,337 @@ class ATParser:
         return None
 
 
+# Forms of an extended command: AT+CSQ, AT+CREG?, AT+CMGR=1 and AT+CSQ=?
+EXECUTE = ''
+READ = '?'
+WRITE = '='
+TEST = '=?'
+
+
+def command_form(command):
+    """
+    Returns the name and the form of an extended command.
+
+    :param command: at-command e.g. AT+CREG?
+    :type command: str
+    :return: tuple of the name e.g. +CREG and the form e.g. READ, the name is None for other commands
+    :rtype: tuple
+    """
+
+    if not command.startswith('AT+'):
+        return None, None
+
+    end = 3
+    while end < len(command) and command[end] not in '=?;\r\n':
+        end += 1
+
+    rest = command[end:end + 2]
+    if rest.startswith(TEST):
+        form = TEST
+    elif rest.startswith(READ):
+        form = READ
+    elif rest.startswith(WRITE):
+        form = WRITE
+    else:
+        form = EXECUTE
+
+    return command[2:end], form
+
+
+class ParserRegistry:
+    """
+    Maps the prefix of a response to the parser of the response.
+
+    Commands get the parser of their prefix only in the forms that answer with the response, e.g. AT+CPIN? is
+    answered with +CPIN: READY, but AT+CPIN=1234 only with OK. The test forms answer with the supported values.
+    """
+
+    def __init__(self):
+        """
+        Construct a new 'ParserRegistry' object.
+
+        :return: returns nothing
+        """
+
+        self._parsers = {}
+        self._forms = {}
+
+    def register(self, prefix, parser, forms=(EXECUTE, READ)):
+        """
+        Registers the parser of a response.
+
+        :param prefix: prefix of the response
+        :param parser: parser for the lines of the response
+        :param forms: forms of the command that answer with the response
+        :type prefix: bytes
+        :type forms: tuple
+        :return: the parser
+        """
+
+        self._parsers[prefix] = parser
+        self._forms[prefix] = frozenset(forms)
+        return parser
+
+    def get(self, prefix, default=ATParser):
+        """
+        Returns the parser for the prefix.
+
+        :param prefix: prefix of the response
+        :param default: parser that is returned if the prefix is not registered
+        :type prefix: bytes
+        :return: parser
+        """
+
+        return self._parsers.get(prefix, default)
+
+    def for_command(self, command, default=ATParser):
+        """
+        Returns the parser of the response to an extended command.
+
+        :param command: at-command e.g. AT+CSQ
+        :param default: parser that is returned if the command has no registered response in its form
+        :type command: str
+        :return: parser
+        """
+
+        name, form = command_form(command)
+        if name is None:
+            return default
+
+        prefix = name.encode()
+        if form not in self._forms.get(prefix, ()):
+            return default
+        return self._parsers[prefix]
+
+    def __contains__(self, prefix):
+        return prefix in self._parsers
+
+
+def _parse_text_sms(header, message):
+    """
+    Converts a listed sms in text mode to a SMS object.
+
+    :param header: header line of the sms
+    :param message: line with the message of the sms
+    :return: SMS object
+    """
+
+    data = SMSListParser.fields.split(header)
+
+    return SMS(int(data[0]), data[1][1:-1], data[2][1:-1], message,
+               address_name=data[3][1:-1] if len(data) > 3 and data[3] else None,
+               time=parse_scts(data[4][1:-1]) if len(data) > 4 and data[4] else None)
+
+
+def _parse_pdu_sms(index, status, data):
+    """
+    Converts a sms in pdu mode to a SMS object.
+
+    :param index: index of the sms in the storage
+    :param status: status of the sms as number
+    :param data: line with the pdu of the sms
+    :return: SMS object
+    """
+
+    part = pdu.decode_sms(data)
+
+    sms = SMS(index, pdu.STATUS[int(status)], part.address, part.message, time=part.time)
+    if index is not None:
+        sms.indexes = [index]
+    if part.parts > 1:
+        sms.concatenation = (part.reference, part.parts, part.part)
+
+    return sms
+
+
+def _is_pdu_header(fields):
+    # In pdu mode the status is a number instead of a quoted string
+    return fields[1].isdigit()
+
+
+class SMSJoiner:
+    """
+    Joins the parts of concatenated sms in pdu mode.
+
+    The parts are listed in the order they were received, which is not always their order in the text.
+    """
+
+    def __init__(self):
+        """
+        Construct a new 'SMSJoiner' object.
+
+        :return: returns nothing
+        """
+
+        # SMS object of the first added part and the parts by their number, by the address and concatenation
+        self._concatenated = {}
+
+    def add(self, sms):
+        """
+        Adds a sms and returns it, once all of its parts were added.
+
+        :param sms: SMS object of a single sms or of a part
+        :type sms: SMS
+        :return: the complete SMS object or None if parts are missing
+        """
+
+        if sms.concatenation is None:
+            return sms
+
+        reference, parts, number = sms.concatenation
+        key = (sms.address, reference, parts)
+        first, added = self._concatenated.setdefault(key, (sms, {}))
+        added[number] = sms
+        if len(added) < parts:
+            return None
+
+        del self._concatenated[key]
+        return self._join(first, added)
+
+    def flush(self):
+        """
+        Returns the concatenated sms of which not all parts were added.
+
+        :return: list of SMS objects
+        :rtype: list
+        """
+
+        sms = [self._join(first, added) for first, added in self._concatenated.values()]
+        self._concatenated.clear()
+        return sms
+
+    @staticmethod
+    def _join(first, added):
+        # The first added part becomes the joined sms
+        numbers = sorted(added)
+        first.indexes = [added[number].index for number in numbers]
+        first.index = first.indexes[0]
+        first.message = ''.join(added[number].message for number in numbers)
+        first.concatenation = None
+        return first
+
+
+def _parse_pdu_list(content):
+    """
+    Decodes a sms listing in pdu mode and joins the parts of concatenated sms.
+
+    :param content: lines of the listing, every second line is a pdu
+    :return: list of SMS objects
+    """
+
+    sms = []
+    listed = set()
+    joiner = SMSJoiner()
+
+    for line, data in zip(content[::2], content[1::2]):
+        header = SMSListParser.fields.split(line)
+        s = _parse_pdu_sms(int(header[0]), header[1], data)
+
+        if s.concatenation is None:
+            sms.append(s)
+            continue
+
+        # A concatenated sms is listed at the position of its first listed part, which becomes the joined sms
+        key = (s.address,) + s.concatenation[:2]
+        if key not in listed:
+            listed.add(key)
+            sms.append(s)
+        joiner.add(s)
+
+    joiner.flush()
+    return sms
+
+
 class SMSListParser(ATParser):
     """
     Parser that returns al list of SMS objects.
     """
 
+    fields = FieldSplitter('+CMGL')
+
     @staticmethod
     def parse(content):
-        sms = []
+        if content and _is_pdu_header(SMSListParser.fields.split(content[0])):
+            return _parse_pdu_list(content)
 
         # Every second line represents the information of the sms. The other line is the message of the sms.
-        for i, line in enumerate(content[::2]):
-            # Remove the command name from the string and split the data
-            data = utils.split_str(line[line.index(':') + 1:])
-            data[0] = data[0].strip()
-
-            # Add a new sms object to the list
-            s = SMS(int(data[0]), data[1][1:-1], data[2][1:-1], content[i * 2 + 1])
-            if data[3]:
-                s.address_name = data[3][1:-1]
-            if len(data) > 4 and data[4]:
-                time_str = data[4][1:-1]
-
-                # Get the index where the timezone starts
-                try:
-                    zone_index = time_str.index('-')
-                except ValueError:
-                    try:
-                        zone_index = time_str.index('+')
-                    except ValueError:
-                        zone_index = len(time_str) - 1
-
-                # Convert the timestamp to a datetime object without the timezone
-                s.time = datetime.strptime(time_str[0:zone_index], '%y/%m/%d,%H:%M:%S')
+        return [_parse_text_sms(header, message) for header, message in zip(content[::2], content[1::2])]
 
-            sms.append(s)
-        return sms
+
+class SMSStreamParser:
+    """
+    Incremental parser for sms listings, that returns every sms as soon as its lines are received.
+
+    In pdu mode the parts of a concatenated sms are held back until all of them are listed.
+    """
+
+    def __init__(self):
+        """
+        Construct a new 'SMSStreamParser' object.
+
+        :return: returns nothing
+        """
+
+        self._header = None
+        self._joiner = SMSJoiner()
+
+    def feed(self, line):
+        """
+        Adds the next line of the listing.
+
+        :param line: line of the listing
+        :type line: str
+        :return: list of SMS objects that are complete
+        :rtype: list
+        """
+
+        # Every second line represents the information of the sms. The other line is the message of the sms.
+        if self._header is None:
+            self._header = line
+            return []
+
+        header, self._header = self._header, None
+        fields = SMSListParser.fields.split(header)
+        if not _is_pdu_header(fields):
+            return [_parse_text_sms(header, line)]
+
+        sms = self._joiner.add(_parse_pdu_sms(int(fields[0]), fields[1], line))
+        return [sms] if sms is not None else []
+
+    def close(self):
+        """
+        Ends the listing and returns the concatenated sms of which not all parts were listed.
+
+        :return: list of SMS objects
+        :rtype: list
+        """
+
+        return self._joiner.flush()
+
+
+class ReadSMSParser(ATParser):
+    """
+    Parser that returns a SMS object of a read sms or None if the storage slot is empty.
+
+    The index is not part of the response, in pdu mode parts of a concatenated sms are not joined.
+    """
+
+    fields = FieldSplitter('+CMGR')
+
+    @staticmethod
+    def parse(content):
+        if not content:
+            return None
+
+        data = ReadSMSParser.fields.split(content[0])
+
+        # In pdu mode the status, the alpha and the length of the pdu precede the pdu
+        if data[0].isdigit():
+            return _parse_pdu_sms(None, data[0], content[1])
+
+        return SMS(None, data[0][1:-1], data[1][1:-1], content[1],
+                   address_name=data[2][1:-1] if len(data) > 2 and data[2] else None,
+                   time=parse_scts(data[3][1:-1]) if len(data) > 3 and data[3] else None)
 
 
 class NetworkStatusParser(ATParser):
@@ -67,17 +401,15 @@ class NetworkStatusParser(ATParser):
     Parser that returns a NetworkStatus object.
     """
 
+    fields = FieldSplitter('+CREG')
+
     @staticmethod
     def parse(content):
-        data = utils.split_str(content[0][content[0].index(':') + 1:])
-
-        status = NetworkStatus(data[0].strip(), int(data[1]))
+        data = NetworkStatusParser.fields.split(content[0])
 
         if len(data) == 4:
-            status.lac = data[2][1:-1]
-            status.ci = data[3][1:-1]
-
-        return status
+            return NetworkStatus(data[0], int(data[1]), data[2][1:-1], data[3][1:-1])
+        return NetworkStatus(data[0], int(data[1]))
 
 
 class SignalQualityParser(ATParser):
@@ -85,10 +417,12 @@ class SignalQualityParser(ATParser):
     Parser that returns a SignalQuality object.
     """
 
+    fields = FieldSplitter('+CSQ')
+
     @staticmethod
     def parse(content):
-        data = utils.split_str(content[0][content[0].index(':') + 1:])
-        return SignalQuality(data[0].strip(), data[1])
+        data = SignalQualityParser.fields.split(content[0])
+        return SignalQuality(data[0], data[1])
 
 
 class PinStatusParser(ATParser):
@@ -96,10 +430,11 @@ class PinStatusParser(ATParser):
     Parser that returns a PinStatus object.
     """
 
+    fields = FieldSplitter('+CPIN')
+
     @staticmethod
     def parse(content):
-        print(content)
-        return PINStatus(content[0][content[0].index(':') + 1:].strip())
+        return PINStatus(PinStatusParser.fields.split(content[0])[0].strip())
 
 
 class IMEIParser(ATParser):
@@ -112,25 +447,39 @@ class IMEIParser(ATParser):
         return IMEI(content[0])
 
 
+class SentSMSParser(ATParser):
+    """
+    Parser that returns the message reference of a sent sms.
+    """
+
+    fields = FieldSplitter('+CMGS')
+
+    @staticmethod
+    def parse(content):
+        if not content:
+            return None
+        return int(SentSMSParser.fields.split(content[0])[0])
+
+
 class SubscriberNumberParser(ATParser):
     """
     Parser that returns a SubscriberNumber object.
     """
 
+    fields = FieldSplitter('+CNUM')
+
     @staticmethod
     def parse(content):
-        data = utils.split_str(content[0][content[0].index(':') + 1:])
+        # The module answers with OK only, if no number is stored on the sim card
+        if not content:
+            return None
 
-        number = SubscriberNumber(data[1][1:-1], data[2])
-
-        if data[0].strip():
-            number.alpha = data[0].strip()
+        data = SubscriberNumberParser.fields.split(content[0])
 
+        alpha = data[0].strip() or None
         if len(data) == 5:
-            number.speed = data[3]
-            number.service = data[4]
-
-        return number
+            return SubscriberNumber(data[1][1:-1], data[2], alpha, data[3], data[4])
+        return SubscriberNumber(data[1][1:-1], data[2], alpha)
 
 
 class IMSIParser(ATParser):
@@ -140,25 +489,20 @@ class IMSIParser(ATParser):
 
     @staticmethod
     def parse(content):
-        mcc = content[0][:3]
-        mnc = content[0][3:5]
-        msin = content[0][5:]
-
-        with open(get_config()['DEFAULT']['apnfile']) as f:
-            data = json.load(f)
+        imsi = content[0]
+        mcc = imsi[:3]
+        index = operators.get_index()
 
-            country = None
-            iso = None
-            network = None
+        if index is None:
+            return IMSI(mcc, imsi[3:5], imsi[5:], None, None, None)
 
-            if mcc in data:
-                country = data[mcc]['country']
-                iso = data[mcc]['iso']
+        # The length of the mnc is not part of the imsi, three digit networks are tried first
+        network, country, iso = index.lookup(mcc, imsi[3:6])
+        if network is not None:
+            return IMSI(mcc, imsi[3:6], imsi[6:], network, country, iso)
 
-                if mnc in data[mcc]:
-                    network = data[mcc][mnc]
-
-            return IMSI(mcc, mnc, msin, network, country, iso)
+        network, country, iso = index.lookup(mcc, imsi[3:5])
+        return IMSI(mcc, imsi[3:5], imsi[5:], network, country, iso)
 
 
 class CallerIdentificationParser(ATParser):
@@ -166,7 +510,92 @@ class CallerIdentificationParser(ATParser):
     Parser that returns the caller number.
     """
 
+    fields = FieldSplitter('+CLIP')
+
+    @staticmethod
+    def parse(content):
+        return CallerIdentificationParser.fields.split(content[0])[0][1:-1]
+
+
+class NetworkRegistrationParser(ATParser):
+    """
+    Parser that returns a NetworkStatus object from the unsolicited result code.
+    """
+
+    fields = FieldSplitter('+CREG')
+
+    @staticmethod
+    def parse(content):
+        data = NetworkRegistrationParser.fields.split(content[0])
+
+        if len(data) == 3:
+            return NetworkStatus(None, int(data[0]), data[1][1:-1], data[2][1:-1])
+        return NetworkStatus(None, int(data[0]))
+
+
+class SMSIndicationParser(ATParser):
+    """
+    Parser that returns a SMSIndication object.
+    """
+
+    fields = FieldSplitter('+CMTI')
+
+    @staticmethod
+    def parse(content):
+        data = SMSIndicationParser.fields.split(content[0])
+        return SMSIndication(data[0][1:-1], int(data[1]))
+
+
+class IncomingSMSParser(ATParser):
+    """
+    Parser that returns a SMS object from the unsolicited result code.
+    """
+
+    fields = FieldSplitter('+CMT')
+
+    @staticmethod
+    def parse(content):
+        data = IncomingSMSParser.fields.split(content[0])
+
+        # In pdu mode only the alpha and the length of the pdu precede the pdu
+        if len(data) == 2:
+            part = pdu.decode_sms(content[1])
+            return SMS(None, SMS.Status.Unread.value, part.address, part.message, time=part.time)
+
+        return SMS(None, SMS.Status.Unread.value, data[0][1:-1], content[1],
+                   address_name=data[1][1:-1] if data[1] else None,
+                   time=parse_scts(data[2][1:-1]) if len(data) > 2 and data[2] else None)
+
+
+class SMSStatusReportParser(ATParser):
+    """
+    Parser that returns a SMSStatusReport object.
+    """
+
+    fields = FieldSplitter('+CDS')
+
     @staticmethod
     def parse(content):
-        data = utils.split_str(content[0][content[0].index(':') + 1:])
-        return data[0].strip()
+        data = SMSStatusReportParser.fields.split(content[0])
+
+        # In pdu mode only the length of the pdu precedes the pdu
+        if len(data) == 1:
+            report = pdu.decode_status_report(content[1])
+            return SMSStatusReport(report.first_octet, report.reference, report.address, str(report.address_type),
+                                   report.time, report.discharge_time, report.status)
+
+        return SMSStatusReport(int(data[0]), int(data[1]), data[2][1:-1] or None, data[3] or None,
+                               parse_scts(data[4][1:-1]), parse_scts(data[5][1:-1]), int(data[6]))
+
+
+# Parsers of the responses to the commands by the prefix of the response
+PARSERS = ParserRegistry()
+PARSERS.register(b'+CMGL', SMSListParser, forms=(EXECUTE, WRITE))
+PARSERS.register(b'+CMGR', ReadSMSParser, forms=(WRITE,))
+PARSERS.register(b'+CMGS', SentSMSParser, forms=(WRITE,))
+PARSERS.register(b'+CREG', NetworkStatusParser, forms=(READ,))
+PARSERS.register(b'+CSQ', SignalQualityParser, forms=(EXECUTE,))
+PARSERS.register(b'+CPIN', PinStatusParser, forms=(READ,))
+PARSERS.register(b'+CNUM', SubscriberNumberParser, forms=(EXECUTE,))
+PARSERS.register(b'+GSN', IMEIParser, forms=(EXECUTE,))
+PARSERS.register(b'+CIMI', IMSIParser, forms=(EXECUTE,))
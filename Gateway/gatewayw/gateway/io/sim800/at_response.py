@@ -4,10 +4,17 @@ import attr
 
 
 class ATResponse:
-    pass
+    """
+    Base class of the parsed responses.
+
+    The responses are slotted attrs classes, which need less memory than a class with a __dict__.
+    Responses that are not changed after parsing are frozen, because cached responses are shared by all callers.
+    """
+
+    __slots__ = ()
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class IMEI(ATResponse):
     """
     Wrapper class for IMEI.
@@ -16,7 +23,7 @@ class IMEI(ATResponse):
     imei = attr.ib()
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class IMSI(ATResponse):
     """
     Data class for IMSI.
@@ -43,7 +50,7 @@ class PINStatus(Enum):
     Pin2 = 'SIM PIN2'
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class NetworkStatus(ATResponse):
     """
     Data class for the network status.
@@ -65,23 +72,14 @@ class NetworkStatus(ATResponse):
         Unknown = 4
         RegisteredRoaming = 5
 
-    # Names defined like in the at-commands documentation
+    # Names defined like in the at-commands documentation, stat is converted to a Status object
     n = attr.ib()
-    stat = attr.ib()
+    stat = attr.ib(converter=Status)
     lac = attr.ib(default=None)
     ci = attr.ib(default=None)
 
-    def __attrs_post_init__(self):
-        """
-        Sets self.stat to a Status object after the initialization.
-
-        :return: nothing
-        """
-
-        self.stat = self.Status(self.stat)
-
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class SignalQuality(ATResponse):
     """
     Data class for the signal quality.
@@ -94,7 +92,7 @@ class SignalQuality(ATResponse):
     ber = attr.ib()
 
 
-@attr.s
+@attr.s(slots=True)
 class SMS(ATResponse):
     """
     Data class for a sms.
@@ -107,23 +105,19 @@ class SMS(ATResponse):
         Sent = 'STO SENT'
 
     index = attr.ib()
-    status = attr.ib()
+    # Converted to a Status object
+    status = attr.ib(converter=Status)
     address = attr.ib()
     message = attr.ib()
     address_name = attr.ib(default=None)
     time = attr.ib(default=None)
-
-    def __attrs_post_init__(self):
-        """
-        Sets status to a Status object after the initialization.
-
-        :return: nothing
-        """
-
-        self.status = self.Status(self.status)
+    # Indexes of all parts of a concatenated sms in pdu mode
+    indexes = attr.ib(default=None)
+    # Reference, number of parts and number of this part of a single part of a concatenated sms in pdu mode
+    concatenation = attr.ib(default=None)
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class SubscriberNumber(ATResponse):
     """
     Data class for subscriber number.
@@ -134,3 +128,31 @@ class SubscriberNumber(ATResponse):
     alpha = attr.ib(default=None)
     speed = attr.ib(default=None)
     service = attr.ib(default=None)
+
+
+@attr.s(slots=True, frozen=True)
+class SMSIndication(ATResponse):
+    """
+    Data class for the indication of a new sms in the storage.
+    """
+
+    storage = attr.ib()
+    index = attr.ib()
+
+
+@attr.s(slots=True, frozen=True)
+class SMSStatusReport(ATResponse):
+    """
+    Data class for the status report of a sent sms.
+
+    The attribute names are the same as in the at-commands documentation
+    (https://www.elecrow.com/download/SIM800%20Series_AT%20Command%20Manual_V1.09.pdf).
+    """
+
+    fo = attr.ib()
+    mr = attr.ib()
+    ra = attr.ib()
+    tora = attr.ib()
+    scts = attr.ib()
+    dt = attr.ib()
+    st = attr.ib()
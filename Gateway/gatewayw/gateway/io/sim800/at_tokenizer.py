@@ -0,0 +1,257 @@
+import re
+from enum import Enum
+
+
+class TokenType(Enum):
+    """
+    Enum for the kind of a token.
+    """
+
+    Line = 0
+    Ok = 1
+    Error = 2
+    Prompt = 3
+    Unsolicited = 4
+
+
+class Token:
+    """
+    A framed piece of data from the serial interface.
+
+    The data stays raw bytes and is only decoded if the text is needed.
+    """
+
+    __slots__ = ('type', 'data')
+
+    def __init__(self, type, data):
+        """
+        Construct a new 'Token' object.
+
+        :param type: kind of the token
+        :param data: line without the line terminator
+        :type type: TokenType
+        :type data: bytes
+        :return: returns nothing
+        """
+
+        self.type = type
+        self.data = data
+
+    @property
+    def text(self):
+        """
+        Decodes the data of the token.
+
+        :return: decoded data
+        :rtype: str
+        :raise UnicodeDecodeError: raises if the data is not valid utf-8
+        """
+
+        return self.data.decode('utf-8')
+
+    def __repr__(self):
+        return 'Token({}, {})'.format(self.type.name, self.data)
+
+
+# Lines that end a command
+FINAL_ERRORS = {b'+CME ERROR', b'+CMS ERROR'}
+
+# Result codes that end ATD and ATA with an error, without a call command they are unsolicited and end a call
+CALL_RESULTS = {b'NO CARRIER', b'NO DIALTONE', b'BUSY', b'NO ANSWER'}
+
+# Lines that are followed by a line of arbitrary text, e.g. the message of a sms
+BODY_PREFIXES = {b'+CMGL', b'+CMGR', b'+CMT', b'+CDS'}
+
+# Lines of BODY_PREFIXES that are only followed by a line in pdu mode, where they hold the length of the pdu alone
+PDU_BODY_PREFIXES = {b'+CDS'}
+
+# Lines that are sent by the module without a command
+UNSOLICITED = {b'RING'}
+
+PROMPT = b'> '
+
+# Result codes that are sent as numbers if numeric result codes are set with ATV0
+NUMERIC_RESULTS = {
+    b'0': b'OK',
+    b'1': b'CONNECT',
+    b'2': b'RING',
+    b'3': b'NO CARRIER',
+    b'4': b'ERROR',
+    b'6': b'NO DIALTONE',
+    b'7': b'BUSY',
+    b'8': b'NO ANSWER'
+}
+
+_command_prefix = re.compile(r'(?:^AT|;)(\+\w+)')
+_call_command = re.compile(r'^AT[AD]', re.IGNORECASE)
+
+
+def line_prefix(line):
+    """
+    Returns the prefix of a line, that is the part before the colon for extended commands
+    and the whole line otherwise.
+
+    :param line: line without the line terminator
+    :type line: bytes
+    :return: prefix of the line
+    :rtype: bytes
+    """
+
+    if line[:1] == b'+':
+        return line.partition(b':')[0]
+    return line
+
+
+def response_prefixes(command):
+    """
+    Returns the prefixes of the lines that are sent as response to the command.
+
+    ATD and ATA are answered with the result codes of the call attempt.
+
+    :param command: at-command e.g. AT+CSQ
+    :type command: str
+    :return: set of prefixes e.g. {b'+CSQ'}
+    :rtype: set
+    """
+
+    prefixes = {prefix.encode() for prefix in _command_prefix.findall(command)}
+    if _call_command.match(command):
+        prefixes |= CALL_RESULTS
+    return prefixes
+
+
+class ATTokenizer:
+    """
+    Incremental tokenizer for the data that is sent by the sim800 module.
+
+    Raw bytes get framed into final result codes, intermediate lines, the prompt char and
+    unsolicited result codes, without decoding the data.
+    """
+
+    def __init__(self, unsolicited=None):
+        """
+        Construct a new 'ATTokenizer' object.
+
+        :param unsolicited: prefixes of unsolicited result codes
+        :type unsolicited: set
+        :return: returns nothing
+        """
+
+        self.unsolicited = UNSOLICITED if unsolicited is None else unsolicited
+
+        # Prefixes of the response lines of the current command, that are no unsolicited result codes
+        self.responses = set()
+
+        # Set if the current command waits for the prompt char
+        self.expect_prompt = False
+
+        # Set if the module sends numeric result codes, which are only terminated by a carriage return.
+        # Verbose responses are still tokenized correctly in this mode.
+        self.numeric = False
+
+        self._buffer = bytearray()
+
+        # Set if the next line is the text of a sms
+        self._body = False
+
+        # Header of an unsolicited result code that is followed by the text of a sms
+        self._urc = None
+
+    def reset(self):
+        """
+        Discards all received data that is not tokenized yet.
+
+        :return: nothing
+        """
+
+        self._buffer.clear()
+        self._body = False
+        self._urc = None
+
+    def feed(self, data):
+        """
+        Adds received data and returns all tokens that are complete.
+
+        :param data: data from the serial interface
+        :type data: bytes
+        :return: list of tokens
+        :rtype: list
+        """
+
+        buffer = self._buffer
+        buffer += data
+
+        tokens = []
+        start = 0
+        while True:
+            # The prompt char is not terminated by a new line
+            if self.expect_prompt and buffer.startswith(PROMPT, start):
+                self.expect_prompt = False
+                start += len(PROMPT)
+                tokens.append(Token(TokenType.Prompt, PROMPT))
+                continue
+
+            end = buffer.find(b'\n', start)
+            if self.numeric:
+                carriage_return = buffer.find(b'\r', start, None if end < 0 else end)
+                if carriage_return >= 0:
+                    end = carriage_return
+            if end < 0:
+                break
+
+            line = bytes(buffer[start:end]).strip(b'\r')
+            start = end + 1
+
+            if line:
+                token = self._classify(line)
+                if token is not None:
+                    tokens.append(token)
+
+        del buffer[:start]
+        return tokens
+
+    def _classify(self, line):
+        """
+        Creates the token for a complete line.
+
+        :param line: line without the line terminator
+        :type line: bytes
+        :return: token of the line or None if the line is part of an unsolicited result code
+        :rtype: Token
+        """
+
+        # The text of a sms is never a result code
+        if self._body:
+            self._body = False
+
+            # Unsolicited result codes like +CMT are delivered with their text in one token
+            if self._urc is not None:
+                header, self._urc = self._urc, None
+                return Token(TokenType.Unsolicited, header + b'\r\n' + line)
+
+            return Token(TokenType.Line, line)
+
+        # Numeric result codes are translated, so they have the same meaning as the verbose ones
+        if self.numeric:
+            line = NUMERIC_RESULTS.get(line, line)
+
+        if line == b'OK':
+            return Token(TokenType.Ok, line)
+        if line == b'ERROR':
+            return Token(TokenType.Error, line)
+
+        prefix = line_prefix(line)
+
+        if prefix in FINAL_ERRORS or (prefix in CALL_RESULTS and prefix in self.responses):
+            return Token(TokenType.Error, line)
+
+        if prefix in BODY_PREFIXES and (prefix not in PDU_BODY_PREFIXES or b',' not in line):
+            self._body = True
+
+        if prefix in self.unsolicited and prefix not in self.responses:
+            if self._body:
+                self._urc = line
+                return None
+            return Token(TokenType.Unsolicited, line)
+
+        return Token(TokenType.Line, line)
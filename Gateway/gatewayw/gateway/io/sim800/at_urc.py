@@ -0,0 +1,77 @@
+import attr
+
+from gateway.io.sim800.at_parser import ATParser, CallerIdentificationParser, SMSIndicationParser, \
+    NetworkRegistrationParser, IncomingSMSParser, SMSStatusReportParser, PinStatusParser
+
+
+@attr.s(slots=True, frozen=True)
+class URC:
+    """
+    Describes an unsolicited result code, that is sent by the sim800 module without a command.
+    """
+
+    # Prefix of the line e.g. b'+CMTI' or the whole line e.g. b'RING'
+    prefix = attr.ib()
+    # Name of the event that gets emitted on the Sim800 object
+    name = attr.ib()
+    parser = attr.ib(default=ATParser)
+
+
+class URCRegistry:
+    """
+    Maps the prefix of a line to the unsolicited result code.
+    """
+
+    def __init__(self):
+        """
+        Construct a new 'URCRegistry' object.
+
+        :return: returns nothing
+        """
+
+        self._urcs = {}
+
+    def register(self, prefix, name, parser=ATParser):
+        """
+        Registers an unsolicited result code.
+
+        :param prefix: prefix of the line
+        :param name: name of the event that gets emitted
+        :param parser: parser for the lines of the result code
+        :type prefix: bytes
+        :type name: str
+        :return: the registered result code
+        :rtype: URC
+        """
+
+        urc = URC(prefix, name, parser)
+        self._urcs[prefix] = urc
+        return urc
+
+    def get(self, prefix):
+        """
+        Returns the unsolicited result code for the prefix.
+
+        :param prefix: prefix of the line
+        :type prefix: bytes
+        :return: URC or None if the prefix is not registered
+        """
+
+        return self._urcs.get(prefix)
+
+    def __contains__(self, prefix):
+        return prefix in self._urcs
+
+
+# Unsolicited result codes that are processed by default
+URCS = URCRegistry()
+URCS.register(b'RING', 'ring')
+URCS.register(b'+CLIP', 'caller_identification', CallerIdentificationParser)
+URCS.register(b'NO CARRIER', 'call_ended')
+URCS.register(b'BUSY', 'busy')
+URCS.register(b'NO ANSWER', 'no_answer')
+URCS.register(b'+CREG', 'network_status', NetworkRegistrationParser)
+URCS.register(b'+CPIN', 'pin_status', PinStatusParser)
+URCS.register(b'+CMTI', 'new_sms', SMSIndicationParser)
+URCS.register(b'+CMT', 'sms', IncomingSMSParser)
+URCS.register(b'+CDS', 'sms_status_report', SMSStatusReportParser)
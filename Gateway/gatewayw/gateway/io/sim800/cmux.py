@@ -0,0 +1,608 @@
+import fcntl
+import selectors
+import socket
+import struct
+import termios
+import threading
+import time
+from collections import deque
+
+from gateway.utils import logger
+
+
+class CMUXError(Exception):
+    pass
+
+
+# Opening and closing flag of a frame in basic option
+FLAG = 0xF9
+
+# Control fields of the frame types without the poll/final bit
+SABM = 0x2F
+UA = 0x63
+DM = 0x0F
+DISC = 0x43
+UIH = 0xEF
+
+# Poll/final bit of the control field
+PF = 0x10
+
+# Maximum number of information bytes per frame, the default of AT+CMUX on the sim800 module
+MAX_FRAME_SIZE = 127
+
+# Time in seconds the module has to answer the start of the multiplexer and the opening of a channel
+OPEN_TIMEOUT = 2
+
+# Type of the modem status command in the messages of the control channel, without the command/response bit
+MSC = 0xE1
+# Command/response bit of the type and the address of a message of the control channel
+CR = 0x02
+# Flow control bit of the v.24 signals of the modem status command, set if the sender can not accept frames
+FC = 0x02
+# V.24 signals of a channel that accepts frames: ready to communicate, ready to receive and data valid
+V24_READY = 0x8D
+
+# Received bytes that a channel holds for a stalled consumer before the module is told to stop sending on it,
+# and the bytes after which received data is dropped
+CHANNEL_BUFFER_SIZE = 16 * 1024
+CHANNEL_BUFFER_LIMIT = 64 * 1024
+
+# Time in seconds the reader waits for data before it checks if the multiplexer was stopped
+SELECT_TIMEOUT = 0.5
+
+
+def _crc_table():
+    # Reflected CRC-8 with the polynomial x^8 + x^2 + x + 1
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xE0 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def fcs(data):
+    """
+    Calculates the frame check sequence of a frame.
+
+    :param data: address, control and length field of the frame
+    :type data: bytes
+    :return: frame check sequence
+    :rtype: int
+    """
+
+    crc = 0xFF
+    for byte in data:
+        crc = _CRC_TABLE[crc ^ byte]
+    return 0xFF - crc
+
+
+def encode_msc(dlci, signals, command=True):
+    """
+    Creates the modem status command of a channel, that is sent in an UIH frame on the control channel.
+
+    :param dlci: number of the channel
+    :param signals: v.24 signals e.g. V24_READY | FC
+    :param command: indicates if the message is a command or the response to one
+    :type dlci: int
+    :type signals: int
+    :type command: bool
+    :return: the encoded message
+    :rtype: bytes
+    """
+
+    return bytes([MSC | (CR if command else 0), 2 << 1 | 0x01, dlci << 2 | CR | 0x01, signals | 0x01])
+
+
+def decode_messages(data):
+    """
+    Splits the information field of an UIH frame on the control channel into its messages.
+
+    :param data: information field
+    :type data: bytes
+    :return: list of tuples of the type without the command/response bit, the command/response bit and the value
+    :rtype: list
+    """
+
+    messages = []
+    position = 0
+    while position + 1 < len(data):
+        message_type = data[position]
+        length = data[position + 1] >> 1
+        value = data[position + 2:position + 2 + length]
+        messages.append((message_type & ~CR, bool(message_type & CR), value))
+        position += 2 + length
+    return messages
+
+
+def encode_frame(dlci, control, data=b'', command=True):
+    """
+    Creates a frame in basic option.
+
+    :param dlci: number of the channel
+    :param control: control field e.g. UIH
+    :param data: information field
+    :param command: indicates if the frame is a command or a response
+    :type dlci: int
+    :type control: int
+    :type data: bytes
+    :type command: bool
+    :return: the encoded frame
+    :rtype: bytes
+    """
+
+    address = (dlci << 2) | (0x02 if command else 0x00) | 0x01
+
+    if len(data) < 128:
+        length = bytes([len(data) << 1 | 0x01])
+    else:
+        length = bytes([(len(data) & 0x7F) << 1, len(data) >> 7])
+
+    header = bytes([address, control]) + length
+    return bytes([FLAG]) + header + data + bytes([fcs(header), FLAG])
+
+
+class Frame:
+    """
+    A decoded frame in basic option.
+    """
+
+    __slots__ = ('dlci', 'control', 'data')
+
+    def __init__(self, dlci, control, data):
+        """
+        Construct a new 'Frame' object.
+
+        :param dlci: number of the channel
+        :param control: control field without the poll/final bit
+        :param data: information field
+        :type dlci: int
+        :type control: int
+        :type data: bytes
+        :return: returns nothing
+        """
+
+        self.dlci = dlci
+        self.control = control
+        self.data = data
+
+    def __repr__(self):
+        return 'Frame({}, {:#04x}, {})'.format(self.dlci, self.control, self.data)
+
+
+class FrameDecoder:
+    """
+    Incremental decoder for frames in basic option.
+
+    Corrupted frames are dropped and the decoder continues with the next flag.
+    """
+
+    def __init__(self):
+        """
+        Construct a new 'FrameDecoder' object.
+
+        :return: returns nothing
+        """
+
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Adds received data and returns all frames that are complete.
+
+        :param data: data from the serial interface
+        :type data: bytes
+        :return: list of frames
+        :rtype: list
+        """
+
+        buffer = self._buffer
+        buffer += data
+
+        frames = []
+        while True:
+            # Skip everything before the opening flag and the closing flag of the previous frame
+            start = buffer.find(FLAG)
+            if start < 0:
+                buffer.clear()
+                break
+            while start + 1 < len(buffer) and buffer[start + 1] == FLAG:
+                start += 1
+            del buffer[:start]
+
+            # Flag, address, control and the first byte of the length
+            if len(buffer) < 4:
+                break
+
+            length = buffer[3] >> 1
+            header_size = 3
+            if not buffer[3] & 0x01:
+                if len(buffer) < 5:
+                    break
+                length |= buffer[4] << 7
+                header_size = 4
+
+            end = 1 + header_size + length
+            if len(buffer) < end + 2:
+                break
+
+            header = bytes(buffer[1:1 + header_size])
+            if buffer[end] != fcs(header) or buffer[end + 1] != FLAG:
+                logger.error('CMUX', 'FrameError(Invalid frame check sequence)')
+                del buffer[:1]
+                continue
+
+            frames.append(Frame(header[0] >> 2, header[1] & ~PF, bytes(buffer[1 + header_size:end])))
+
+            # Keep the closing flag, because it can be the opening flag of the next frame
+            del buffer[:end + 1]
+
+        return frames
+
+
+class CMUXChannel:
+    """
+    A virtual channel of the multiplexer, that can be used like a serial object.
+
+    The received data is provided by a socket, so the channel can be watched with a selector or the event loop.
+    The reader of the multiplexer never blocks on a channel: data that does not fit into the socket is held by
+    the channel, the module is told to stop sending on the channel while too much is held and data beyond the
+    limit is dropped.
+    """
+
+    def __init__(self, mux, dlci):
+        """
+        Construct a new 'CMUXChannel' object.
+
+        :param mux: multiplexer of the channel
+        :param dlci: number of the channel
+        :type mux: CMUX
+        :type dlci: int
+        :return: returns nothing
+        """
+
+        self.dlci = dlci
+        self.timeout = 1
+
+        self._mux = mux
+        self._socket, self._peer = socket.socketpair()
+        self._peer.setblocking(False)
+
+        # Received data that did not fit into the socket, only used by the reader of the multiplexer
+        self._pending = bytearray()
+        # Set while the module is told to stop sending on the channel
+        self.throttled = False
+
+        # Set while the module can not accept frames on the channel, the frames are held until it can again
+        self.stopped = False
+        self.held = deque()
+
+        # Set when the module confirms the opening of the channel
+        self.opened = threading.Event()
+
+    @property
+    def pending(self):
+        """
+        Number of received bytes that wait for space in the socket.
+        """
+
+        return len(self._pending)
+
+    @property
+    def baudrate(self):
+        return self._mux.serial.baudrate
+
+    @property
+    def in_waiting(self):
+        """
+        Returns the number of received bytes that are not read yet.
+
+        :return: number of bytes
+        :rtype: int
+        """
+
+        return struct.unpack('i', fcntl.ioctl(self._socket, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def read(self, size=1):
+        """
+        Reads up to size bytes and waits for them until the timeout.
+
+        :param size: maximum number of bytes
+        :type size: int
+        :return: received bytes or an empty bytes object on a timeout
+        :rtype: bytes
+        """
+
+        self._socket.settimeout(self.timeout)
+        try:
+            return self._socket.recv(size)
+        except socket.timeout:
+            return b''
+
+    def write(self, data):
+        """
+        Writes data to the channel.
+
+        :param data: data that should be written
+        :type data: bytes
+        :return: nothing
+        """
+
+        self._mux.write(self.dlci, data)
+
+    def reset_input_buffer(self):
+        """
+        Discards all received data that is not read yet.
+
+        :return: nothing
+        """
+
+        self._socket.setblocking(False)
+        try:
+            while self._socket.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def deliver(self, data):
+        """
+        Provides data that was received on the channel for reading, without waiting for the consumer.
+
+        :param data: information field of a frame
+        :type data: bytes
+        :return: nothing
+        """
+
+        if len(self._pending) + len(data) > CHANNEL_BUFFER_LIMIT:
+            logger.error('CMUX', 'BufferError(Channel {} dropped {} bytes)'.format(self.dlci, len(data)))
+            return
+
+        self._pending += data
+        self.flush()
+
+    def flush(self):
+        """
+        Moves the held data into the socket, as far as the consumer made space for it.
+
+        :return: nothing
+        """
+
+        if not self._pending:
+            return
+
+        try:
+            sent = self._peer.send(self._pending)
+        except BlockingIOError:
+            return
+        except OSError:
+            # The channel was closed
+            sent = len(self._pending)
+
+        del self._pending[:sent]
+
+    def close(self):
+        self._socket.close()
+        self._peer.close()
+
+
+class CMUX(threading.Thread):
+    """
+    GSM 07.10 multiplexer in basic option, that provides several virtual channels over one serial interface.
+
+    Each channel has its own command processing on the module, so a long command on one channel
+    does not block the commands on the other channels.
+    """
+
+    def __init__(self, serial, channels=3):
+        """
+        Construct a new 'CMUX' object.
+
+        :param serial: serial object of the module
+        :param channels: number of virtual channels
+        :type channels: int
+        :return: returns nothing
+        """
+
+        super().__init__()
+        self.daemon = True
+
+        self.serial = serial
+        self.channels = {dlci: CMUXChannel(self, dlci) for dlci in range(1, channels + 1)}
+
+        self._control = CMUXChannel(self, 0)
+        self._decoder = FrameDecoder()
+        self._write_lock = threading.Lock()
+        self._running = False
+        # Watches the serial interface and the channels that hold data, only used by the reader
+        self._selector = None
+
+    def start(self):
+        """
+        Switches the module to the multiplexer mode and opens all channels.
+
+        :return: nothing
+        :raise CMUXError: raises if the module does not start the multiplexer or does not open a channel
+        """
+
+        self._start_multiplexer()
+
+        self._running = True
+        super().start()
+
+        for channel in [self._control] + list(self.channels.values()):
+            self._send(channel.dlci, SABM | PF)
+            if not channel.opened.wait(OPEN_TIMEOUT):
+                raise CMUXError('Channel {} was not opened'.format(channel.dlci))
+
+        logger.info('CMUX', 'Opened {} channels!'.format(len(self.channels)))
+
+    def _start_multiplexer(self):
+        """
+        Writes AT+CMUX=0 and waits for the OK of the module.
+
+        :return: nothing
+        :raise CMUXError: raises if the module does not answer with OK
+        """
+
+        self.serial.reset_input_buffer()
+        self.serial.write(b'AT+CMUX=0\r')
+
+        response = b''
+        deadline = time.monotonic() + OPEN_TIMEOUT
+        while time.monotonic() < deadline:
+            response += self.serial.read(self.serial.in_waiting or 1)
+            if b'OK\r\n' in response:
+                return
+            if b'ERROR' in response:
+                break
+
+        raise CMUXError('Module did not start the multiplexer: {}'.format(response))
+
+    def stop(self):
+        """
+        Closes all channels and returns the module to the normal mode.
+
+        :return: nothing
+        """
+
+        if not self._running:
+            return
+
+        # Closing the control channel closes the multiplexer on the module
+        for dlci in list(self.channels) + [0]:
+            self._send(dlci, DISC | PF)
+
+        self._running = False
+        self.join(2)
+
+        for channel in [self._control] + list(self.channels.values()):
+            channel.close()
+
+    def write(self, dlci, data):
+        """
+        Writes data to a channel, split into frames of the maximum frame size.
+
+        :param dlci: number of the channel
+        :param data: data that should be written
+        :type dlci: int
+        :type data: bytes
+        :return: nothing
+        """
+
+        channel = self.channels.get(dlci)
+
+        for start in range(0, len(data), MAX_FRAME_SIZE):
+            # The frames are held while the module can not accept frames on the channel
+            with self._write_lock:
+                if channel is not None and (channel.stopped or channel.held):
+                    channel.held.append(data[start:start + MAX_FRAME_SIZE])
+                    continue
+            self._send(dlci, UIH, data[start:start + MAX_FRAME_SIZE])
+
+    def _send(self, dlci, control, data=b'', command=True):
+        frame = encode_frame(dlci, control, data, command)
+        logger.debug('CMUX', 'Wrote frame: ' + str(frame))
+
+        with self._write_lock:
+            self.serial.write(frame)
+
+    def _process_control(self, data):
+        """
+        Processes the messages of an UIH frame on the control channel.
+
+        The modem status command of the module sets the flow control of a channel, the held frames of the channel
+        are written once the module accepts frames again.
+
+        :param data: information field of the frame
+        :type data: bytes
+        :return: nothing
+        """
+
+        for message_type, command, value in decode_messages(data):
+            if message_type != MSC or not command or len(value) < 2:
+                # Responses to our commands and other messages need no answer
+                continue
+
+            self._send(0, UIH, encode_msc(value[0] >> 2, value[1] & ~0x01, command=False))
+
+            channel = self.channels.get(value[0] >> 2)
+            if channel is None:
+                continue
+
+            with self._write_lock:
+                channel.stopped = bool(value[1] & FC)
+                logger.info('CMUX', 'Channel {} {}'.format(channel.dlci, 'stopped' if channel.stopped else 'resumed'))
+                held = [] if channel.stopped else list(channel.held)
+                channel.held.clear()
+
+            for data in held:
+                self._send(channel.dlci, UIH, data)
+
+    def _update_flow(self, channel):
+        """
+        Tells the module to stop or resume sending on a channel, depending on the data it holds for its consumer,
+        and watches the channel until its consumer made space for the data.
+
+        :param channel: channel that received or flushed data
+        :return: nothing
+        """
+
+        throttle = channel.pending >= CHANNEL_BUFFER_SIZE
+        if throttle != channel.throttled:
+            channel.throttled = throttle
+            self._send(0, UIH, encode_msc(channel.dlci, V24_READY | (FC if throttle else 0)))
+
+        key = self._selector.get_map().get(channel._peer.fileno())
+        if channel.pending and key is None:
+            self._selector.register(channel._peer, selectors.EVENT_WRITE, channel)
+        elif not channel.pending and key is not None:
+            self._selector.unregister(channel._peer)
+
+    def _process_frame(self, frame):
+        """
+        Delivers the data of a frame to its channel.
+
+        :param frame: received frame
+        :return: nothing
+        """
+
+        channel = self.channels.get(frame.dlci, self._control if frame.dlci == 0 else None)
+        if channel is None:
+            logger.error('CMUX', 'FrameError(Unknown channel {})'.format(frame.dlci))
+            return
+
+        if frame.control == UA:
+            channel.opened.set()
+        elif frame.control == DM:
+            logger.error('CMUX', 'FrameError(Channel {} was refused)'.format(frame.dlci))
+        elif frame.control == UIH and frame.dlci == 0:
+            self._process_control(frame.data)
+        elif frame.control == UIH:
+            channel.deliver(frame.data)
+            self._update_flow(channel)
+
+    def run(self):
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.serial.fileno(), selectors.EVENT_READ)
+
+        try:
+            while self._running:
+                for key, _ in self._selector.select(SELECT_TIMEOUT):
+                    # The consumer of a channel made space for the data it holds
+                    if key.data is not None:
+                        key.data.flush()
+                        self._update_flow(key.data)
+                        continue
+
+                    data = self.serial.read(self.serial.in_waiting or 1)
+                    for frame in self._decoder.feed(data):
+                        self._process_frame(frame)
+        finally:
+            self._selector.close()
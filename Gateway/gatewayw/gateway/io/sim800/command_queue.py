@@ -0,0 +1,93 @@
+import threading
+from collections import deque
+from queue import Empty, Full
+
+from gateway.io.sim800.at_command import Priority
+
+
+class CommandQueue:
+    """
+    Threadsafe queue that returns the events ordered by the priority of their command.
+
+    Events with the same priority are returned in the order they were queued. Every priority class can be
+    limited to a number of queued events, events that nobody waits for anymore do not count.
+    """
+
+    def __init__(self, limits=None):
+        """
+        Construct a new 'CommandQueue' object.
+
+        :param limits: dict that maps a priority class to the number of events that can be queued,
+                       classes without a limit are unbounded
+        :type limits: dict
+        :return: returns nothing
+        """
+
+        self.limits = limits or {}
+        self._queues = [deque() for _ in Priority]
+        self._lock = threading.Lock()
+
+    def put(self, event):
+        """
+        Adds the event to the queue of its priority.
+
+        :param event: event with an ATCommand
+        :return: nothing
+        :raise Full: raises if the priority class of the event is full
+        """
+
+        priority = event.command.priority
+        with self._lock:
+            queue = self._queues[priority]
+            limit = self.limits.get(priority)
+
+            if limit is not None and len(queue) >= limit:
+                # Cancelled events would only be skipped by the serial loop
+                live = [queued for queued in queue if not queued.cancelled]
+                if len(live) >= limit:
+                    raise Full
+                queue.clear()
+                queue.extend(live)
+
+            queue.append(event)
+
+    put_nowait = put
+
+    def get(self):
+        """
+        Removes and returns the event with the highest priority.
+
+        :return: event
+        :raise Empty: raises if no event is queued
+        """
+
+        with self._lock:
+            for queue in self._queues:
+                if queue:
+                    return queue.popleft()
+
+        raise Empty
+
+    get_nowait = get
+
+    def empty(self):
+        """
+        :return: boolean that indicates if no event is queued
+        """
+
+        return not any(self._queues)
+
+    def qsize(self):
+        """
+        :return: number of queued events
+        """
+
+        return sum(len(queue) for queue in self._queues)
+
+    def depth(self, priority):
+        """
+        :param priority: priority class
+        :return: number of queued events with the priority
+        """
+
+        return len(self._queues[priority])
@@ -0,0 +1,657 @@
+import argparse
+import os
+import sys
+import threading
+import time
+import tty
+from datetime import datetime
+
+import attr
+
+from gateway.io.sim800 import pdu
+
+
+# Codes of +CME ERROR and +CMS ERROR that are sent by the emulator
+CME_INCORRECT_PASSWORD = 16
+CME_UNKNOWN = 100
+CMS_INVALID_INDEX = 321
+CMS_UNKNOWN = 500
+
+# Final result codes of ATD and ATA, that end a call attempt, and their numeric codes
+CALL_RESULTS = {'NO CARRIER': 3, 'NO DIALTONE': 6, 'BUSY': 7, 'NO ANSWER': 8}
+
+# Commands that answer errors with +CMS ERROR instead of +CME ERROR
+SMS_COMMANDS = {'+CMGS', '+CMGR', '+CMGL', '+CMGD'}
+
+# Filters of AT+CMGL in text mode and the status numbers of the pdu mode
+TEXT_FILTERS = {'"ALL"': None, '"REC UNREAD"': 'REC UNREAD', '"REC READ"': 'REC READ'}
+PDU_FILTERS = {'4': None, '0': 'REC UNREAD', '1': 'REC READ'}
+
+
+class CommandError(Exception):
+    """
+    Raised by a command of the emulator, that is answered with an error.
+    """
+
+    def __init__(self, code=None):
+        """
+        Construct a new 'CommandError' object.
+
+        :param code: code of the +CME ERROR or +CMS ERROR, None for a plain ERROR
+        :type code: int
+        :return: returns nothing
+        """
+
+        super().__init__(code)
+        self.code = code
+
+
+class CallError(CommandError):
+    """
+    Raised by ATD and ATA, if the call attempt fails with a result code like BUSY.
+    """
+
+    def __init__(self, result):
+        """
+        Construct a new 'CallError' object.
+
+        :param result: result code e.g. NO CARRIER
+        :type result: str
+        :return: returns nothing
+        """
+
+        super().__init__()
+        self.result = result
+
+
+@attr.s(slots=True)
+class StoredSMS:
+    """
+    Data class for a sms in the storage of the emulator. Long texts are stored as one part per index.
+    """
+
+    status = attr.ib()
+    number = attr.ib()
+    # Text of the part
+    text = attr.ib()
+    time = attr.ib()
+    # SMS-DELIVER pdu without the smsc and the hex string that is listed in pdu mode
+    length = attr.ib()
+    pdu = attr.ib()
+
+
+def _encode_semi_octets(value):
+    return (value % 10) << 4 | value // 10
+
+
+def _encode_timestamp(time):
+    """
+    Encodes a datetime as service centre timestamp of a pdu.
+
+    :param time: datetime with timezone
+    :return: timestamp of 7 octets
+    :rtype: bytes
+    """
+
+    quarters = int(time.utcoffset().total_seconds()) // 900
+    zone = _encode_semi_octets(abs(quarters)) | (0x08 if quarters < 0 else 0x00)
+
+    return bytes(_encode_semi_octets(value) for value in (time.year % 100, time.month, time.day, time.hour,
+                                                          time.minute, time.second)) + bytes([zone])
+
+
+def format_scts(time):
+    """
+    Formats a datetime as service centre timestamp of the text mode.
+
+    :param time: datetime with timezone
+    :return: timestamp e.g. 19/03/14,12:30:45+04
+    :rtype: str
+    """
+
+    quarters = int(time.utcoffset().total_seconds()) // 900
+    return time.strftime('%y/%m/%d,%H:%M:%S') + '{:+03d}'.format(quarters)
+
+
+def encode_deliver(number, text, time, reference=0):
+    """
+    Encodes a received sms as SMS-DELIVER pdus, like the module stores them.
+
+    :param number: phone number of the sender
+    :param text: text of the sms
+    :param time: datetime with timezone when the sms was received
+    :param reference: reference number of a concatenated sms
+    :return: list of tuples with the length of the pdu without the smsc and the pdu as hex string
+    :rtype: list
+    """
+
+    timestamp = _encode_timestamp(time)
+
+    pdus = []
+    for _, submit in pdu.encode_sms(number, text, reference):
+        tpdu = bytes.fromhex(submit[2:])
+
+        # The submit has the message reference before the address and no validity period after the coding scheme
+        address_end = 2 + 2 + (tpdu[2] + 1) // 2
+        first_octet = pdu.MTI_DELIVER | 0x04 | (tpdu[0] & 0x40)
+        deliver = bytes([first_octet]) + tpdu[2:address_end + 2] + timestamp + tpdu[address_end + 2:]
+
+        pdus.append((len(deliver), '00' + deliver.hex().upper()))
+
+    return pdus
+
+
+class Emulator(threading.Thread):
+    """
+    Emulates a sim800 module on a pseudo-terminal, that can be opened by 'Sim800(serial_port=...)'.
+
+    The commands that are used by the Sim800 class are answered from the state of the emulator: echo, numeric
+    result codes, error mode, sms mode, pin, sms storage, the sent sms and the call. ATA without an incoming call
+    fails with NO CARRIER and ATD fails with the result code of the number in call_results, e.g. BUSY. Commands can
+    be batched with a semicolon.
+    Unknown commands are answered with OK. Fixed responses for single commands can be configured and win over
+    the state.
+
+    Every command is answered after the latency. If a baud rate is set, the answers are paced like on a serial
+    line with 10 bits per byte, AT+IPR changes the rate. Unsolicited result codes, incoming sms and error storms
+    are injected from other threads.
+    """
+
+    def __init__(self, responses=None, echo=True, latency=0, numeric=False, send_latency=0, baudrate=None,
+                 pin=None, capacity=30):
+        """
+        Construct a new 'Emulator' object.
+
+        :param responses: dict that maps a command to the lines of its response
+        :param echo: indicates if commands get echoed
+        :param latency: time in seconds before a command is answered
+        :param numeric: indicates if numeric result codes are sent
+        :param send_latency: time in seconds the network needs to accept a sms
+        :param baudrate: baud rate the answers are paced with, None sends them at once
+        :param pin: pin of the sim card, None if the sim card is not locked
+        :param capacity: number of sms the storage holds
+        :type responses: dict
+        :type echo: bool
+        :type latency: float
+        :type numeric: bool
+        :type send_latency: float
+        :type baudrate: int
+        :type pin: str
+        :type capacity: int
+        """
+
+        super().__init__()
+        self.daemon = True
+
+        self.responses = responses or {}
+        self.echo = echo
+        self.latency = latency
+        self.numeric = numeric
+        self.send_latency = send_latency
+        self.baudrate = baudrate
+        self.pin = pin
+        self.capacity = capacity
+
+        self.error_mode = 0
+        self.sms_mode = 0
+        self.caller_identification = False
+        self.unlocked = pin is None
+
+        self.imei = '861234567890123'
+        self.imsi = '232011234567890'
+        self.number = '+436501234567'
+        self.signal = (15, 0)
+        self.registration = 1
+        # Mode of AT+CREG, +CREG is only sent on a change of the registration if it is set
+        self.registration_mode = 0
+
+        # Result codes of dialed numbers that fail e.g. {'+436501234567': 'BUSY'}
+        self.call_results = {}
+        # Set while a call rings or is active
+        self.ringing = False
+        self.in_call = False
+
+        # Stored sms by index and the sms that were sent with AT+CMGS, as number and text or as pdu
+        self.storage = {}
+        self.sent_sms = []
+
+        # Number of commands that are answered with an error and the code of the error
+        self._storm = 0
+        self._storm_code = None
+        self._reference = 0
+        self._next_baudrate = None
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+
+        # Port that can be opened by 'Sim800(serial_port=...)'
+        self.port = os.ttyname(self._slave)
+
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+
+    @property
+    def sent(self):
+        """
+        Number of sms that were sent with AT+CMGS.
+        """
+
+        return len(self.sent_sms)
+
+    def close(self):
+        """
+        Stops the emulator and closes the pseudo-terminal.
+
+        :return: nothing
+        """
+
+        self._running.set()
+        os.close(self._slave)
+
+    def _write(self, data):
+        """
+        Writes data to the pseudo-terminal, paced by the baud rate.
+
+        :param data: data that gets written
+        :type data: bytes
+        :return: nothing
+        """
+
+        with self._lock:
+            if self.baudrate:
+                time.sleep(len(data) * 10 / self.baudrate)
+            try:
+                os.write(self._master, data)
+            except OSError:
+                pass
+
+    def inject(self, line):
+        """
+        Sends an unsolicited line.
+
+        :param line: line without the line terminators e.g. RING
+        :type line: str
+        :return: nothing
+        """
+
+        self._write(b'\r\n' + line.encode() + b'\r\n')
+
+    def ring(self, number=None):
+        """
+        Signals an incoming call with RING and +CLIP, if the caller identification is enabled.
+
+        :param number: phone number of the caller
+        :type number: str
+        :return: nothing
+        """
+
+        self.ringing = True
+
+        data = b'\r\nRING\r\n'
+        if self.caller_identification and number:
+            data += '\r\n+CLIP: "{}",145,"",0,"",0\r\n'.format(number).encode()
+        self._write(data)
+
+    def register(self, status):
+        """
+        Changes the network registration and reports it with +CREG, if the result code is enabled.
+
+        :param status: status of the registration e.g. 5 for roaming
+        :type status: int
+        :return: nothing
+        """
+
+        self.registration = status
+        if self.registration_mode:
+            self.inject('+CREG: {}'.format(status))
+
+    def receive_sms(self, number, text, time=None):
+        """
+        Stores an incoming sms and indicates every stored part with +CMTI.
+
+        :param number: phone number of the sender
+        :param text: text of the sms, long texts are stored as concatenated parts
+        :param time: datetime with timezone, defaults to now
+        :type number: str
+        :type text: str
+        :return: indexes of the stored parts
+        :rtype: list
+        :raise ValueError: raises if the storage is full
+        """
+
+        time = time or datetime.now().astimezone()
+        self._reference = (self._reference + 1) % 256
+
+        parts = encode_deliver(number, text, time, self._reference)
+        free = [index for index in range(1, self.capacity + 1) if index not in self.storage]
+        if len(free) < len(parts):
+            raise ValueError('SMS storage is full')
+
+        indexes = free[:len(parts)]
+        for index, (length, data) in zip(indexes, parts):
+            self.storage[index] = StoredSMS('REC UNREAD', number, pdu.decode_sms(data).message, time, length, data)
+
+        self._write(b''.join('\r\n+CMTI: "SM",{}\r\n'.format(index).encode() for index in indexes))
+        return indexes
+
+    def error_storm(self, count, code=None):
+        """
+        Answers the next commands with errors.
+
+        :param count: number of commands that fail
+        :param code: code of the +CME ERROR or +CMS ERROR, defaults to unknown error
+        :type count: int
+        :type code: int
+        :return: nothing
+        """
+
+        self._storm_code = code
+        self._storm = count
+
+    def _result(self, error=None, command=''):
+        """
+        Builds the final result code.
+
+        :param error: CommandError or None for OK
+        :param command: name of the failed command
+        :return: result code
+        :rtype: bytes
+        """
+
+        if error is None:
+            return b'0\r' if self.numeric else b'\r\nOK\r\n'
+
+        if isinstance(error, CallError):
+            if self.numeric:
+                return '{}\r'.format(CALL_RESULTS[error.result]).encode()
+            return '\r\n{}\r\n'.format(error.result).encode()
+
+        if self.error_mode == 0:
+            return b'4\r' if self.numeric else b'\r\nERROR\r\n'
+
+        prefix = '+CMS ERROR' if command in SMS_COMMANDS else '+CME ERROR'
+        code = error.code if error.code is not None else (CMS_UNKNOWN if command in SMS_COMMANDS else CME_UNKNOWN)
+        line = '{}: {}\r\n'.format(prefix, code).encode()
+        return line if self.numeric else b'\r\n' + line
+
+    def _lines(self, lines):
+        if self.numeric:
+            # Information responses have no leading line break
+            return b''.join(line.encode() + b'\r\n' for line in lines)
+        return b''.join(b'\r\n' + line.encode() + b'\r\n' for line in lines)
+
+    def _answer(self, command):
+        """
+        Executes a command line and builds the answer.
+
+        :param command: command line without the carriage return e.g. AT+CSQ;+CREG?
+        :type command: bytes
+        :return: answer that gets written to the pseudo-terminal
+        :rtype: bytes
+        """
+
+        echo = command + b'\r' if self.echo else b''
+        text = command.decode()
+
+        if text in self.responses:
+            return echo + self._lines(self.responses[text]) + self._result()
+
+        lines = []
+        name = ''
+        try:
+            if self._storm:
+                self._storm -= 1
+                name = _split_command(text[2:])[0][0] if len(text) > 2 else ''
+                raise CommandError(self._storm_code)
+
+            for name, argument in _split_command(text[2:]):
+                lines += self._execute(name, argument)
+        except CommandError as e:
+            return echo + self._lines(lines) + self._result(e, name)
+
+        return echo + self._lines(lines) + self._result()
+
+    def _execute(self, name, argument):
+        """
+        Executes a single command.
+
+        :param name: name of the command e.g. +CSQ or E
+        :param argument: rest of the command e.g. ? or =1
+        :return: lines of the information response
+        :rtype: list
+        :raise CommandError: raises if the command fails
+        """
+
+        value = argument[1:] if argument.startswith('=') else argument
+
+        if name in ('E', 'V', 'Z'):
+            if name == 'E':
+                self.echo = value != '0'
+            elif name == 'V':
+                self.numeric = value == '0'
+            else:
+                self.echo, self.numeric, self.error_mode = True, False, 0
+            return []
+
+        if name == 'A':
+            if not self.ringing:
+                raise CallError('NO CARRIER')
+            self.ringing, self.in_call = False, True
+        elif name == 'D':
+            result = self.call_results.get(argument.strip())
+            if result is not None:
+                raise CallError(result)
+            self.in_call = True
+        elif name == 'H':
+            self.ringing = self.in_call = False
+
+        if name in ('', 'A', 'H', 'D', '+VTS', '+CHLD', '+CREG', '+CNMI'):
+            if name == '+CREG' and argument == '?':
+                return ['+CREG: {},{}'.format(self.registration_mode, self.registration)]
+            if name == '+CREG':
+                self.registration_mode = int(value)
+            return []
+
+        if name == '+CMEE':
+            self.error_mode = int(value)
+        elif name == '+CMGF':
+            self.sms_mode = int(value)
+        elif name == '+CLIP':
+            self.caller_identification = value == '1'
+        elif name == '+IPR':
+            # The answer is still sent with the old rate
+            if self.baudrate and int(value):
+                self._next_baudrate = int(value)
+        elif name == '+CSQ':
+            return ['+CSQ: {},{}'.format(*self.signal)]
+        elif name == '+GSN':
+            return [self.imei]
+        elif name == '+CIMI':
+            if not self.unlocked:
+                raise CommandError(CME_UNKNOWN)
+            return [self.imsi]
+        elif name == '+CNUM':
+            return ['+CNUM: "","{}",145,7,4'.format(self.number)]
+        elif name == '+CPIN':
+            if argument == '?':
+                return ['+CPIN: {}'.format('READY' if self.unlocked else 'SIM PIN')]
+            if value.strip('"') != self.pin:
+                raise CommandError(CME_INCORRECT_PASSWORD)
+            self.unlocked = True
+        elif name == '+CPOWD':
+            return ['NORMAL POWER DOWN']
+        elif name == '+CMGL':
+            return self._list_sms(value)
+        elif name == '+CMGR':
+            return self._read_sms(int(value))
+        elif name == '+CMGD':
+            index, _, flag = value.partition(',')
+            if flag == '4':
+                self.storage.clear()
+            else:
+                self.storage.pop(int(index), None)
+        elif name == '+CMUX':
+            # The multiplexer is not emulated
+            raise CommandError()
+
+        return []
+
+    def _sms_lines(self, index, sms, prefix):
+        if self.sms_mode == 1:
+            header = '"{}","{}","","{}"'.format(sms.status, sms.number, format_scts(sms.time))
+            head = '{}: {},{}'.format(prefix, index, header) if prefix == '+CMGL' else '{}: {}'.format(prefix, header)
+            lines = [head, sms.text]
+        else:
+            status = pdu.STATUS.index(sms.status)
+            head = '{}: {},{},,{}'.format(prefix, index, status, sms.length) if prefix == '+CMGL' else \
+                '{}: {},,{}'.format(prefix, status, sms.length)
+            lines = [head, sms.pdu]
+
+        # Listed and read sms are marked as read like on the module
+        if sms.status == 'REC UNREAD':
+            sms.status = 'REC READ'
+        return lines
+
+    def _list_sms(self, value):
+        filters = TEXT_FILTERS if self.sms_mode == 1 else PDU_FILTERS
+        if value not in filters:
+            raise CommandError(CMS_UNKNOWN)
+
+        lines = []
+        for index in sorted(self.storage):
+            sms = self.storage[index]
+            if filters[value] is None or sms.status == filters[value]:
+                lines += self._sms_lines(index, sms, '+CMGL')
+        return lines
+
+    def _read_sms(self, index):
+        if index < 1 or index > self.capacity:
+            raise CommandError(CMS_INVALID_INDEX)
+
+        sms = self.storage.get(index)
+        return self._sms_lines(index, sms, '+CMGR') if sms is not None else []
+
+    def _send_sms(self, command, buffer):
+        """
+        Takes the message of a sms from the buffer and confirms it.
+
+        :param command: the AT+CMGS command
+        :param buffer: received data after the prompt
+        :type command: bytes
+        :type buffer: bytes
+        :return: the rest of the buffer or None if the message is not complete yet
+        """
+
+        if b'\x1a' not in buffer:
+            return None
+
+        message, buffer = buffer.split(b'\x1a', 1)
+        time.sleep(self.send_latency)
+
+        argument = command.decode()[len('AT+CMGS='):]
+        if self.sms_mode == 1:
+            self.sent_sms.append((argument.strip('"'), message.decode()))
+        else:
+            self.sent_sms.append(message.decode())
+
+        answer = message if self.echo else b''
+        self._write(answer + self._lines(['+CMGS: {}'.format(self.sent % 256)]) + self._result())
+        return buffer
+
+    def run(self):
+        buffer = b''
+        prompted = None
+        while not self._running.is_set():
+            try:
+                buffer += os.read(self._master, 1024)
+            except OSError:
+                break
+
+            if prompted is not None:
+                rest = self._send_sms(prompted, buffer)
+                if rest is None:
+                    continue
+                buffer, prompted = rest, None
+
+            while b'\r' in buffer:
+                command, buffer = buffer.split(b'\r', 1)
+                command = command.strip()
+                if not command:
+                    continue
+
+                if self.latency:
+                    time.sleep(self.latency)
+
+                if command.startswith(b'AT+CMGS=') and not self._storm:
+                    self._write((command + b'\r' if self.echo else b'') + b'\r\n> ')
+                    rest = self._send_sms(command, buffer)
+                    if rest is None:
+                        prompted = command
+                        break
+                    buffer = rest
+                    continue
+
+                self._write(self._answer(command))
+
+                if self._next_baudrate:
+                    self.baudrate, self._next_baudrate = self._next_baudrate, None
+
+        os.close(self._master)
+
+
+def _split_command(text):
+    """
+    Splits the commands of a command line without the AT prefix into their names and arguments.
+
+    :param text: command line e.g. +CSQ;+CREG?;E0
+    :type text: str
+    :return: list of tuples of the name and the argument e.g. [('+CSQ', ''), ('+CREG', '?'), ('E', '0')]
+    :rtype: list
+    """
+
+    commands = []
+    for command in text.split(';'):
+        if command.startswith('+'):
+            end = 1
+            while end < len(command) and command[end] not in '=?':
+                end += 1
+            commands.append((command[:end], command[end:]))
+        elif command:
+            commands.append((command[0], command[1:]))
+
+    return commands or [('', '')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SIM800 emulator on a pseudo-terminal.')
+    parser.add_argument('--latency', type=float, default=0, help='seconds before a command is answered')
+    parser.add_argument('--send-latency', type=float, default=0, help='seconds the network needs per sms')
+    parser.add_argument('--baudrate', '-b', type=int, default=None, help='baud rate the answers are paced with')
+    parser.add_argument('--pin', default=None, help='pin of the emulated sim card')
+    args = parser.parse_args()
+
+    emulator = Emulator(latency=args.latency, send_latency=args.send_latency, baudrate=args.baudrate, pin=args.pin)
+    emulator.start()
+
+    print(emulator.port)
+    print('Commands: ring [number] | sms <number> <text> | storm <count> [code] | urc <line>')
+    sys.stdout.flush()
+
+    for line in sys.stdin:
+        command, _, argument = line.strip().partition(' ')
+        if command == 'ring':
+            emulator.ring(argument or None)
+        elif command == 'sms':
+            number, _, text = argument.partition(' ')
+            print(emulator.receive_sms(number, text))
+        elif command == 'storm':
+            count, _, code = argument.partition(' ')
+            emulator.error_storm(int(count), int(code) if code else None)
+        elif command == 'urc':
+            emulator.inject(argument)
+
+    emulator.close()
+
+
+if __name__ == '__main__':
+    main()
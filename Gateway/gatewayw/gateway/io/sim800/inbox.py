@@ -0,0 +1,168 @@
+import asyncio
+
+from gateway.io.sim800.at_parser import SMSJoiner
+from gateway.io.sim800.at_response import SMS
+from gateway.utils import logger
+
+
+class Inbox:
+    """
+    Keeps the received sms in sync with a server, one storage slot at a time.
+
+    Every +CMTI indication costs a single AT+CMGR of the new index instead of a listing of the whole storage.
+    After the upload of a sms is confirmed, its storage slots are deleted, so the storage does not fill up.
+    Parts of a concatenated sms in pdu mode are held back until all of them were read.
+    """
+
+    def __init__(self, sim, upload):
+        """
+        Construct a new 'Inbox' object.
+
+        :param sim: Sim800 object
+        :param upload: coroutine function that gets a SMS object and returns if the server confirmed it
+        :type upload: function
+        :return: returns nothing
+        """
+
+        self.sim = sim
+        self.upload = upload
+
+        # Storage slots that were seen and not deleted yet, mapped to their sms or None while it is read
+        self.slots = {}
+        # Storage slots of uploaded sms, that could not be deleted
+        self.uploaded = set()
+
+        self._joiner = SMSJoiner()
+        self._lock = asyncio.Lock()
+
+    def start(self):
+        """
+        Starts to process the +CMTI indications of the module.
+
+        :return: nothing
+        """
+
+        self.sim.on('new_sms', self._on_new_sms)
+
+    def stop(self):
+        """
+        Stops to process the +CMTI indications of the module.
+
+        :return: nothing
+        """
+
+        self.sim.remove_listener('new_sms', self._on_new_sms)
+
+    async def _on_new_sms(self, indication):
+        await self.receive(indication.index)
+
+    async def receive(self, index):
+        """
+        Reads the sms at a new index of the storage and uploads it.
+
+        :param index: index of the sms in the storage
+        :type index: int
+        :return: nothing
+        """
+
+        # The indication of a slot that is already processed is a duplicate
+        if index in self.slots:
+            return
+        self.slots[index] = None
+
+        event = await self.sim.read_sms(index)
+        if event.error or event.data is None:
+            logger.error('Inbox', 'ReadSMSError({})'.format(event.error_message or 'Empty slot {}'.format(index)))
+            del self.slots[index]
+            return
+
+        self.slots[index] = event.data
+
+        sms = self._joiner.add(event.data)
+        if sms is not None:
+            await self._upload(sms)
+
+    async def sync(self):
+        """
+        Uploads the sms whose upload failed and all sms of the storage that were not seen yet.
+
+        Should be called at the start, because sms that were received while the gateway was not running
+        are not indicated again, and from time to time to retry failed uploads.
+
+        :return: nothing
+        """
+
+        for index in list(self.uploaded):
+            await self._delete(index)
+
+        for sms in self._joiner.flush():
+            await self._upload(sms)
+
+        for sms in [sms for index, sms in self.slots.items()
+                    if sms is not None and sms.index == index and index not in self.uploaded]:
+            await self._upload(sms)
+
+        # Only received sms are uploaded, stored drafts and sent sms stay in the storage. The read sms are listed
+        # first, because listing the unread ones marks them as read.
+        listed = []
+        for status in (SMS.Status.Read, SMS.Status.Unread):
+            async for sms in self.sim.iter_sms(status):
+                if not any(index in self.slots for index in sms.indexes or [sms.index]):
+                    listed.append(sms)
+
+        for sms in listed:
+            for index in sms.indexes or [sms.index]:
+                self.slots[index] = sms
+            await self._upload(sms)
+
+    async def _upload(self, sms):
+        """
+        Uploads a sms and deletes its storage slots once the upload is confirmed.
+
+        :param sms: SMS object
+        :return: boolean that indicates if the sms was uploaded
+        """
+
+        indexes = sms.indexes or [sms.index]
+
+        # The joined sms of a concatenated sms is known by all of its slots
+        for index in indexes:
+            self.slots[index] = sms
+
+        # Uploads of the same sms from a sync and an indication must not overlap
+        async with self._lock:
+            if self.slots.get(indexes[0]) is not sms or indexes[0] in self.uploaded:
+                return True
+
+            try:
+                confirmed = await self.upload(sms)
+            except Exception as e:
+                logger.error('Inbox', 'UploadError({})'.format(e))
+                confirmed = False
+
+            if not confirmed:
+                logger.error('Inbox', 'UploadError(Sms {} is kept in the storage)'.format(sms.index))
+                return False
+
+            self.uploaded.update(indexes)
+            for index in indexes:
+                await self._delete(index)
+
+        logger.info('Inbox', 'Uploaded sms {}'.format(sms.index))
+        return True
+
+    async def _delete(self, index):
+        """
+        Deletes the storage slot of an uploaded sms.
+
+        :param index: index of the sms in the storage
+        :return: nothing
+        """
+
+        event = await self.sim.delete_sms(index)
+        if event.error:
+            logger.error('Inbox', 'DeleteSMSError({})'.format(event.error_message))
+            return
+
+        self.uploaded.discard(index)
+        self.slots.pop(index, None)
@@ -0,0 +1,256 @@
+import threading
+import time
+
+from gateway.io.sim800.at_command import Priority
+from gateway.io.sim800.serial_loop import EchoError, ResponseTimeout
+
+
+# Number of bits of a value that are kept exactly, the relative error of a recorded value is below 1 / 2 ** (BITS - 1)
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_BUCKETS = SUB_BUCKETS >> 1
+
+# Largest value in microseconds that is recorded exactly enough, larger values are counted in the last bucket
+MAX_VALUE = 1 << 36
+
+# Percentiles of the latencies in a snapshot
+PERCENTILES = (50, 90, 99)
+
+
+def _bucket(value):
+    """
+    Returns the index of the bucket of a value. Values below SUB_BUCKETS have a bucket each, larger values share
+    a bucket with the values that have the same SUB_BUCKET_BITS highest bits.
+    """
+
+    if value < SUB_BUCKETS:
+        return value
+
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return (shift + 1) * HALF_BUCKETS + (value >> shift) - HALF_BUCKETS
+
+
+def _lowest(index):
+    """
+    Returns the lowest value of a bucket.
+    """
+
+    if index < SUB_BUCKETS:
+        return index
+
+    shift = index // HALF_BUCKETS - 1
+    return (index % HALF_BUCKETS + HALF_BUCKETS) << shift
+
+
+class Histogram:
+    """
+    Latency histogram with logarithmic buckets like a HdrHistogram.
+
+    The values are recorded in microseconds with a relative error of about 3%, so a value costs an
+    increment and the memory does not grow with the number of values.
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        """
+        Construct a new 'Histogram' object.
+
+        :return: returns nothing
+        """
+
+        self.counts = [0] * (_bucket(MAX_VALUE) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        """
+        Records a latency.
+
+        :param seconds: latency in seconds
+        :type seconds: float
+        :return: nothing
+        """
+
+        value = min(max(int(seconds * 1e6), 0), MAX_VALUE)
+        self.counts[_bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile):
+        """
+        Returns the latency below which the percentage of the recorded latencies are.
+
+        :param percentile: percentile between 0 and 100
+        :type percentile: float
+        :return: latency in seconds, 0 if nothing was recorded
+        :rtype: float
+        """
+
+        if not self.count:
+            return 0
+
+        rank = max(1, int(self.count * percentile / 100 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(_lowest(index + 1) - 1, self.max) / 1e6
+
+        return self.max / 1e6
+
+    def as_dict(self):
+        """
+        :return: count, mean, percentiles and maximum in milliseconds
+        :rtype: dict
+        """
+
+        summary = {'count': self.count, 'mean': self.total / self.count / 1e3 if self.count else 0}
+        for percentile in PERCENTILES:
+            summary['p{}'.format(percentile)] = self.percentile(percentile) * 1e3
+        summary['max'] = self.max / 1e3
+        return summary
+
+
+class CommandMetrics:
+    """
+    Latencies and failures of the commands with the same name.
+    """
+
+    __slots__ = ('queued', 'first_byte', 'response', 'total', 'errors', 'timeouts', 'echo_errors')
+
+    def __init__(self):
+        """
+        Construct a new 'CommandMetrics' object.
+
+        :return: returns nothing
+        """
+
+        # From the write call until the command is written, from the write until the first byte and the final
+        # result code, and from the write call until the final result code
+        self.queued = Histogram()
+        self.first_byte = Histogram()
+        self.response = Histogram()
+        self.total = Histogram()
+
+        self.errors = 0
+        self.timeouts = 0
+        self.echo_errors = 0
+
+    def as_dict(self):
+        return {
+            'count': self.total.count,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'echo_errors': self.echo_errors,
+            'queued': self.queued.as_dict(),
+            'first_byte': self.first_byte.as_dict(),
+            'response': self.response.as_dict(),
+            'total': self.total.as_dict()
+        }
+
+
+class Metrics:
+    """
+    Collects the latencies of the commands by their name and the depth of the command queues.
+
+    The serial loops report every finished command once with the timestamps of its event, so the overhead
+    per command is a few histogram increments.
+    """
+
+    def __init__(self):
+        """
+        Construct a new 'Metrics' object.
+
+        :return: returns nothing
+        """
+
+        self._lock = threading.Lock()
+        self.commands = {}
+        # Current and maximal number of queued commands per priority class
+        self.queue_depths = {priority: 0 for priority in Priority}
+        self.max_queue_depths = {priority: 0 for priority in Priority}
+        self.started = time.monotonic()
+
+    def queue_depth(self, priority, depth):
+        """
+        Updates the gauge of a command queue.
+
+        :param priority: priority class of the queue
+        :param depth: number of queued commands
+        :type depth: int
+        :return: nothing
+        """
+
+        self.queue_depths[priority] = depth
+        if depth > self.max_queue_depths[priority]:
+            self.max_queue_depths[priority] = depth
+
+    def record(self, event, error=None):
+        """
+        Records the latencies of a finished command.
+
+        :param event: the finished event
+        :param error: error the command failed with or None
+        :type error: Exception
+        :return: nothing
+        """
+
+        finished = time.monotonic()
+        name = event.name or event.command.command
+
+        with self._lock:
+            metrics = self.commands.get(name)
+            if metrics is None:
+                metrics = self.commands[name] = CommandMetrics()
+
+            if event.error:
+                metrics.errors += 1
+            if isinstance(error, ResponseTimeout):
+                metrics.timeouts += 1
+            elif isinstance(error, EchoError):
+                metrics.echo_errors += 1
+
+            metrics.total.record(finished - event.created)
+            if event.written_at is not None:
+                metrics.queued.record(event.written_at - event.created)
+                metrics.response.record(finished - event.written_at)
+                if event.first_byte_at is not None:
+                    metrics.first_byte.record(event.first_byte_at - event.written_at)
+
+    def snapshot(self):
+        """
+        Returns the current state of the metrics, e.g. to log or upload it.
+
+        :return: dict with the metrics of the commands by their name and the queue gauges by priority class,
+                 latencies are in milliseconds
+        :rtype: dict
+        """
+
+        with self._lock:
+            commands = {name: metrics.as_dict() for name, metrics in self.commands.items()}
+
+        return {
+            'uptime': time.monotonic() - self.started,
+            'commands': commands,
+            'queues': {priority.name: {'depth': self.queue_depths[priority], 'max': self.max_queue_depths[priority]}
+                       for priority in Priority},
+            'errors': sum(metrics['errors'] for metrics in commands.values()),
+            'timeouts': sum(metrics['timeouts'] for metrics in commands.values()),
+            'echo_errors': sum(metrics['echo_errors'] for metrics in commands.values())
+        }
+
+    def reset(self):
+        """
+        Drops the recorded latencies and counters, the current queue depths stay.
+
+        :return: nothing
+        """
+
+        with self._lock:
+            self.commands = {}
+            self.max_queue_depths = dict(self.queue_depths)
+            self.started = time.monotonic()
@@ -0,0 +1,239 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+
+
+# The module only depends on the standard library, so the helper scripts can load it without the gateway package
+# and its compiled extensions.
+
+# The index starts with a header of the magic and the number of records. The records are sorted by their key, the
+# mcc followed by the mnc padded with spaces, so they are searched by bisection. The key of the mcc alone holds the
+# country and the iso code separated by a null byte, the key with the mnc holds the name of the network. The values
+# are stored after the records and are referenced by their offset and length.
+MAGIC = b'GWO1'
+HEADER = struct.Struct('<4sI')
+RECORD = struct.Struct('<6sIH')
+KEY_SIZE = 6
+
+
+def _key(mcc, mnc=''):
+    return (mcc + mnc).ljust(KEY_SIZE).encode('ascii')
+
+
+def merge_operator(apns, mcc, mnc, network, country=None, iso=None):
+    """
+    Adds an operator to the apn configuration. The country and iso code of a mcc are only replaced by known values,
+    so sources without them can be merged after the ones with them.
+
+    :param apns: operators by mcc like in apn-conf.json
+    :param mcc: mobile country code
+    :param mnc: mobile network code
+    :param network: name of the network
+    :param country: name of the country
+    :param iso: iso code of the country
+    :type apns: dict
+    :return: nothing
+    """
+
+    operators = apns.get(mcc)
+    if operators is None:
+        operators = apns[mcc] = {'country': None, 'iso': None}
+
+    operators[mnc] = network
+    if country is not None:
+        operators['country'] = country
+    if iso is not None:
+        operators['iso'] = iso
+
+
+def build_index(apns):
+    """
+    Converts the operators of the apn configuration to the binary index.
+
+    :param apns: operators by mcc like in apn-conf.json, e.g. {'232': {'01': 'A1', 'country': 'Austria', 'iso': 'at'}}
+    :type apns: dict
+    :return: the index
+    :rtype: bytes
+    """
+
+    entries = {}
+    for mcc, operators in apns.items():
+        entries[_key(mcc)] = '{}\0{}'.format(operators.get('country') or '', operators.get('iso') or '')
+
+        for mnc, network in operators.items():
+            if mnc not in ('country', 'iso'):
+                entries[_key(mcc, mnc)] = network or ''
+
+    records = bytearray()
+    values = bytearray()
+    offset = HEADER.size + RECORD.size * len(entries)
+    for key in sorted(entries):
+        value = entries[key].encode('utf-8')
+        records += RECORD.pack(key, offset + len(values), len(value))
+        values += value
+
+    return HEADER.pack(MAGIC, len(entries)) + records + values
+
+
+def write_index(apns, path):
+    """
+    Writes the binary index of the operators to a file. The file is replaced at once, so a running gateway never
+    maps a partly written index.
+
+    :param apns: operators by mcc like in apn-conf.json
+    :param path: path of the index
+    :type apns: dict
+    :type path: str
+    :return: nothing
+    """
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(build_index(apns))
+    os.replace(path + '.tmp', path)
+
+
+class OperatorIndex:
+    """
+    Looks up the network, country and iso code of a mcc and mnc in the binary index without loading it.
+    """
+
+    def __init__(self, buffer):
+        """
+        Construct a new 'OperatorIndex' object.
+
+        :param buffer: the index, a memory map or bytes
+        :return: returns nothing
+        :raise ValueError: raises if the buffer is no index
+        """
+
+        magic, self.count = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError('Invalid operator index')
+
+        self._buffer = buffer
+
+    @classmethod
+    def open(cls, path):
+        """
+        Maps the index file into the memory.
+
+        :param path: path of the index
+        :type path: str
+        :return: OperatorIndex object
+        """
+
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def from_json(cls, path):
+        """
+        Builds the index in the memory from the apn configuration.
+
+        :param path: path of apn-conf.json
+        :type path: str
+        :return: OperatorIndex object
+        """
+
+        with open(path) as f:
+            return cls(build_index(json.load(f)))
+
+    def _find(self, key):
+        buffer = self._buffer
+        low = 0
+        high = self.count
+
+        while low < high:
+            middle = (low + high) // 2
+            start = HEADER.size + middle * RECORD.size
+
+            if buffer[start:start + KEY_SIZE] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == self.count:
+            return None
+
+        found, offset, length = RECORD.unpack_from(buffer, HEADER.size + low * RECORD.size)
+        if found != key:
+            return None
+        return buffer[offset:offset + length].decode('utf-8')
+
+    def lookup(self, mcc, mnc):
+        """
+        Returns the operator of a mcc and mnc.
+
+        :param mcc: mobile country code e.g. 232
+        :param mnc: mobile network code e.g. 01
+        :type mcc: str
+        :type mnc: str
+        :return: tuple of the network, country and iso code, which are None if they are unknown
+        :rtype: tuple
+        """
+
+        country = self._find(_key(mcc))
+        if country is None:
+            return None, None, None
+
+        country, iso = country.split('\0')
+        network = self._find(_key(mcc, mnc)) if len(mcc) + len(mnc) <= KEY_SIZE else None
+
+        return network, country or None, iso or None
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+
+_index = None
+
+
+def get_index():
+    """
+    Returns the operator index of the configuration, that is opened at the first call.
+
+    If the index file of the option apnindex does not exist or is invalid, the index is built once from the
+    apn file.
+
+    :return: OperatorIndex object or None, if no apn file is configured
+    """
+
+    from gateway.core.config import get_config
+    from gateway.utils import logger
+
+    global _index
+
+    if _index is None:
+        config = get_config()
+        if config is None or 'apnfile' not in config['DEFAULT']:
+            return None
+
+        path = config['DEFAULT'].get('apnindex')
+        if path and os.path.exists(path):
+            try:
+                _index = OperatorIndex.open(path)
+            except (OSError, ValueError, struct.error) as e:
+                logger.error('Operators', 'IndexError({})'.format(e))
+
+        if _index is None:
+            logger.info('Operators', 'No index found, building it from {}'.format(config['DEFAULT']['apnfile']))
+            _index = OperatorIndex.from_json(config['DEFAULT']['apnfile'])
+
+    return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes the binary operator index of an apn configuration.')
+    parser.add_argument('input', help='apn configuration e.g. apn-conf.json')
+    parser.add_argument('output', help='path of the index e.g. apn-conf.idx')
+    args = parser.parse_args()
+
+    with open(args.input) as f:
+        write_index(json.load(f), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from collections import deque
+
+import attr
+
+from gateway.io.sim800.pdu import PDUError, normalize_number
+from gateway.utils import logger
+
+
+# Codes of +CMS ERROR, after which the sms is sent again, because the failure is temporary. A sms is only sent
+# again if none of its parts was accepted, otherwise the recipient would get the accepted parts twice.
+# Network out of order, temporary failure, congestion, resources unavailable, no network service,
+# network timeout and unknown error
+RETRY_CMS_ERRORS = {38, 41, 42, 47, 331, 332, 500}
+
+# Number of sent sms whose latency is kept for the percentiles
+LATENCY_SAMPLES = 1000
+
+
+@attr.s
+class OutgoingSMS:
+    """
+    Data class for a sms in the outbox.
+    """
+
+    id = attr.ib()
+    number = attr.ib()
+    text = attr.ib()
+    # Unix time the sms was put into the outbox
+    created = attr.ib()
+    attempts = attr.ib(default=0)
+
+
+class OutboxStats:
+    """
+    Counters of the outbox, to watch the throughput and the latency of the sent sms.
+    """
+
+    def __init__(self):
+        """
+        Construct a new 'OutboxStats' object.
+
+        :return: returns nothing
+        """
+
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+        # Time from putting a sms into the outbox until it was sent, of the last sent sms
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        # Monotonic times the last sms were sent
+        self._sent_times = deque(maxlen=LATENCY_SAMPLES)
+
+    def record_sent(self, latency):
+        self.sent += 1
+        self.latencies.append(latency)
+        self._sent_times.append(time.monotonic())
+
+    def throughput(self, window=60):
+        """
+        Returns the number of sms per minute that were sent within the last window.
+
+        :param window: time in seconds
+        :type window: float
+        :return: sms per minute
+        :rtype: float
+        """
+
+        start = time.monotonic() - window
+        return sum(1 for sent in self._sent_times if sent >= start) * 60 / window
+
+    def latency(self, percentile):
+        """
+        Returns a percentile of the latency of the last sent sms.
+
+        :param percentile: percentile between 0 and 100
+        :type percentile: float
+        :return: latency in seconds or None if no sms was sent
+        :rtype: float
+        """
+
+        if not self.latencies:
+            return None
+
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * percentile / 100), len(latencies) - 1)]
+
+    def as_dict(self):
+        """
+        :return: the counters in a dict
+        :rtype: dict
+        """
+
+        return {
+            'queued': self.queued,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'throughput': self.throughput(),
+            'latency_p50': self.latency(50),
+            'latency_p95': self.latency(95)
+        }
+
+
+def _cms_error(error_message):
+    """
+    Returns the code of a +CMS ERROR or None for other errors.
+
+    :param error_message: error message of the event
+    :type error_message: str
+    :return: error code
+    :rtype: int
+    """
+
+    if not error_message.startswith('+CMS ERROR:'):
+        return None
+
+    try:
+        return int(error_message[error_message.index(':') + 1:])
+    except ValueError:
+        return None
+
+
+class Outbox:
+    """
+    Queue for outgoing sms, that sends them in the background with the Sim800 object.
+
+    Only a limited number of sms is sent at the same time, so bulk sends do not crowd out other commands.
+    Sms to the same number are paced, sms that failed with a temporary error before any part was accepted
+    are sent again and pending sms are persisted, so they are sent after a restart.
+    """
+
+    def __init__(self, sim, path=None, concurrency=2, pacing=5, retries=3, retry_delay=10):
+        """
+        Construct a new 'Outbox' object.
+
+        :param sim: Sim800 object
+        :param path: path of the file the pending sms are persisted in, None to not persist them
+        :param concurrency: maximum number of sms that are sent at the same time
+        :param pacing: minimum time in seconds between two sms to the same number
+        :param retries: number of times a sms is sent again after a temporary error
+        :param retry_delay: time in seconds before the first retry, it doubles with every retry
+        :type path: str
+        :type concurrency: int
+        :type pacing: float
+        :type retries: int
+        :type retry_delay: float
+        :return: returns nothing
+        """
+
+        self.sim = sim
+        self.path = path
+        self.concurrency = concurrency
+        self.pacing = pacing
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+        self.stats = OutboxStats()
+
+        # Sms that are not sent yet by their id
+        self.pending = {}
+
+        self._queue = asyncio.Queue()
+        # Set while no sms is pending
+        self._empty = asyncio.Event()
+        self._empty.set()
+        self._ids = itertools.count(1)
+        self._workers = []
+        self._timers = set()
+
+        # Monotonic time the last sms to a number was sent
+        self._last_sent = {}
+
+    def start(self):
+        """
+        Loads the persisted sms and starts sending.
+
+        :return: nothing
+        """
+
+        for sms in self._load():
+            self.pending[sms.id] = sms
+            self._queue.put_nowait(sms.id)
+            self._empty.clear()
+
+        if self.pending:
+            logger.info('Outbox', 'Loaded {} pending sms'.format(len(self.pending)))
+            self._ids = itertools.count(max(self.pending) + 1)
+
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """
+        Stops sending, the pending sms stay persisted.
+
+        :return: nothing
+        """
+
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def put(self, number, text):
+        """
+        Puts a sms into the outbox.
+
+        :param number: phone number of the recipient
+        :param text: message of the sms
+        :type number: str
+        :type text: str
+        :return: the queued sms
+        :rtype: OutgoingSMS
+        :raise PDUError: raises if the number is invalid
+        """
+
+        sms = OutgoingSMS(next(self._ids), normalize_number(number), text, time.time())
+        self.pending[sms.id] = sms
+        self.stats.queued += 1
+        self._empty.clear()
+        self._persist()
+
+        self._queue.put_nowait(sms.id)
+        return sms
+
+    async def join(self):
+        """
+        Waits until all sms are sent or failed.
+
+        :return: nothing
+        """
+
+        await self._empty.wait()
+
+    async def _work(self):
+        while True:
+            sms = self.pending.get(await self._queue.get())
+            if sms is None:
+                continue
+
+            # Sms to a number that got one recently are queued again once the pacing passed
+            wait = self._last_sent.get(sms.number, -self.pacing) + self.pacing - time.monotonic()
+            if wait > 0:
+                self._requeue(sms, wait)
+                continue
+
+            self._last_sent[sms.number] = time.monotonic()
+            await self._send(sms)
+
+    def _requeue(self, sms, delay):
+        def put():
+            self._timers.discard(timer)
+            self._queue.put_nowait(sms.id)
+
+        timer = asyncio.get_event_loop().call_later(delay, put)
+        self._timers.add(timer)
+
+    async def _send(self, sms):
+        """
+        Sends a sms and queues it again after a temporary error.
+
+        :param sms: sms of the outbox
+        :return: nothing
+        """
+
+        # Message references of the parts that were accepted by the network
+        sent = []
+
+        sms.attempts += 1
+        try:
+            event = await self.sim.send_sms(sms.number, sms.text, sent)
+        except asyncio.CancelledError:
+            raise
+        except PDUError as e:
+            # The sms can not be encoded, so another attempt fails the same way
+            logger.error('Outbox', 'SendSMSError({})'.format(e))
+            self.stats.failed += 1
+            self._remove(sms)
+            return
+        except Exception as e:
+            # E.g. no modem of a pool is available
+            error_message = '{}({})'.format(type(e).__name__, ', '.join(str(arg) for arg in e.args))
+            self._failed(sms, error_message, temporary=not sent)
+            return
+
+        if not event.error:
+            self.stats.record_sent(time.time() - sms.created)
+            logger.info('Outbox', 'Sent sms {}'.format(sms.id))
+            self._remove(sms)
+            return
+
+        # Temporary errors of the network are worth another attempt. After a timeout the network may have accepted
+        # the part and after an accepted part another attempt would send it twice.
+        temporary = _cms_error(event.error_message) in RETRY_CMS_ERRORS and not sent
+        if sent:
+            logger.error('Outbox', 'SendSMSError(Sms {}: {} parts were sent)'.format(sms.id, len(sent)))
+        self._failed(sms, event.error_message, temporary)
+
+    def _failed(self, sms, error_message, temporary):
+        """
+        Queues a sms again after a temporary error, as long as it has attempts left, or drops it.
+
+        :param sms: sms of the outbox
+        :param error_message: error of the attempt
+        :param temporary: indicates if another attempt can succeed
+        :return: nothing
+        """
+
+        if temporary and sms.attempts <= self.retries:
+            delay = self.retry_delay * 2 ** (sms.attempts - 1)
+            logger.error('Outbox', 'SendSMSError({}, retry in {}s)'.format(error_message, delay))
+            self.stats.retries += 1
+            self._persist()
+            self._requeue(sms, delay)
+            return
+
+        logger.error('Outbox', 'SendSMSError({})'.format(error_message))
+        self.stats.failed += 1
+        self._remove(sms)
+
+    def _remove(self, sms):
+        del self.pending[sms.id]
+        if not self.pending:
+            self._empty.set()
+        self._persist()
+
+    def _load(self):
+        """
+        Reads the persisted sms.
+
+        :return: list of OutgoingSMS objects
+        """
+
+        if self.path is None or not os.path.isfile(self.path):
+            return []
+
+        try:
+            with open(self.path) as f:
+                return [OutgoingSMS(**sms) for sms in json.load(f)]
+        except (OSError, ValueError, TypeError) as e:
+            logger.error('Outbox', 'LoadError({})'.format(e))
+            return []
+
+    def _persist(self):
+        """
+        Writes the pending sms to the file, the file gets replaced so it is never written partly.
+
+        :return: nothing
+        """
+
+        if self.path is None:
+            return
+
+        try:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump([attr.asdict(sms) for sms in self.pending.values()], f)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as e:
+            logger.error('Outbox', 'PersistError({})'.format(e))
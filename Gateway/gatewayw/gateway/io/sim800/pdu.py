@@ -0,0 +1,462 @@
+from datetime import datetime
+
+import attr
+
+from gateway.io.sim800.scts import century, timezone_of
+
+
+# GSM 03.38 default alphabet, the index of a char is its septet
+GSM7_BASIC = ('@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ !"#¤%&\'()*+,-./0123456789:;<=>?'
+              '¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà')
+
+# Chars of the extension table, that are sent as escape septet followed by the septet of the table
+GSM7_EXTENSION = {
+    0x0A: '\f', 0x14: '^', 0x28: '{', 0x29: '}', 0x2F: '\\', 0x3C: '[', 0x3D: '~', 0x3E: ']', 0x40: '|', 0x65: '€'
+}
+
+ESCAPE = 0x1B
+
+_GSM7_ENCODE = {char: (septet,) for septet, char in enumerate(GSM7_BASIC) if septet != ESCAPE}
+_GSM7_ENCODE.update({char: (ESCAPE, septet) for septet, char in GSM7_EXTENSION.items()})
+
+# Data coding schemes
+DCS_GSM7 = 0x00
+DCS_UCS2 = 0x08
+
+# Maximum length of the user data in septets for gsm-7 and in octets for ucs-2
+MAX_SEPTETS = 160
+MAX_OCTETS = 140
+
+# User data header of a concatenated sms with an 8-bit reference: header length, IEI, IE length, ref, total, part
+UDH_LENGTH = 6
+
+# Message types of the first octet
+MTI_DELIVER = 0x00
+MTI_SUBMIT = 0x01
+MTI_STATUS_REPORT = 0x02
+
+# Status of a stored sms in the listings of the pdu mode
+STATUS = ('REC UNREAD', 'REC READ', 'STO UNSENT', 'STO SENT')
+
+# Maximum number of digits of an address field
+MAX_ADDRESS_DIGITS = 20
+
+# Chars that group the digits of a phone number, e.g. +43 (650) 123-45
+_NUMBER_SEPARATORS = str.maketrans('', '', ' -./()')
+
+
+class PDUError(Exception):
+    pass
+
+
+@attr.s(slots=True)
+class SMSPart:
+    """
+    Data class for a decoded sms pdu.
+
+    Concatenated sms have a reference, that is the same for all parts, the number of parts and the
+    number of this part starting at 1.
+    """
+
+    address = attr.ib()
+    message = attr.ib()
+    time = attr.ib(default=None)
+    reference = attr.ib(default=None)
+    parts = attr.ib(default=1)
+    part = attr.ib(default=1)
+
+
+@attr.s(slots=True)
+class StatusReportPart:
+    """
+    Data class for a decoded status report pdu.
+
+    The reference is the message reference of the sent sms, the status is 0 if the sms was delivered.
+    """
+
+    first_octet = attr.ib()
+    reference = attr.ib()
+    address = attr.ib()
+    address_type = attr.ib()
+    time = attr.ib()
+    discharge_time = attr.ib()
+    status = attr.ib()
+
+
+def is_gsm7(text):
+    """
+    Checks if the text can be encoded with the gsm-7 default alphabet.
+
+    :param text: text of the sms
+    :type text: str
+    :return: boolean that indicates if the text is gsm-7
+    """
+
+    return all(char in _GSM7_ENCODE for char in text)
+
+
+def pack_septets(septets, padding=0):
+    """
+    Packs 7-bit septets into octets.
+
+    :param septets: list of septets
+    :param padding: number of fill bits before the first septet
+    :type septets: list
+    :type padding: int
+    :return: packed octets
+    :rtype: bytes
+    """
+
+    value = 0
+    for i, septet in enumerate(septets):
+        value |= septet << (padding + i * 7)
+
+    bits = padding + len(septets) * 7
+    return value.to_bytes((bits + 7) // 8, 'little')
+
+
+def unpack_septets(data, count, padding=0):
+    """
+    Unpacks octets into 7-bit septets.
+
+    :param data: packed octets
+    :param count: number of septets
+    :param padding: number of fill bits before the first septet
+    :type data: bytes
+    :type count: int
+    :type padding: int
+    :return: list of septets
+    :rtype: list
+    """
+
+    value = int.from_bytes(data, 'little') >> padding
+    return [(value >> (i * 7)) & 0x7F for i in range(count)]
+
+
+def decode_gsm7(septets):
+    """
+    Converts septets of the gsm-7 default alphabet to a string.
+
+    :param septets: list of septets
+    :type septets: list
+    :return: decoded text
+    :rtype: str
+    """
+
+    text = []
+    escape = False
+    for septet in septets:
+        if escape:
+            text.append(GSM7_EXTENSION.get(septet, ' '))
+            escape = False
+        elif septet == ESCAPE:
+            escape = True
+        else:
+            text.append(GSM7_BASIC[septet])
+    return ''.join(text)
+
+
+def _split(text, limit, size):
+    """
+    Splits the text into parts, that do not exceed the limit and do not split a char.
+
+    :param text: text of the sms
+    :param limit: maximum size of a part
+    :param size: function that returns the size of a char
+    :return: list of parts
+    :rtype: list
+    """
+
+    parts = []
+    part = []
+    length = 0
+    for char in text:
+        char_size = size(char)
+        if length + char_size > limit:
+            parts.append(''.join(part))
+            part = []
+            length = 0
+        part.append(char)
+        length += char_size
+
+    parts.append(''.join(part))
+    return parts
+
+
+def normalize_number(number):
+    """
+    Removes the separators of a phone number, e.g. '+43 650 123-45' becomes '+4365012345'.
+
+    :param number: phone number, international numbers start with +
+    :type number: str
+    :return: the number without separators
+    :rtype: str
+    :raise PDUError: raises if the number has other chars than digits or too many digits
+    """
+
+    normalized = number.strip().translate(_NUMBER_SEPARATORS)
+    digits = normalized[1:] if normalized.startswith('+') else normalized
+    if not digits or digits.strip('0123456789') or len(digits) > MAX_ADDRESS_DIGITS:
+        raise PDUError('Invalid phone number: {}'.format(number))
+
+    return normalized
+
+
+def _encode_address(number):
+    """
+    Encodes a phone number as address field.
+
+    :param number: phone number, international numbers start with +
+    :type number: str
+    :return: address field
+    :rtype: bytes
+    """
+
+    digits = number.lstrip('+')
+    if not digits.isdigit():
+        raise PDUError('Invalid phone number: {}'.format(number))
+
+    number_type = 0x91 if number.startswith('+') else 0x81
+
+    # The digits are sent as swapped semi-octets filled up with F
+    padded = digits + 'F' * (len(digits) % 2)
+    swapped = ''.join(padded[i + 1] + padded[i] for i in range(0, len(padded), 2))
+
+    return bytes([len(digits), number_type]) + bytes.fromhex(swapped)
+
+
+def _decode_address(data):
+    """
+    Decodes an address field.
+
+    :param data: address field starting with the number of semi-octets
+    :type data: bytes
+    :return: the address and the size of the field in octets
+    :rtype: tuple
+    """
+
+    length = data[0]
+    number_type = data[1]
+    octets = (length + 1) // 2
+    value = data[2:2 + octets]
+
+    # Alphanumeric addresses are packed in gsm-7
+    if number_type & 0x70 == 0x50:
+        address = decode_gsm7(unpack_septets(value, length * 4 // 7))
+    else:
+        swapped = value.hex().upper()
+        address = ''.join(swapped[i + 1] + swapped[i] for i in range(0, len(swapped), 2))[:length]
+        if number_type & 0x70 == 0x10:
+            address = '+' + address
+
+    return address, 2 + octets
+
+
+def _decode_semi_octets(octet):
+    return (octet & 0x0F) * 10 + (octet >> 4)
+
+
+def _decode_timestamp(data):
+    """
+    Decodes the service centre timestamp.
+
+    :param data: timestamp of 7 octets
+    :type data: bytes
+    :return: datetime object with the timezone
+    """
+
+    year, month, day, hour, minute, second = (_decode_semi_octets(octet) for octet in data[:6])
+
+    # The zone is in quarter hours and the sign is the third bit of the first semi-octet
+    zone = data[6]
+    quarters = (zone & 0x07) * 10 + (zone >> 4)
+    if zone & 0x08:
+        quarters = -quarters
+
+    return datetime(century(year), month, day, hour, minute, second, tzinfo=timezone_of(quarters))
+
+
+def encode_sms(number, text, reference=0):
+    """
+    Encodes a sms as SMS-SUBMIT pdus for the AT+CMGS command in pdu mode.
+
+    Texts that are not covered by the gsm-7 default alphabet are encoded with ucs-2.
+    Long texts are split into concatenated sms, which get joined by the phone of the recipient.
+
+    :param number: phone number of the recipient
+    :param text: text of the sms
+    :param reference: reference number of a concatenated sms
+    :type number: str
+    :type text: str
+    :type reference: int
+    :return: list of tuples with the length of the pdu without the smsc and the pdu as hex string
+    :rtype: list
+    """
+
+    if is_gsm7(text):
+        dcs = DCS_GSM7
+        size = lambda char: len(_GSM7_ENCODE[char])
+        limit = MAX_SEPTETS
+        # The header needs 7 septets including the fill bit
+        part_limit = MAX_SEPTETS - (UDH_LENGTH * 8 + 6) // 7
+    else:
+        dcs = DCS_UCS2
+        size = lambda char: len(char.encode('utf-16-be'))
+        limit = MAX_OCTETS
+        part_limit = MAX_OCTETS - UDH_LENGTH
+
+    texts = [text] if sum(size(char) for char in text) <= limit else _split(text, part_limit, size)
+    concatenated = len(texts) > 1
+    if len(texts) > 255:
+        raise PDUError('Text is too long')
+
+    pdus = []
+    for number_of_part, part in enumerate(texts, 1):
+        header = b''
+        if concatenated:
+            header = bytes([UDH_LENGTH - 1, 0x00, 0x03, reference & 0xFF, len(texts), number_of_part])
+
+        if dcs == DCS_GSM7:
+            septets = [septet for char in part for septet in _GSM7_ENCODE[char]]
+            padding = (7 - len(header) * 8 % 7) % 7
+            user_data = header + pack_septets(septets, padding)
+            user_data_length = (len(header) * 8 + padding) // 7 + len(septets)
+        else:
+            user_data = header + part.encode('utf-16-be')
+            user_data_length = len(user_data)
+
+        # SMS-SUBMIT, with the user data header indicator for concatenated sms
+        first_octet = MTI_SUBMIT | (0x40 if concatenated else 0x00)
+
+        tpdu = bytes([first_octet, 0x00]) + _encode_address(number) + bytes([0x00, dcs, user_data_length]) + user_data
+
+        # The smsc of the sim card is used
+        pdus.append((len(tpdu), ('00' + tpdu.hex()).upper()))
+
+    return pdus
+
+
+def decode_sms(pdu):
+    """
+    Decodes a SMS-DELIVER or SMS-SUBMIT pdu as it is listed by the module in pdu mode.
+
+    :param pdu: pdu as hex string including the smsc
+    :type pdu: str
+    :return: decoded sms
+    :rtype: SMSPart
+    :raise PDUError: raises if the pdu is malformed
+    """
+
+    try:
+        data = bytes.fromhex(pdu.strip())
+
+        position = 1 + data[0]
+        first_octet = data[position]
+        message_type = first_octet & 0x03
+        position += 1
+
+        # The message reference of a SMS-SUBMIT
+        if message_type == MTI_SUBMIT:
+            position += 1
+        elif message_type != MTI_DELIVER:
+            raise PDUError('Unsupported message type: {}'.format(message_type))
+
+        address, size = _decode_address(data[position:])
+        position += size
+
+        dcs = data[position + 1]
+        position += 2
+
+        time = None
+        if message_type == MTI_DELIVER:
+            time = _decode_timestamp(data[position:position + 7])
+            position += 7
+        else:
+            # The validity period is relative with one octet or absolute with seven octets
+            validity_period = (first_octet >> 3) & 0x03
+            position += {0: 0, 2: 1}.get(validity_period, 7)
+
+        user_data_length = data[position]
+        user_data = data[position + 1:]
+    except (IndexError, ValueError) as e:
+        raise PDUError('Malformed pdu: {}'.format(e))
+
+    sms = SMSPart(address, '', time)
+
+    header_length = 0
+    if first_octet & 0x40:
+        header_length = user_data[0] + 1
+        _decode_header(sms, user_data[1:header_length])
+
+    alphabet = (dcs >> 2) & 0x03 if dcs & 0xC0 == 0x00 else (dcs >> 2) & 0x01 if dcs & 0xF0 == 0xF0 else 0
+    if alphabet == 0:
+        header_septets = (header_length * 8 + 6) // 7
+        padding = header_septets * 7 - header_length * 8
+        septets = unpack_septets(user_data[header_length:], user_data_length - header_septets, padding)
+        sms.message = decode_gsm7(septets)
+    elif alphabet == 2:
+        sms.message = user_data[header_length:user_data_length].decode('utf-16-be', 'replace')
+    else:
+        sms.message = user_data[header_length:user_data_length].decode('latin-1')
+
+    return sms
+
+
+def decode_status_report(pdu):
+    """
+    Decodes a SMS-STATUS-REPORT pdu as it is reported by +CDS in pdu mode.
+
+    :param pdu: pdu as hex string including the smsc
+    :type pdu: str
+    :return: decoded status report
+    :rtype: StatusReportPart
+    :raise PDUError: raises if the pdu is malformed
+    """
+
+    try:
+        data = bytes.fromhex(pdu.strip())
+
+        position = 1 + data[0]
+        first_octet = data[position]
+        if first_octet & 0x03 != MTI_STATUS_REPORT:
+            raise PDUError('Unsupported message type: {}'.format(first_octet & 0x03))
+
+        reference = data[position + 1]
+        address_type = data[position + 3]
+        address, size = _decode_address(data[position + 2:])
+        position += 2 + size
+
+        time = _decode_timestamp(data[position:position + 7])
+        discharge_time = _decode_timestamp(data[position + 7:position + 14])
+        status = data[position + 14]
+    except (IndexError, ValueError) as e:
+        raise PDUError('Malformed pdu: {}'.format(e))
+
+    return StatusReportPart(first_octet, reference, address, address_type, time, discharge_time, status)
+
+
+def _decode_header(sms, header):
+    """
+    Reads the concatenation information elements of the user data header.
+
+    :param sms: sms of the header
+    :param header: user data header without the header length
+    :type sms: SMSPart
+    :type header: bytes
+    :return: nothing
+    """
+
+    position = 0
+    while position + 1 < len(header):
+        identifier = header[position]
+        length = header[position + 1]
+        element = header[position + 2:position + 2 + length]
+
+        # Concatenated sms with an 8-bit or 16-bit reference
+        if identifier == 0x00 and length == 3:
+            sms.reference, sms.parts, sms.part = element
+        elif identifier == 0x08 and length == 4:
+            sms.reference = element[0] << 8 | element[1]
+            sms.parts, sms.part = element[2], element[3]
+
+        position += 2 + length
@@ -0,0 +1,283 @@
+import asyncio
+from enum import Enum
+
+import attr
+from pyee import EventEmitter
+
+from gateway.io.sim800.sim800 import Sim800Error
+from gateway.utils import clear_str, logger
+
+
+# Unsolicited result codes that are forwarded by the pool with the modem that reported them
+URC_EVENTS = ('ring', 'caller_identification', 'call_ended', 'busy', 'no_answer', 'network_status', 'pin_status',
+              'new_sms', 'sms', 'sms_status_report')
+
+# Result codes after which the line of a modem is free again
+CALL_ENDED_EVENTS = ('call_ended', 'busy', 'no_answer')
+
+
+class Policy(Enum):
+    """
+    Enum for the policy a modem is selected with.
+
+    LeastBusy: the modem with the fewest queued and pending commands
+    Cost: the modem with the cheapest sim card, the least busy of equally cheap ones
+    Carrier: the modems of the carrier of the number, the least busy of them, or any modem if none matches
+    """
+
+    LeastBusy = 'least_busy'
+    Cost = 'cost'
+    Carrier = 'carrier'
+
+
+class PoolError(Sim800Error):
+    pass
+
+
+@attr.s
+class Modem:
+    """
+    Data class for a modem of the pool.
+    """
+
+    name = attr.ib()
+    sim = attr.ib()
+    # Cost of a call or sms with the sim card, only compared between the modems
+    cost = attr.ib(default=0)
+    # Name of the network of the sim card, set by the setup of the pool if it is unknown
+    carrier = attr.ib(default=None)
+    # Prefixes of the numbers in the network of the carrier e.g. ('+43650', '0650')
+    prefixes = attr.ib(default=(), converter=tuple)
+    pin = attr.ib(default=None)
+
+    # Set if the modem could be set up
+    available = attr.ib(default=True)
+    # Set while a call is dialed or active
+    in_call = attr.ib(default=False)
+    # Number of dials and sms that were assigned to the modem and are not finished
+    pending = attr.ib(default=0)
+    # Number of dials and sms that were assigned to the modem
+    assigned = attr.ib(default=0)
+
+    @property
+    def load(self):
+        """
+        :return: number of the pending and queued commands
+        :rtype: int
+        """
+
+        return self.pending + sum(self.sim.metrics.queue_depths.values())
+
+    def serves(self, number):
+        """
+        Checks if a number is in the network of the carrier.
+
+        :param number: phone number
+        :type number: str
+        :return: boolean
+        """
+
+        return any(number.startswith(prefix) for prefix in self.prefixes)
+
+
+class ModemPool(EventEmitter):
+    """
+    Owns several Sim800 objects and spreads the outgoing calls and sms over them.
+
+    The unsolicited result codes of every modem are emitted by the pool with the modem as first argument,
+    e.g. pool.on('caller_identification', handler) calls handler(modem, number). A modem is busy for calls from
+    the dial or ring until the call ended, sms can be sent over every available modem. The pool has the
+    send_sms coroutine of Sim800, so an Outbox sends over the pool without changes.
+    """
+
+    def __init__(self, modems, policy=Policy.LeastBusy, loop=asyncio.get_event_loop()):
+        """
+        Construct a new 'ModemPool' object.
+
+        :param modems: Modem objects, their names have to be unique
+        :param policy: default policy the modems are selected with
+        :param loop: event loop
+        :type modems: list
+        :type policy: Policy
+        :return: returns nothing
+        """
+
+        super().__init__(loop=loop)
+
+        self.modems = {}
+        for modem in modems:
+            if modem.name in self.modems:
+                raise ValueError('Duplicate modem name: {}'.format(modem.name))
+            self.modems[modem.name] = modem
+
+            for name in URC_EVENTS:
+                modem.sim.on(name, self._forwarder(modem, name))
+
+        if not self.modems:
+            raise ValueError('A pool needs at least one modem')
+
+        self.policy = policy
+
+    def __getitem__(self, name):
+        return self.modems[name]
+
+    def __iter__(self):
+        return iter(self.modems.values())
+
+    def __len__(self):
+        return len(self.modems)
+
+    def _forwarder(self, modem, name):
+        # The handlers run in the event loop, so the call state is only changed there
+        async def forward(data=None):
+            if name in ('ring', 'caller_identification'):
+                modem.in_call = True
+            elif name in CALL_ENDED_EVENTS:
+                modem.in_call = False
+            self.emit(name, modem, data)
+
+        return forward
+
+    async def setup(self, modems=None):
+        """
+        Sets the modems up with their pin and reads the carrier of the modems without one.
+
+        Modems that fail are not used until they were set up again.
+
+        :param modems: Modem objects or None for all modems
+        :type modems: list
+        :return: nothing
+        :raise PoolError: raises if none of the modems could be set up
+        """
+
+        modems = list(self) if modems is None else modems
+        results = await asyncio.gather(*[modem.sim.setup(modem.pin) for modem in modems], return_exceptions=True)
+
+        for modem, result in zip(modems, results):
+            if isinstance(result, Exception):
+                modem.available = False
+                logger.error('ModemPool', 'SetupError(Modem: {}, {})'.format(modem.name, result))
+                continue
+
+            modem.available = True
+            if modem.carrier is None:
+                event = await modem.sim.request_imsi()
+                if not event.error:
+                    modem.carrier = event.data.network
+
+        if not any(modem.available for modem in modems):
+            raise PoolError('ModemPool', 'No modem could be set up')
+
+    def close(self):
+        """
+        Closes the serial interfaces of all modems.
+
+        :return: nothing
+        """
+
+        for modem in self:
+            modem.sim.close()
+
+    def select(self, number=None, policy=None, call=False):
+        """
+        Returns the modem a call or sms is assigned to.
+
+        Modems with the same cost or load are used in turn.
+
+        :param number: phone number of the participant, used by the carrier policy
+        :param policy: policy or None for the default policy of the pool
+        :param call: indicates if the modem needs a free line
+        :type number: str
+        :type policy: Policy
+        :type call: bool
+        :return: Modem object
+        :raise PoolError: raises if no modem is available
+        """
+
+        candidates = [modem for modem in self if modem.available and not (call and modem.in_call)]
+        if not candidates:
+            raise PoolError('ModemPool', 'No {}modem available'.format('idle ' if call else ''))
+
+        policy = policy or self.policy
+        if policy == Policy.Carrier and number:
+            carrier = [modem for modem in candidates if modem.serves(number)]
+            candidates = carrier or candidates
+
+        if policy == Policy.Cost:
+            return min(candidates, key=lambda modem: (modem.cost, modem.load, modem.assigned))
+        return min(candidates, key=lambda modem: (modem.load, modem.assigned))
+
+    async def dial_number(self, number, policy=None):
+        """
+        Calls a participant over an idle modem.
+
+        :param number: phone number of the participant
+        :param policy: policy or None for the default policy of the pool
+        :type number: str
+        :type policy: Policy
+        :return: tuple of the modem and the event
+        :raise PoolError: raises if every modem is in a call
+        """
+
+        number = clear_str(number)
+        modem = self.select(number, policy, call=True)
+        logger.debug('ModemPool', 'Dial {} over {}'.format(number, modem.name))
+
+        # The line is taken before the dial is written, so concurrent dials use other modems
+        modem.in_call = True
+        modem.pending += 1
+        modem.assigned += 1
+        try:
+            event = await modem.sim.dial_number(number)
+        except Exception:
+            modem.in_call = False
+            raise
+        finally:
+            modem.pending -= 1
+
+        if event.error:
+            modem.in_call = False
+        return modem, event
+
+    async def hang_up_call(self, modem):
+        """
+        Disconnects the call of a modem.
+
+        :param modem: Modem object or its name
+        :return: event
+        """
+
+        if not isinstance(modem, Modem):
+            modem = self.modems[modem]
+
+        event = await modem.sim.hang_up_call()
+        if not event.error:
+            modem.in_call = False
+        return event
+
+    async def send_sms(self, number, text, sent=None, policy=None):
+        """
+        Sends a sms over an available modem.
+
+        :param number: phone number of the participant
+        :param text: message of the sms
+        :param sent: list the message references of the accepted parts are appended to
+        :param policy: policy or None for the default policy of the pool
+        :type number: str
+        :type text: str
+        :type sent: list
+        :type policy: Policy
+        :return: event of the last part or the first part that failed
+        :raise PoolError: raises if no modem is available
+        """
+
+        number = clear_str(number)
+        modem = self.select(number, policy)
+
+        logger.debug('ModemPool', 'Send sms to {} over {}'.format(number, modem.name))
+        modem.pending += 1
+        modem.assigned += 1
+        try:
+            return await modem.sim.send_sms(number, text, sent)
+        finally:
+            modem.pending -= 1
@@ -0,0 +1,101 @@
+import math
+import threading
+import time
+
+
+# Time in seconds a response is valid, responses that never change during a session are valid forever
+CACHE_TTLS = {
+    'AT+GSN': math.inf,
+    'AT+CIMI': math.inf,
+    'AT+CNUM': math.inf,
+    'AT+CSQ': 5,
+    'AT+CPIN?': 30,
+    'AT+CREG?': 30
+}
+
+# Commands whose responses are outdated, when an unsolicited result code is emitted. +CREG is only sent after
+# AT+CREG=1, that is set by Sim800.setup()
+URC_INVALIDATIONS = {
+    'pin_status': ('AT+CPIN?', 'AT+CIMI', 'AT+CNUM'),
+    'network_status': ('AT+CREG?', 'AT+CSQ')
+}
+
+
+class ResponseCache:
+    """
+    Threadsafe cache for the events of commands that only read the state of the module.
+
+    Each command has its own time to live, commands without one are never cached.
+    """
+
+    def __init__(self, ttls=None):
+        """
+        Construct a new 'ResponseCache' object.
+
+        :param ttls: dict that maps a command e.g. AT+CSQ to the time in seconds its response is valid
+        :type ttls: dict
+        :return: returns nothing
+        """
+
+        self.ttls = dict(CACHE_TTLS)
+        self.ttls.update(ttls or {})
+
+        # Maps a command to the time its response expires and the event
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, command):
+        """
+        Returns the cached event of the command.
+
+        :param command: command without the line terminator
+        :type command: str
+        :return: event or None if no valid response is cached
+        """
+
+        with self._lock:
+            entry = self._entries.get(command)
+            if entry is None:
+                return None
+
+            expires, event = entry
+            if time.monotonic() >= expires:
+                del self._entries[command]
+                return None
+
+            return event
+
+    def put(self, command, event):
+        """
+        Caches the event of the command if the command has a time to live and succeeded.
+
+        :param command: command without the line terminator
+        :param event: event with the response of the command
+        :type command: str
+        :return: nothing
+        """
+
+        ttl = self.ttls.get(command)
+        if not ttl or event.error:
+            return
+
+        with self._lock:
+            self._entries[command] = (time.monotonic() + ttl, event)
+
+    def invalidate(self, *commands):
+        """
+        Removes the responses of the commands or all responses if no command is passed.
+
+        :param commands: commands without the line terminator
+        :return: nothing
+        """
+
+        with self._lock:
+            if not commands:
+                self._entries.clear()
+
+            for command in commands:
+                self._entries.pop(command, None)
+
+    def __contains__(self, command):
+        return self.get(command) is not None
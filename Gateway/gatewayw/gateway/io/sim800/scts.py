@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, timezone
+
+
+# Timezones by their offset in quarter hours, the offsets of the networks repeat, so the objects are shared
+_TIMEZONES = {}
+
+
+def timezone_of(quarters):
+    """
+    Returns the timezone for an offset in quarter hours, like it is sent in a timestamp of the service centre.
+
+    :param quarters: offset to utc in quarter hours
+    :type quarters: int
+    :return: timezone object
+    :rtype: timezone
+    """
+
+    zone = _TIMEZONES.get(quarters)
+    if zone is None:
+        zone = _TIMEZONES[quarters] = timezone(timedelta(minutes=15 * quarters))
+    return zone
+
+
+def century(year):
+    """
+    Adds the century to a year with two digits, like %y of strptime.
+
+    :param year: year with two digits
+    :type year: int
+    :return: year with four digits
+    :rtype: int
+    """
+
+    return year + (1900 if year >= 69 else 2000)
+
+
+def parse_scts(text):
+    """
+    Converts the service centre timestamp of the text mode to a datetime object.
+
+    The timestamp has a fixed width, so the fields are read by their position instead of with strptime.
+
+    :param text: timestamp without quotes e.g. 19/03/14,12:30:45+04, the zone is in quarter hours
+    :type text: str
+    :return: datetime object with the timezone or without it, if the timestamp has no zone
+    :rtype: datetime
+    :raise ValueError: raises if the timestamp is malformed
+    """
+
+    if len(text) < 17 or text[2] != '/' or text[5] != '/' or text[8] != ',' or text[11] != ':' or text[14] != ':':
+        raise ValueError('Malformed timestamp: {}'.format(text))
+
+    zone = timezone_of(int(text[17:])) if len(text) > 17 else None
+
+    return datetime(century(int(text[0:2])), int(text[3:5]), int(text[6:8]),
+                    int(text[9:11]), int(text[12:14]), int(text[15:17]), tzinfo=zone)
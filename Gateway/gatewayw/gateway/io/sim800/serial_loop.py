@@ -1,7 +1,15 @@
+import os
+import selectors
+import sys
 import threading
-from queue import Queue
+import time
+from collections import deque
 from threading import Thread
 
+from gateway.io.sim800.at_tokenizer import ATTokenizer, TokenType, response_prefixes, line_prefix
+from gateway.io.sim800.at_urc import URCS
+from gateway.io.sim800.command_queue import CommandQueue
+from gateway.io.sim800.trace import RECEIVED, WRITTEN
 from gateway.utils import clear_str, logger
 
 
@@ -13,14 +21,34 @@ class EchoError(SerialError):
     pass
 
 
-class SerialLoop(Thread):
+class ResponseTimeout(SerialError):
+    pass
+
+
+# Number of times the resynchronisation is tried after a failed command
+RESYNC_ATTEMPTS = 3
+# Time in seconds without data, after which the serial interface is considered drained
+RESYNC_QUIET = 0.1
+# Time in seconds the module has to answer the bare AT command of the resynchronisation
+RESYNC_TIMEOUT = 1
+# Time in seconds the stop of a threaded loop waits for the thread to finish its current command
+STOP_TIMEOUT = 1
+
+
+class BaseSerialLoop:
     """
-    SerialLoop is a thread for communication with the sim800 module over the serial interface.
+    Base class for the serial backends of the sim800 module.
+
+    It holds the state of the connection and processes the lines of a response,
+    but does not decide how the serial interface is read.
     """
 
+    # Indicates if the events have to be set threadsafe in the event loop
+    threadsafe = True
+
     def __init__(self, emitter, serial, debug):
         """
-        Construct a new 'SerialLoop' object.
+        Construct a new 'BaseSerialLoop' object.
 
         :param emitter: Sim800 object
         :param serial: serial object
@@ -31,8 +59,6 @@ class SerialLoop(Thread):
         :return: returns nothing
         """
 
-        super(SerialLoop, self).__init__()
-
         if not hasattr(emitter, 'emit'):
             raise ValueError
 
@@ -47,13 +73,25 @@ class SerialLoop(Thread):
         self.echo = True
         self.caller_identification = False
 
-        # The Events that should be written and emitted, when a message returns from the serial interface
-        self.command_queue = Queue(64)
+        # The Events that should be written and emitted, when a message returns from the serial interface.
+        # Events are taken by the priority of their command.
+        self.command_queue = CommandQueue()
 
-        # Set running to stop the loop
-        self.running = threading.Event()
+        # Unsolicited result codes that get emitted on the emitter
+        self.urcs = URCS
 
-        self.daemon = True
+        # Frames the received bytes into lines, result codes and the prompt char
+        self.tokenizer = ATTokenizer(unsolicited=self.urcs)
+
+        # Recorder of the raw bytes in both directions and the channel of this loop in the trace
+        self.trace = None
+        self.trace_channel = 0
+
+        # Metrics of the commands and queues, that the finished events are reported to
+        self.metrics = None
+
+        # Event whose command is processed
+        self._event = None
 
     @staticmethod
     def _get_event_from_queue(command_queue):
@@ -67,151 +105,215 @@ class SerialLoop(Thread):
 
         return event, command
 
-    def _verify_echo(self, command):
+    def _fileno(self):
         """
-        Reads from the serial interface and checks if the data is the same as the passed command.
+        Returns the file descriptor the loop listens on for incoming data.
+
+        :return: file descriptor of the serial interface or stdin in debug mode
+        :rtype: int
+        """
+
+        if self.debug:
+            return sys.stdin.fileno()
+        return self.serial.fileno()
+
+    def _queue_changed(self, priority):
+        """
+        Reports the depth of the command queue of a priority class to the metrics.
+
+        :param priority: priority class of the queued or taken command
+        :return: nothing
+        """
+
+        if self.metrics is not None:
+            self.metrics.queue_depth(priority, self.command_queue.depth(priority))
+
+    def _received(self, data):
+        """
+        Records received data in the trace and marks the first byte of the response of the current command.
+
+        :param data: data from the serial interface
+        :type data: bytes
+        :return: nothing
+        """
+
+        if self.trace is not None:
+            self.trace.record(RECEIVED, data, self.trace_channel)
+
+        event = self._event
+        if event is not None and event.first_byte_at is None:
+            event.first_byte_at = time.monotonic()
+
+    def _check_echo(self, command, token):
+        """
+        Checks if the token is the echo of the passed command.
 
         :param command: command object of the event
+        :param token: token from the serial interface
         :return: nothing
         :raise EchoError: raises if the echo is not the same as the command
         """
 
-        # Verify the command if echo mode is on
-        if self.echo:
-            # Get the data from the serial interface, remove \r\n and convert it to a string
-            response = self._read()
-            response = clear_str(response.decode('utf-8'))
+        # The sim800 module sends usually the same command back first
+        if token is None or token.data != command.command.encode():
+            response = token.data.decode('utf-8', 'replace') if token else ''
 
-            # The sim800 module sends usually the same command back first
-            if response != command.command:
-                # Print an error and continue with the next command if not the same is send back
-                logger.error('Sim800', 'SerialError(WrongEcho: {})'.format(response))
-                raise EchoError(response, command.command)
+            # Print an error and continue with the next command if not the same is send back
+            logger.error('Sim800', 'SerialError(WrongEcho: {})'.format(response))
+            raise EchoError(response, command.command)
 
-    def _read_response(self, event):
+    def _process_token(self, event, token):
         """
-        Reads from the serial interface and fills the event object with the response.
+        Fills the event with a token of the response.
 
         :param event: event object
-        :return: nothing
-        :raise SerialError: raises if the serial data can not be decoded
+        :param token: token from the serial interface
+        :return: boolean that indicates if the response is complete
+        :raise SerialError: raises if the data of a line can not be decoded
         """
 
         command = event.command
+        token_type = token.type
 
-        # Listen on the serial interface until an error or success
-        while True:
-            res = self._read()
-            # Get the data from the serial interface, remove \r\n and convert it to a string
-            try:
-                response = clear_str(res.decode('utf-8'))
-            except UnicodeDecodeError:
-                logger.error('Sim800', 'SerialError')
-                event.error = True
-                raise SerialError('Received data could not be decoded!')
-
-            # If the prompt char is send back, serial800 expects some kind of data
-            if '>' in response and command.data:
+        # If the prompt char is send back, serial800 expects some kind of data
+        if token_type is TokenType.Prompt:
+            if command.data:
                 self._write(command.data)
-                continue
+            return False
 
-            if 'OK' in response:
-                event.error = False
-                break
-            elif 'ERROR' in response:
-                event.error_message = response
-                event.error = True
-                break
-            elif len(response) > 0:
-                # Save the transmitted data in the content property of
-                # the event line by line until OK or ERROR is send
-                if not self._emit_serial_event(response):
-                    event.content.append(response)
+        if token_type is TokenType.Ok:
+            event.error = False
+            return True
+        elif token_type is TokenType.Error:
+            event.error_message = token.data.decode('utf-8', 'replace')
+            event.error = True
+            return True
+        elif token_type is TokenType.Unsolicited:
+            self._process_unsolicited(token)
+            return False
+
+        # Save the transmitted data in the content property of
+        # the event line by line until OK or ERROR is send
+        try:
+            line = token.text
+        except UnicodeDecodeError:
+            logger.error('Sim800', 'SerialError')
+            event.error = True
+            raise SerialError('Received data could not be decoded!')
+
+        # A streamed response is passed on line by line instead
+        if event.stream is not None:
+            event.stream(line)
+        else:
+            event.content.append(line)
 
-    def _emit_serial_event(self, response):
+        return False
+
+    def _process_unsolicited(self, token):
         """
-        Checks the response string for an event.
+        Decodes a token that was received without a command and checks it for an event.
 
-        :param response: event from serial interface e.g. RING
-        :type response str
-        :return: boolean that indicates if the passed data was processed
+        :param token: token from the serial interface
+        :return: nothing
         """
 
-        logger.debug('Sim800', 'Got other data: {}'.format(response))
-        if response == 'RING':
-            logger.debug('Sim800', 'Processing ring event...')
-            number = None
+        try:
+            self._emit_serial_event(token.text)
+        except UnicodeDecodeError:
+            logger.error('Sim800', 'SerialError')
 
-            # if self.caller_identification:
-            #     number = parser.CallerIdentificationParser.parse([self._read()])
+    def _fail_event(self, event, error):
+        """
+        Sets the event with the error of a failed command.
 
-            # Emit the ring event
-            self.emitter.emit('ring', number)
-            logger.info('Sim800', 'Ring event!')
-            return True
-        return False
+        :param event: event object
+        :param error: error that caused the failure
+        :type error: SerialError
+        :return: nothing
+        """
 
-    def run(self):
+        self.tokenizer.responses = set()
+
+        event.error = True
+        event.error_message = '{}({})'.format(type(error).__name__, error.args[0] if error.args else '')
+
+        if self.metrics is not None:
+            self.metrics.record(event, error)
+
+        event.set()
+
+    def _finish_event(self, event):
         """
-        Is there for writing commands to the serial interface and reading the response
+        Parses the content of the event and sets it for the tasks that are waiting for it.
 
-        :return: returns nothing
+        :param event: event object
+        :return: nothing
         """
 
-        logger.info('Sim800', 'Started Service!')
+        self.tokenizer.responses = set()
 
-        while not self.running.is_set():
-            # Write the event to the serial interface and emit the returning value
-            if not self.command_queue.empty():
-                event, command = self._get_event_from_queue(self.command_queue)
+        if not event.error:
+            # Parse the event content, a malformed response must not stop the loop
+            try:
+                event.data = event.command.parser.parse(event.content)
+            except Exception as e:
+                logger.error('Sim800', 'ParserError({})'.format(e))
+                event.error = True
+                event.error_message = 'ParserError({})'.format(e)
 
-                # Write the command to the serial interface
-                self._write(command.command)
+        if self.metrics is not None:
+            self.metrics.record(event)
 
-                try:
-                    self._verify_echo(command)           # Verify the echo of the command if activated
-                    self._read_response(event)  # Fill the event with the response from the serial interface
-                except EchoError or SerialError:
-                    continue
+        # Set the event for tasks that are waiting for it
+        event.set()
 
-                if not event.error:
-                    # Parse the event content
-                    event.data = command.parser.parse(event.content)
+    def _emit_serial_event(self, response):
+        """
+        Checks the response string for an event.
 
-                # Set the event for tasks that are waiting for it
-                event.set()
+        The event gets looked up in the registry of unsolicited result codes
+        and emitted with the parsed data.
 
-            # If no events are in the queue, just listen on the serial port
-            else:
-                # Get the data from the serial interface, remove \r\n and convert it to a string
-                res = self._read()
-                try:
-                    response = clear_str(res.decode('utf-8'))
-                    if not response:
-                        continue
+        :param response: event from serial interface e.g. RING
+        :type response str
+        :return: boolean that indicates if the passed data was processed
+        """
 
-                    self._emit_serial_event(response)
+        lines = response.split('\r\n')
+        urc = self.urcs.get(line_prefix(lines[0].encode()))
 
-                except UnicodeDecodeError:
-                    logger.error('Sim800', 'SerialError')
+        if urc is None:
+            logger.debug('Sim800', 'Got other data: {}'.format(response))
+            return False
 
-    def _read(self):
+        logger.debug('Sim800', 'Processing {} event...'.format(urc.name))
+
+        try:
+            data = urc.parser.parse(lines)
+        except (ValueError, IndexError):
+            logger.error('Sim800', 'URCParseError({})'.format(response))
+            return True
+
+        # Emit the event
+        self.emitter.emit(urc.name, data)
+        logger.info('Sim800', '{} event!'.format(urc.name))
+        return True
+
+    def _write_command(self, command):
         """
-        Reads from the serial interface
+        Writes the command terminated with a carriage return to the serial interface.
 
-        :return: returns the value from the serial interface
-        :rtype: bytearray
+        :param command: command object of the event
+        :return: nothing
         """
 
-        # When debug mode is enabled get the data from the command line
-        if self.debug:
-            return str.encode(input())
-        else:
-            # Read the data from the serial interface
-            data = self.serial.readline()
-            if data:
-                logger.debug('Sim800', 'Received data from serial interface: ' + str(data))
-            return data
+        # Lines with the prefix of the command are the response and not unsolicited
+        self.tokenizer.responses = response_prefixes(command.command)
+        if self._event is not None:
+            self._event.written_at = time.monotonic()
+        self.tokenizer.expect_prompt = bool(command.data)
+
+        self._write(command.command + '\r')
 
     def _write(self, data):
         """
@@ -234,6 +336,303 @@ class SerialLoop(Thread):
 
         logger.debug('Sim800', 'Wrote data to serial interface: ' + str(data))
 
+        if self.trace is not None:
+            self.trace.record(WRITTEN, data, self.trace_channel)
+
         # Write the data to the serial interface
         if not self.debug:
             self.serial.write(data)
+
+
+class SerialLoop(BaseSerialLoop, Thread):
+    """
+    SerialLoop is a thread for communication with the sim800 module over the serial interface.
+    """
+
+    def __init__(self, emitter, serial, debug):
+        """
+        Construct a new 'SerialLoop' object.
+
+        :param emitter: Sim800 object
+        :param serial: serial object
+        :param debug: indicates debug mode
+        :type emitter: object
+        :type serial: object
+        :type debug: bool
+        :return: returns nothing
+        """
+
+        Thread.__init__(self)
+        BaseSerialLoop.__init__(self, emitter, serial, debug)
+
+        # Set running to stop the loop
+        self.running = threading.Event()
+
+        # Pipe that wakes up the loop when a command gets queued or the loop gets stopped
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        os.set_blocking(self._wakeup_write, False)
+
+        # Tokens that are received but not processed yet
+        self._tokens = deque()
+
+        # Time until the current command must be answered
+        self._deadline = None
+
+        self.daemon = True
+
+    def put(self, event):
+        """
+        Queues the event and wakes up the loop.
+
+        :param event: event that should be written to the serial interface
+        :return: nothing
+        """
+
+        self.command_queue.put(event)
+        self._queue_changed(event.command.priority)
+        self._wakeup()
+
+    def stop(self):
+        """
+        Stops the loop, even if it is waiting for data, and waits until the thread left the serial interface.
+
+        :return: nothing
+        """
+
+        self.running.set()
+        self._wakeup()
+
+        # A handler of the loop can stop it as well, the thread can not wait for itself
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(STOP_TIMEOUT)
+
+    def _wakeup(self):
+        """
+        Writes a byte to the wakeup pipe, so that the selector in the loop returns.
+
+        :return: nothing
+        """
+
+        try:
+            os.write(self._wakeup_write, b'\0')
+        except BlockingIOError:
+            # The pipe is full, so the loop is going to wake up anyway
+            pass
+
+    def _clear_wakeup(self):
+        """
+        Empties the wakeup pipe.
+
+        :return: nothing
+        """
+
+        try:
+            while os.read(self._wakeup_read, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _verify_echo(self, command):
+        """
+        Reads from the serial interface and checks if the data is the same as the passed command.
+
+        :param command: command object of the event
+        :return: nothing
+        :raise EchoError: raises if the echo is not the same as the command
+        """
+
+        # Verify the command if echo mode is on, result codes that arrive before the echo are dispatched
+        if self.echo:
+            token = self._next_token()
+            while token is not None and token.type is TokenType.Unsolicited:
+                self._process_unsolicited(token)
+                token = self._next_token()
+            self._check_echo(command, token)
+
+    def _read_response(self, event):
+        """
+        Reads from the serial interface and fills the event object with the response.
+
+        :param event: event object
+        :return: nothing
+        :raise SerialError: raises if the serial data can not be decoded
+        """
+
+        # Listen on the serial interface until an error or success
+        while True:
+            token = self._next_token()
+            if token is not None and self._process_token(event, token):
+                break
+
+    def _next_token(self):
+        """
+        Reads the next token and waits for it until the deadline of the current command.
+
+        :return: the next token or None if no deadline is set and the serial interface timed out
+        :rtype: Token
+        :raise ResponseTimeout: raises if the deadline passed
+        """
+
+        while True:
+            token = self._read_token()
+            if token is not None or self._deadline is None:
+                return token
+
+            if time.monotonic() > self._deadline:
+                logger.error('Sim800', 'SerialError(Timeout)')
+                raise ResponseTimeout('No response within the deadline')
+
+    def _read_token(self):
+        """
+        Reads from the serial interface until a token is complete.
+
+        :return: the next token or None if the serial interface timed out
+        :rtype: Token
+        """
+
+        while not self._tokens:
+            data = self._read()
+            if not data:
+                return None
+            self._tokens.extend(self.tokenizer.feed(data))
+
+        return self._tokens.popleft()
+
+    def _resync(self):
+        """
+        Drains the serial interface and confirms with a bare AT command, that the module is in sync again.
+
+        :return: boolean that indicates if the module answered
+        """
+
+        if self.debug:
+            return True
+
+        logger.info('Sim800', 'Resynchronizing serial interface...')
+
+        self._tokens.clear()
+        self.tokenizer.reset()
+        self.tokenizer.responses = set()
+        self.tokenizer.expect_prompt = False
+
+        timeout = self.serial.timeout
+        self.serial.timeout = RESYNC_QUIET
+
+        try:
+            for _ in range(RESYNC_ATTEMPTS):
+                # Discard everything until the line is quiet, e.g. the rest of a late response
+                self.serial.reset_input_buffer()
+                while self._read():
+                    pass
+
+                self._write('AT\r')
+                self._deadline = time.monotonic() + RESYNC_TIMEOUT
+
+                try:
+                    while True:
+                        token = self._next_token()
+                        if token.type is TokenType.Ok:
+                            logger.info('Sim800', 'Serial interface is in sync!')
+                            return True
+                        elif token.type is TokenType.Unsolicited:
+                            self._process_unsolicited(token)
+                except ResponseTimeout:
+                    continue
+        finally:
+            self.serial.timeout = timeout
+            self._deadline = None
+
+        logger.error('Sim800', 'SerialError(Resync failed)')
+        return False
+
+    def _read_idle(self):
+        """
+        Reads data that arrived while no command is processed and checks it for an event.
+
+        :return: nothing
+        """
+
+        self._tokens.extend(self.tokenizer.feed(self._read()))
+
+        while self._tokens:
+            self._process_unsolicited(self._tokens.popleft())
+
+    def run(self):
+        """
+        Is there for writing commands to the serial interface and reading the response.
+
+        The loop sleeps in a selector until either the serial interface has data or a command gets queued,
+        so commands are written immediately and an idle module does not use any cpu time.
+
+        :return: returns nothing
+        """
+
+        logger.info('Sim800', 'Started Service!')
+
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_read, selectors.EVENT_READ)
+        selector.register(self._fileno(), selectors.EVENT_READ)
+
+        try:
+            while not self.running.is_set():
+                # Tokens that were received after the last response are no part of the next one
+                while self._tokens:
+                    self._process_unsolicited(self._tokens.popleft())
+
+                # Write the event to the serial interface and emit the returning value
+                if not self.command_queue.empty():
+                    event, command = self._get_event_from_queue(self.command_queue)
+                    self._queue_changed(command.priority)
+
+                    # Skip commands that nobody waits for anymore
+                    if event.cancelled:
+                        continue
+
+                    # Write the command to the serial interface
+                    self._event = event
+                    self._deadline = time.monotonic() + command.timeout
+                    self._write_command(command)
+
+                    try:
+                        self._verify_echo(command)           # Verify the echo of the command if activated
+                        self._read_response(event)  # Fill the event with the response from the serial interface
+                    except SerialError as e:
+                        # Report the failure immediately and bring the module back in sync
+                        self._fail_event(event, e)
+                        self._resync()
+                        continue
+                    finally:
+                        self._deadline = None
+                        self._event = None
+
+                    self._finish_event(event)
+
+                # If no events are in the queue, wait until data arrives or a command gets queued
+                else:
+                    for key, _ in selector.select():
+                        if key.fd == self._wakeup_read:
+                            self._clear_wakeup()
+                        else:
+                            self._read_idle()
+        finally:
+            selector.close()
+
+    def _read(self):
+        """
+        Reads from the serial interface
+
+        :return: returns the value from the serial interface
+        :rtype: bytearray
+        """
+
+        # When debug mode is enabled get the data from the command line
+        if self.debug:
+            return str.encode(input()) + b'\r\n'
+        else:
+            # Read all available bytes from the serial interface, but at least one
+            data = self.serial.read(self.serial.in_waiting or 1)
+            if data:
+                logger.debug('Sim800', 'Received data from serial interface: ' + str(data))
+                self._received(data)
+            return data
@@ -1,15 +1,30 @@
 import asyncio
+import threading
+import time
+from functools import partial
+from queue import Full
 
 from pyee import EventEmitter
 
 from serial import Serial
 
 from gateway.io.sim800.serial_loop import SerialLoop
-from gateway.io.sim800.at_command import ATCommand
+from gateway.io.sim800.async_serial_loop import AsyncSerialLoop
+from gateway.io.sim800.at_command import ATCommand, Priority
 from gateway.io.sim800.at_event import ATEvent
 from gateway.io.sim800.at_parser import *
 from gateway.io.sim800.at_response import *
-from gateway.utils import clear_str
+from gateway.io.sim800.cmux import CMUX
+from gateway.io.sim800 import pdu
+from gateway.io.sim800.at_tokenizer import BODY_PREFIXES, line_prefix, response_prefixes
+from gateway.io.sim800.metrics import Metrics
+from gateway.io.sim800.response_cache import ResponseCache, URC_INVALIDATIONS
+from gateway.io.sim800.trace import TraceRecorder
+from gateway.utils import clear_str, logger
+
+
+# Commands that answer with lines without their prefix
+_BARE_RESPONSES = {b'+CIMI', b'+GSN', b'+CGSN', b'+GMI', b'+CGMI', b'+GMM', b'+CGMM', b'+GMR', b'+CGMR'}
 
 
 class Sim800Error(Exception):
@@ -22,61 +37,472 @@ def _raise_event_error(event):
     return event
 
 
+def _split_batch(batch_event, events):
+    """
+    Distributes the content of a batch event to the events of the chained commands and parses it.
+
+    :param batch_event: event of the chained command
+    :param events: events of the single commands in the same order as they were chained
+    :return: nothing
+    """
+
+    prefixes = [response_prefixes(event.command.command) for event in events]
+
+    current = 0
+    last = -1
+    for line in batch_event.content:
+        raw = line.encode()
+        prefix = line_prefix(raw) if raw[:1] == b'+' else None
+
+        if prefix is not None:
+            # Lines with a prefix belong to the next command with the same prefix
+            index = next((i for i in range(current, len(events)) if prefix in prefixes[i]), None)
+        elif events[current].content and prefixes[current] & BODY_PREFIXES:
+            # The message of a sms belongs to the listing
+            index = current
+        else:
+            # Lines without a prefix belong to the next command that answers without a prefix
+            index = next((i for i in range(current, len(events))
+                          if prefixes[i] & _BARE_RESPONSES and not events[i].content), None)
+
+        if index is None:
+            logger.error('Sim800', 'BatchError(Unassigned line: {})'.format(line))
+            continue
+
+        events[index].content.append(line)
+        current = index
+        last = max(last, index)
+
+    for index, event in enumerate(events):
+        # The module stops at the first failing command, so all commands after the last answer failed
+        if batch_event.error and index > last:
+            event.error = True
+            event.error_message = batch_event.error_message
+        else:
+            # A malformed answer fails only its own command, every event is still set
+            try:
+                event.data = event.command.parser.parse(event.content)
+            except Exception as e:
+                logger.error('Sim800', 'ParserError({})'.format(e))
+                event.error = True
+                event.error_message = 'ParserError({})'.format(e)
+
+        event.set()
+
+
+class _SMSStream:
+    """
+    Passes the sms of a streamed listing from the serial loop to the coroutine that iterates over them.
+
+    Only a limited number of sms is held, while the consumer is behind the serial loop stops reading.
+    The thread backend blocks its thread and the asyncio backend pauses watching the serial interface,
+    so the rest of the listing waits in the buffers of the serial interface.
+    """
+
+    # Marks the end of the listing in the queue
+    END = object()
+
+    def __init__(self, serial_loop, loop, maxsize):
+        """
+        Construct a new '_SMSStream' object.
+
+        :param serial_loop: serial loop the listing is read with
+        :param loop: event loop of the consumer
+        :param maxsize: maximum number of sms that are received but not consumed
+        :type maxsize: int
+        :return: returns nothing
+        """
+
+        self.parser = SMSStreamParser()
+
+        self._serial_loop = serial_loop
+        self._loop = loop
+        self._maxsize = maxsize
+        self._queue = asyncio.Queue()
+
+        # Number of sms that are passed to the event loop but not consumed, guarded for the thread backend
+        self._pending = 0
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def feed(self, line):
+        """
+        Parses a line of the listing, gets called by the serial loop.
+
+        :param line: line of the listing
+        :type line: str
+        :return: nothing
+        """
+
+        # A malformed sms must not stop the serial loop
+        try:
+            listed = self.parser.feed(line)
+        except Exception as e:
+            logger.error('Sim800', 'ParserError({})'.format(e))
+            return
+
+        for sms in listed:
+            if self._serial_loop.threadsafe:
+                # Block the serial thread until the consumer caught up
+                with self._condition:
+                    self._condition.wait_for(lambda: self._pending < self._maxsize or self._closed)
+                    if self._closed:
+                        return
+                    self._pending += 1
+                self._loop.call_soon_threadsafe(self._queue.put_nowait, sms)
+            elif not self._closed:
+                self._queue.put_nowait(sms)
+                if self._queue.qsize() >= self._maxsize:
+                    self._serial_loop.pause_reading()
+
+    def end(self):
+        """
+        Ends the listing after the serial loop finished the command.
+
+        :return: nothing
+        """
+
+        for sms in self.parser.close():
+            self._queue.put_nowait(sms)
+        self._queue.put_nowait(self.END)
+
+        # The following data is no part of the listing anymore
+        if not self._serial_loop.threadsafe:
+            self._serial_loop.resume_reading()
+
+    async def get(self):
+        """
+        Waits for the next sms.
+
+        :return: SMS object or END
+        """
+
+        sms = await self._queue.get()
+
+        if self._serial_loop.threadsafe:
+            with self._condition:
+                self._pending = max(self._pending - 1, 0)
+                self._condition.notify()
+        elif self._queue.qsize() < self._maxsize:
+            self._serial_loop.resume_reading()
+
+        return sms
+
+    def close(self):
+        """
+        Drops the rest of the listing, e.g. if the consumer stopped the iteration.
+
+        :return: nothing
+        """
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        if not self._serial_loop.threadsafe:
+            self._serial_loop.resume_reading()
+
+
 class Sim800(EventEmitter):
     """
     Sim800 processes AT-Commands over the serial interface
     """
 
-    def __init__(self, serial_port='/dev/serial0', debug=False, loop=asyncio.get_event_loop()):
+    # Baud rates the module is switched to with AT+IPR, ordered from the fastest to the slowest
+    BAUDRATES = (115200, 57600, 38400, 19200, 9600)
+
+    # Time in seconds the module needs to answer the probe of a baud rate
+    PROBE_TIMEOUT = 1
+
+    # Number of commands that have to succeed after switching the baud rate
+    PROBE_COUNT = 3
+
+    # Channels of the multiplexer per priority class. The setup and the status queries run on the
+    # interactive channel, so the unsolicited result codes that are enabled there are reported there.
+    CMUX_CHANNELS = {
+        Priority.CallControl: 1,
+        Priority.Background: 2,
+        Priority.Interactive: 3
+    }
+
+    # Number of commands per priority class that can be queued or processed at the same time
+    QUEUE_LIMITS = {
+        Priority.CallControl: 8,
+        Priority.Interactive: 32,
+        Priority.Background: 16
+    }
+
+    def __init__(self, serial_port='/dev/serial0', debug=False, loop=asyncio.get_event_loop(), backend='thread',
+                 queue_limits=None, cache_ttls=None, baudrate=9600, cmux=False, trace=None):
         """
         Construct a new 'SerialLoop' object.
 
+        Backend can be either 'thread' or 'asyncio'
+        thread: The serial interface is processed in a separate thread
+        asyncio: The serial interface is processed in the event loop
+
+        With cmux the serial interface is multiplexed into a channel per priority class, each with its own
+        serial loop, so e.g. call control is not blocked by a long sms listing.
+
         :param serial_port: port of the serial interface
         :param debug: indicates debug mode
+        :param backend: backend for the serial interface
+        :param queue_limits: dict that maps a priority class to the number of commands that can be queued
+        :param cache_ttls: dict that maps a command e.g. AT+CSQ to the time in seconds its response is cached
+        :param baudrate: baud rate the serial interface is opened with
+        :param cmux: indicates if the serial interface is multiplexed
+        :param trace: path of a file the raw bytes of the serial interface are recorded to, None disables it
         :type serial_port: str
         :type debug: bool
+        :type backend: str
+        :type queue_limits: dict
+        :type cache_ttls: dict
+        :type baudrate: int
+        :type cmux: bool
+        :type trace: str
         :return: returns nothing
         """
 
         super().__init__(scheduler=asyncio.run_coroutine_threadsafe, loop=loop)
 
-        # Create serial loop
-        serial = Serial(serial_port, baudrate=9600, timeout=1)
-        self.serial_loop = SerialLoop(self, serial, debug)
-        if debug:
-            self.serial_loop.echo = False
+        if backend not in ('thread', 'asyncio'):
+            raise ValueError('Backend must be either thread or asyncio')
+
+        serial = Serial(serial_port, baudrate=baudrate, timeout=1)
+
+        # The command line can not be multiplexed
+        self.cmux = None
+        if cmux and not debug:
+            self.cmux = CMUX(serial, channels=len(set(self.CMUX_CHANNELS.values())))
+            self.cmux.start()
+            ports = {priority: self.cmux.channels[dlci] for priority, dlci in self.CMUX_CHANNELS.items()}
+        else:
+            ports = {priority: serial for priority in Priority}
+
+        # Create a serial loop per serial interface
+        serial_loops = {}
+        for port in ports.values():
+            if port not in serial_loops:
+                if backend == 'thread':
+                    serial_loops[port] = SerialLoop(self, port, debug)
+                else:
+                    serial_loops[port] = AsyncSerialLoop(self, port, debug, loop)
+                if debug:
+                    serial_loops[port].echo = False
+
+        self.serial_loops = {priority: serial_loops[port] for priority, port in ports.items()}
+        self._serial_loops = list(serial_loops.values())
+
+        # The serial loop of the interactive commands, that receives the unsolicited result codes
+        self.serial_loop = self.serial_loops[Priority.Interactive]
+
+        # Every serial loop records to the same trace with its own channel and reports to the same metrics
+        self.trace = TraceRecorder(trace) if trace else None
+        self.metrics = Metrics()
+        for channel, serial_loop in enumerate(self._serial_loops):
+            serial_loop.trace = self.trace
+            serial_loop.trace_channel = channel
+            serial_loop.metrics = self.metrics
+
         # Set the event loop
         self._event_loop = loop
 
-        # Start the thread
-        self.serial_loop.start()
+        # The command queues reject commands beyond the limits, coroutines wait for a free slot instead of
+        # blocking the event loop, if a priority class is full
+        limits = dict(self.QUEUE_LIMITS)
+        limits.update(queue_limits or {})
+        for serial_loop in self._serial_loops:
+            serial_loop.command_queue.limits = limits
+        self._queue_slots = {priority: asyncio.Semaphore(limit) for priority, limit in limits.items()}
+
+        # Responses of commands that only read the state, they are dropped when the state changes
+        self.cache = ResponseCache(cache_ttls)
+        for name, commands in URC_INVALIDATIONS.items():
+            self.on(name, partial(self._invalidate_cache, commands))
+
+        # Futures of the events of the read-only commands that are in flight, by their command. They are resolved
+        # when the command is queued, or with None if the caller was cancelled before.
+        self._in_flight = {}
+
+        # Set if the sms commands use the pdu mode instead of the text mode
+        self.pdu_mode = False
+        # Reference number of the next concatenated sms
+        self._sms_reference = 0
+
+        # Start the serial loops
+        for serial_loop in self._serial_loops:
+            serial_loop.start()
 
         self.debug = debug
 
     def close(self):
         """
-        Closes the SerialLoop thread
+        Closes the serial loops and the multiplexer
 
         :return: returns nothing
         :rtype: str
         """
 
-        self.serial_loop.running.set()
+        for serial_loop in self._serial_loops:
+            serial_loop.stop()
 
-    async def write(self, command):
+        if self.cmux is not None:
+            self.cmux.stop()
+
+        if self.trace is not None:
+            self.trace.close()
+
+    def _invalidate_cache(self, commands, data=None):
+        """
+        Drops the cached responses when an unsolicited result code reports a change.
+
+        :param commands: commands whose responses are outdated
+        :param data: parsed data of the result code
+        :return: nothing
+        """
+
+        logger.debug('Sim800', 'Invalidate cached responses: {}'.format(', '.join(commands)))
+        self.cache.invalidate(*commands)
+
+    async def write(self, command, serial_loop=None, stream=None):
         """
         Writes the command to the serial interface.
 
+        Commands with a time to live in the cache are answered from the cache, if the response is still valid.
+        If such a command is already queued or processed, the caller shares its event instead of writing it again.
+
         :param command: command that should be written to the serial interface
+        :param serial_loop: serial loop the command is written with, defaults to the one of its priority class
+        :param stream: callback that gets every line of the response instead of the content of the event,
+                       it gets called from the serial loop
         :return: returns the response event if no callback is set on the command
         """
 
-        event = ATEvent(command.name, command)
-        self.serial_loop.command_queue.put(event)
-
-        await event.wait()
+        serial_loop = serial_loop or self.serial_loops[command.priority]
+
+        key = clear_str(command.command)
+        event = self.cache.get(key) if stream is None else None
+        if event is not None:
+            logger.debug('Sim800', 'Cached response for {}'.format(key))
+            return event
+
+        # Share the event of an identical command that only reads the state. The command is in flight from the
+        # call of the first caller, so the callers that wait for a slot of a full priority class share it too.
+        shareable = stream is None and key in self.cache.ttls
+        while shareable and key in self._in_flight:
+            event = await asyncio.shield(self._in_flight[key])
+
+            # Write the command again, if the first caller was cancelled before its command was written
+            if event is not None and not event.cancelled:
+                logger.debug('Sim800', 'Shared response for {}'.format(key))
+                await self._wait(event)
+                return event
+
+        pending = None
+        if shareable:
+            pending = self._event_loop.create_future()
+            self._in_flight[key] = pending
+
+        # The time waiting for a slot of a full priority class counts to the time the command is queued
+        enqueued = time.monotonic()
+        try:
+            # Wait until the priority class of the command has a free slot
+            async with self._queue_slots[command.priority]:
+                event = ATEvent(command.name, command, loop=self._event_loop, threadsafe=serial_loop.threadsafe,
+                                created=enqueued)
+                event.stream = stream
+                try:
+                    serial_loop.put(event)
+                except Full:
+                    # Commands that were put to the serial loop directly took the free slots
+                    logger.error('Sim800', 'QueueFull({})'.format(command.priority.name))
+                    event.error = True
+                    event.error_message = 'QueueFull({})'.format(command.priority.name)
+                    return event
+
+                if pending is not None:
+                    pending.set_result(event)
+
+                await self._wait(event)
+        finally:
+            if pending is not None:
+                del self._in_flight[key]
+                if not pending.done():
+                    pending.set_result(None)
+
+        if stream is None:
+            self.cache.put(key, event)
         return event
 
+    @staticmethod
+    async def _wait(event):
+        """
+        Waits until the serial loop sets the event.
+
+        The serial loop sets the event with an error if the module does not answer within the timeout.
+
+        :param event: event that was put to the serial loop
+        :return: nothing
+        """
+
+        event.waiters += 1
+        try:
+            await event.wait()
+        except asyncio.CancelledError:
+            # A queued command is skipped, a running command is read to the end to keep the module in sync
+            event.waiters -= 1
+            if not event.waiters:
+                event.cancelled = True
+            raise
+
+    async def batch(self, commands):
+        """
+        Chains several commands and writes them in one transmission, e.g. AT+CSQ;+CREG?;+CPIN?
+
+        Only extended commands (AT+...) can be chained. If the module answers with an error,
+        all commands after the last one that returned data are set with the error.
+
+        :param commands: list of ATCommand objects
+        :return: list of events in the same order as the commands
+        """
+
+        commands = list(commands)
+        events = [ATEvent(command.name, command, loop=self._event_loop, threadsafe=False) for command in commands]
+
+        parts = []
+        for command in commands:
+            part = clear_str(command.command)
+            if not part.startswith('AT+'):
+                raise ValueError('Only extended commands can be chained: {}'.format(part))
+            parts.append(part[2:])
+
+        name = 'Batch({})'.format(','.join(command.name for command in commands))
+        priority = min(command.priority for command in commands)
+        timeout = max(command.timeout for command in commands)
+        # The content is parsed by the parsers of the single commands
+        batch_event = await self.write(ATCommand('AT{}\r\n'.format(';'.join(parts)), name=name, parser=ATParser,
+                                                 priority=priority, timeout=timeout))
+
+        _split_batch(batch_event, events)
+
+        for event in events:
+            self.cache.put(clear_str(event.command.command), event)
+        return events
+
+    async def request_status(self):
+        """
+        Read the signal quality, network status, pin status and imsi with one transmission.
+
+        :return: list of events in that order
+        """
+
+        return await self.batch([
+            ATCommand('AT+CSQ\r\n', name='SignalQuality', parser=SignalQualityParser),
+            ATCommand('AT+CREG?\r\n', name='NetworkStatus', parser=NetworkStatusParser),
+            ATCommand('AT+CPIN?\r\n', name='PINStatus', parser=PinStatusParser),
+            ATCommand('AT+CIMI\r\n', name='IMSI', parser=IMSIParser)
+        ])
+
     async def answer_call(self):
         """
         Answer an incoming call.
@@ -84,7 +510,7 @@ class Sim800(EventEmitter):
         :return: event
         """
 
-        return await self.write(ATCommand('ATA\r\n', name='AnswerCall'))
+        return await self.write(ATCommand('ATA\r\n', name='AnswerCall', priority=Priority.CallControl))
 
     async def hang_up_call(self):
         """
@@ -93,7 +519,7 @@ class Sim800(EventEmitter):
         :return: event
         """
 
-        return await self.write(ATCommand('ATH\r\n', name='HangUpCall'))
+        return await self.write(ATCommand('ATH\r\n', name='HangUpCall', priority=Priority.CallControl))
 
     async def dial_number(self, number):
         """
@@ -106,25 +532,51 @@ class Sim800(EventEmitter):
 
         # Remove all \n and \r from the number
         number = clear_str(number)
-        return await self.write(ATCommand('ATD{};\r\n'.format(number), name='DialNumber'))
+        return await self.write(ATCommand('ATD{};\r\n'.format(number), name='DialNumber',
+                                          priority=Priority.CallControl, timeout=20))
 
-    async def send_sms(self, number, text):
+    async def send_sms(self, number, text, sent=None):
         """
         Send a sms to a participant.
 
+        In pdu mode long texts are sent as concatenated sms and texts with chars that are not in the
+        gsm-7 alphabet are sent in ucs-2. The sending stops at the first part that fails, the parts before
+        it were accepted by the network.
+
+        Event Data: message reference of the sent part
+
         :param number: phone number of the participant
         :param text: message of the sms
+        :param sent: list the message references of the accepted parts are appended to
         :type number: str
         :type text: str
-        :return: event
+        :type sent: list
+        :return: event of the last part or the first part that failed
         """
 
-        # Remove all \n\r from the strings and add <ctrl-Z/ESC> after the message of the sms
+        # Remove all \n\r from the number
         number = clear_str(number)
+
+        if self.pdu_mode:
+            self._sms_reference = (self._sms_reference + 1) % 256
+            for length, data in pdu.encode_sms(number, text, self._sms_reference):
+                event = await self.write(ATCommand('AT+CMGS={}\r'.format(length), name='SendSMS', data=data + '\x1A',
+                                                   parser=SentSMSParser, priority=Priority.Background, timeout=60))
+                if event.error:
+                    break
+                if sent is not None:
+                    sent.append(event.data)
+            return event
+
+        # Remove all \n\r from the message and add <ctrl-Z/ESC> after the message of the sms
         text = clear_str(text)
         text += '\x1A'
 
-        return await self.write(ATCommand('AT+CMGS="{}"\r'.format(number), name='SendSMS', data=text))
+        event = await self.write(ATCommand('AT+CMGS="{}"\r'.format(number), name='SendSMS', data=text,
+                                           parser=SentSMSParser, priority=Priority.Background, timeout=60))
+        if sent is not None and not event.error:
+            sent.append(event.data)
+        return event
 
     async def request_unread_sms(self):
         """
@@ -134,7 +586,9 @@ class Sim800(EventEmitter):
 
         :return: event
         """
-        return await self.write(ATCommand('AT+CMGL="REC UNREAD"\r\n', name='ListUnreadSMS', parser=SMSListParser))
+        stat = '0' if self.pdu_mode else '"REC UNREAD"'
+        return await self.write(ATCommand('AT+CMGL={}\r\n'.format(stat), name='ListUnreadSMS', parser=SMSListParser,
+                                          priority=Priority.Background, timeout=20))
 
     async def request_all_sms(self):
         """
@@ -145,7 +599,84 @@ class Sim800(EventEmitter):
         :return: event
         """
 
-        return await self.write(ATCommand('AT+CMGL="ALL"\r\n', name='ListAllSMS', parser=SMSListParser))
+        stat = '4' if self.pdu_mode else '"ALL"'
+        return await self.write(ATCommand('AT+CMGL={}\r\n'.format(stat), name='ListAllSMS', parser=SMSListParser,
+                                          priority=Priority.Background, timeout=20))
+
+    async def read_sms(self, index):
+        """
+        Read the sms at an index of the storage.
+
+        Event Data: SMS or None if the storage slot is empty
+
+        :param index: index of the sms in the storage
+        :type index: int
+        :return: event
+        """
+
+        event = await self.write(ATCommand('AT+CMGR={}\r\n'.format(index), name='ReadSMS', parser=ReadSMSParser,
+                                           priority=Priority.Background))
+
+        if not event.error and event.data is not None:
+            event.data.index = index
+            event.data.indexes = [index]
+
+        return event
+
+    async def delete_sms(self, index):
+        """
+        Delete the sms at an index of the storage.
+
+        :param index: index of the sms in the storage
+        :type index: int
+        :return: event
+        """
+
+        return await self.write(ATCommand('AT+CMGD={}\r\n'.format(index), name='DeleteSMS',
+                                          priority=Priority.Background))
+
+    async def iter_sms(self, status=None, maxsize=16):
+        """
+        Read the sms like 'request_all_sms()', but yield every sms as soon as its lines are received.
+
+        The sms can be processed while the module is still sending the listing. At most maxsize sms
+        are held, the serial interface is not read while the consumer is behind.
+
+        Usage: async for sms in sim.iter_sms(): ...
+
+        :param status: status of the sms that are read, defaults to all sms
+        :param maxsize: maximum number of sms that are received but not consumed
+        :type status: SMS.Status
+        :type maxsize: int
+        :return: async generator of SMS objects
+        :raise Sim800Error: raises after the last sms if the module answered with an error
+        """
+
+        if status is None:
+            stat = '4' if self.pdu_mode else '"ALL"'
+        else:
+            stat = pdu.STATUS.index(status.value) if self.pdu_mode else '"{}"'.format(status.value)
+
+        serial_loop = self.serial_loops[Priority.Background]
+        stream = _SMSStream(serial_loop, self._event_loop, maxsize)
+
+        command = ATCommand('AT+CMGL={}\r\n'.format(stat), name='ListSMS', priority=Priority.Background, timeout=20)
+        task = asyncio.ensure_future(self.write(command, stream=stream.feed), loop=self._event_loop)
+        task.add_done_callback(lambda _: stream.end())
+
+        try:
+            while True:
+                sms = await stream.get()
+                if sms is stream.END:
+                    break
+                yield sms
+
+            _raise_event_error(task.result())
+        finally:
+            # Stops the listing if the consumer left the iteration early
+            stream.close()
+            if not task.done():
+                task.cancel()
 
     async def set_sms_mode(self, mode=None):
         """
@@ -160,7 +691,12 @@ class Sim800(EventEmitter):
         :return: event
         """
 
-        return await self.write(ATCommand('AT+CMGF={}\r\n'.format(mode), name='SMSMode'))
+        event = await self.write(ATCommand('AT+CMGF={}\r\n'.format(mode), name='SMSMode'))
+
+        if not event.error:
+            self.pdu_mode = not mode
+
+        return event
 
     async def power_off(self, mode):
         """
@@ -174,6 +710,7 @@ class Sim800(EventEmitter):
         :return: event
         """
 
+        self.cache.invalidate()
         return await self.write(ATCommand('AT+CPOWD={}\r\n'.format(mode), name='PowerOff'))
 
     async def request_signal_quality(self):
@@ -194,6 +731,7 @@ class Sim800(EventEmitter):
         :return: event
         """
 
+        self.cache.invalidate()
         return await self.write(ATCommand('ATZ\r\n', name='ResetDefaultConfiguration'))
 
     async def enter_pin(self, pin):
@@ -204,7 +742,12 @@ class Sim800(EventEmitter):
         :return: event
         """
 
-        return await self.write(ATCommand('AT+CPIN={}\r\n'.format(pin), name='EnterPIN'))
+        # The set command is only answered with a result code, so the registered +CPIN parser does not apply
+        event = await self.write(ATCommand('AT+CPIN={}\r\n'.format(pin), name='EnterPIN', parser=ATParser))
+
+        # The pin status and the data of the sim card change after the pin got entered
+        self.cache.invalidate(*URC_INVALIDATIONS['pin_status'])
+        return event
 
     async def request_pin_status(self):
         """
@@ -241,23 +784,66 @@ class Sim800(EventEmitter):
 
     async def set_echo_mode(self, mode):
         """
-        Set the echo mode.
+        Set the echo mode on every channel.
 
         0: Echo mode off
         1: Echo mode on
 
         :param mode: echo mode
         :type mode: int
-        :return: event
+        :return: event of the last channel or the first one that failed
         """
 
-        event = await self.write(ATCommand('ATE{}\r\n'.format(mode), name='EchoMode'))
+        for serial_loop in self._serial_loops:
+            event = await self.write(ATCommand('ATE{}\r\n'.format(mode), name='EchoMode'), serial_loop)
+            if event.error:
+                break
 
-        if not event.error:
-            self.serial_loop.echo = bool(mode)
+            serial_loop.echo = bool(mode)
 
         return event
 
+    async def set_result_code_mode(self, mode):
+        """
+        Set the format of the result codes on every channel.
+
+        0: Numeric result codes e.g. 0 instead of OK
+        1: Verbose result codes
+
+        :param mode: result code mode
+        :type mode: int
+        :return: event of the last channel or the first one that failed
+        """
+
+        for serial_loop in self._serial_loops:
+            tokenizer = serial_loop.tokenizer
+
+            # The response of ATV0 is already numeric, the tokenizer understands both formats in numeric mode
+            tokenizer.numeric = True
+            event = await self.write(ATCommand('ATV{}\r\n'.format(mode), name='ResultCodeMode'), serial_loop)
+            if event.error:
+                break
+
+            tokenizer.numeric = not mode
+
+        return event
+
+    async def set_link_mode(self, low_overhead):
+        """
+        Set echo and the format of the result codes for the serial link.
+
+        In the low overhead mode, echo is turned off and result codes are sent as numbers,
+        which saves the transmission and the verification of the echo.
+
+        :param low_overhead: indicates the low overhead mode
+        :type low_overhead: bool
+        :return: nothing
+        :raise Sim800Error: raises if the module does not accept a command
+        """
+
+        _raise_event_error(await self.set_echo_mode(int(not low_overhead)))
+        _raise_event_error(await self.set_result_code_mode(int(not low_overhead)))
+
     async def set_caller_identification_mode(self, mode):
         """
         Set the caller identification mode.
@@ -277,6 +863,27 @@ class Sim800(EventEmitter):
 
         return event
 
+    async def set_network_registration_mode(self, mode):
+        """
+        Set the network registration mode.
+
+        0: No network registration result code
+        1: Get +CREG when the network registration changes, that invalidates the cached registration
+        2: Get +CREG with the location information
+
+        :param mode: network registration mode
+        :type mode: int
+        :return: event
+        """
+
+        event = await self.write(ATCommand('AT+CREG={}\r\n'.format(mode), name='NetworkRegistrationMode'))
+
+        # The mode is the first field of the response to AT+CREG?
+        if not event.error:
+            self.cache.invalidate('AT+CREG?')
+
+        return event
+
     async def set_error_mode(self, mode):
         """
         Set the error mode.
@@ -296,11 +903,110 @@ class Sim800(EventEmitter):
         """
         Read the subscriber number and additional parameters.
 
-        :return: event
+        :return: event, its data is None if no number is stored on the sim card
         """
 
         return await self.write(ATCommand('AT+CNUM\r\n', name='SubscriberNumber'))
 
+    async def probe(self, count=1):
+        """
+        Checks if the module answers a bare AT command with the current baud rate.
+
+        :param count: number of commands that have to succeed
+        :type count: int
+        :return: boolean that indicates if all commands succeeded
+        """
+
+        for _ in range(count):
+            event = await self.write(ATCommand('AT\r\n', name='Attention', timeout=self.PROBE_TIMEOUT))
+            if event.error:
+                return False
+        return True
+
+    def _set_baudrate(self, baudrate):
+        """
+        Changes the baud rate of the serial interface and discards the data that was received with the old one.
+
+        :param baudrate: baud rate
+        :type baudrate: int
+        :return: nothing
+        """
+
+        serial = self.serial_loop.serial
+        serial.baudrate = baudrate
+        serial.reset_input_buffer()
+
+    async def _find_baudrate(self):
+        """
+        Probes the current and then all other baud rates until the module answers.
+
+        :return: the baud rate the module is using
+        :rtype: int
+        :raise Sim800Error: raises if the module answers with none of the baud rates
+        """
+
+        current = self.serial_loop.serial.baudrate
+        for baudrate in [current] + [rate for rate in self.BAUDRATES if rate != current]:
+            self._set_baudrate(baudrate)
+            if await self.probe():
+                return baudrate
+
+        raise Sim800Error('NegotiateBaudrate', 'Module does not answer')
+
+    async def negotiate_baudrate(self, baudrates=None):
+        """
+        Switches the module and the serial interface to the fastest baud rate that works.
+
+        First the baud rate of the module is found by probing the current and then all other baud rates.
+        Then each baud rate, starting with the fastest one, is set with AT+IPR and verified with several
+        commands. If the link is not stable, the module is switched back and the next slower rate is tried.
+
+        :param baudrates: baud rates that may be used, defaults to BAUDRATES
+        :type baudrates: list
+        :return: the baud rate that is used or None in debug mode
+        :rtype: int
+        :raise Sim800Error: raises if the module answers with none of the baud rates
+        """
+
+        # The command line has no baud rate
+        if self.debug:
+            return None
+
+        # The baud rate can not be changed while the serial interface is multiplexed
+        if self.cmux is not None:
+            logger.info('Sim800', 'Baud rate is fixed while multiplexed')
+            return self.cmux.serial.baudrate
+
+        baudrates = sorted(baudrates or self.BAUDRATES, reverse=True)
+        current = await self._find_baudrate()
+
+        logger.info('Sim800', 'Module answers with {} baud'.format(current))
+
+        for baudrate in baudrates:
+            if baudrate == current:
+                break
+
+            # The module answers with the old baud rate and switches afterwards
+            event = await self.write(ATCommand('AT+IPR={}\r\n'.format(baudrate), name='SetBaudrate'))
+            if event.error:
+                continue
+
+            self._set_baudrate(baudrate)
+            if await self.probe(self.PROBE_COUNT):
+                current = baudrate
+                break
+
+            logger.error('Sim800', 'BaudrateError(Link not stable with {} baud)'.format(baudrate))
+
+            # Switch back to the last working baud rate, the command gets maybe garbled on an unstable link
+            await self.write(ATCommand('AT+IPR={}\r\n'.format(current), name='SetBaudrate'))
+            self._set_baudrate(current)
+            if not await self.probe():
+                current = await self._find_baudrate()
+
+        logger.info('Sim800', 'Using {} baud'.format(current))
+        return current
+
     async def request_imsi(self):
         """
         Read the operator imsi.
@@ -308,7 +1014,7 @@ class Sim800(EventEmitter):
         :return: event
         """
 
-        return await self.write(ATCommand('AT+CIMI\r\n', name='IMSI', parser=IMEIParser))
+        return await self.write(ATCommand('AT+CIMI\r\n', name='IMSI', parser=IMSIParser))
 
     async def transmit_dtmf_tone(self, tone):
         """
@@ -319,32 +1025,40 @@ class Sim800(EventEmitter):
         :type tone: str
         :return: event
         """
-        return await self.write(ATCommand('AT+VTS="{}"\r\n'.format(tone), name='DTMFTone'))
+        return await self.write(ATCommand('AT+VTS="{}"\r\n'.format(tone), name='DTMFTone',
+                                          priority=Priority.CallControl))
 
     # TODO: Fill in the right parameter for n in hold_call and resume_call
 
     async def hold_call(self):
-        return await self.write(ATCommand('AT+CHLD=n\r\n', name='CallHold'))
+        return await self.write(ATCommand('AT+CHLD=n\r\n', name='CallHold', priority=Priority.CallControl))
 
     async def resume_call(self):
-        return await self.write(ATCommand('AT+CHLD=n\r\n', name='CallResume'))
+        return await self.write(ATCommand('AT+CHLD=n\r\n', name='CallResume', priority=Priority.CallControl))
 
-    async def setup(self, pin=None):
+    async def setup(self, pin=None, low_overhead=True):
         """
-        Setup the module to return error codes and set sms commands to text mode.
+        Setup the module to return error codes and set sms commands to pdu mode.
 
+        :param pin: pin of the sim card
+        :param low_overhead: indicates if the link is set to the low overhead mode
+        :type low_overhead: bool
         :return: nothing
         """
 
         try:
+            if low_overhead:
+                await self.set_link_mode(True)
 
             if pin:
                 event = _raise_event_error(await self.request_pin_status())
                 if event.data != PINStatus.Ready:
                     _raise_event_error(await self.enter_pin(pin))
 
-            _raise_event_error(await self.set_sms_mode(1))
+            _raise_event_error(await self.set_sms_mode(0))
             _raise_event_error(await self.set_error_mode(1))
             _raise_event_error(await self.set_caller_identification_mode(1))
+            # The cached registration is invalidated by the result code instead of being served until it expires
+            _raise_event_error(await self.set_network_registration_mode(1))
         except Sim800Error:
             raise
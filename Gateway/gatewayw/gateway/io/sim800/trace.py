@@ -0,0 +1,327 @@
+import argparse
+import os
+import struct
+import threading
+import time
+import tty
+from collections import namedtuple
+
+from gateway.utils import logger
+
+
+# The file starts with the magic and the wall clock time the recording started. Every record has a header with the
+# channel and direction, the time in microseconds since the start and the length of the data that follows.
+MAGIC = b'GWT1'
+HEADER = struct.Struct('<4sd')
+RECORD = struct.Struct('<BQH')
+
+# Directions of the data
+RECEIVED = 0
+WRITTEN = 1
+
+# Size of the buffer that is written to the file at once
+FLUSH_SIZE = 64 * 1024
+
+TraceRecord = namedtuple('TraceRecord', ('time', 'channel', 'direction', 'data'))
+
+
+class TraceRecorder:
+    """
+    Records the raw bytes of the serial interface in both directions to a binary trace file.
+
+    Records are collected in a buffer, so a record costs a struct pack and a copy and never touches the file.
+    A writer thread writes the buffer when it is full or the flush interval passed, so the file is not written
+    from the event loop of the asyncio backend. If the file reaches its maximum size, it is moved to path.1 and
+    a new file is started.
+    """
+
+    def __init__(self, path, max_size=16 * 1024 * 1024, flush_interval=1.0):
+        """
+        Construct a new 'TraceRecorder' object.
+
+        :param path: path of the trace file
+        :param max_size: size in bytes after which the file is rotated
+        :param flush_interval: seconds after which the buffered records are written
+        :type path: str
+        :type max_size: int
+        :type flush_interval: float
+        :return: returns nothing
+        """
+
+        self.path = path
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+
+        # Guards the buffer, the file is only written while holding the io lock, so the buffers are written in order
+        self._condition = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._buffer = bytearray()
+        self._closed = False
+
+        self._file = None
+        self._size = 0
+        # The times of all files are relative to the start of the recording
+        self._start = time.monotonic()
+        self._started_at = time.time()
+        self._open()
+
+        self._writer = threading.Thread(target=self._write_loop, name='TraceRecorder', daemon=True)
+        self._writer.start()
+
+    def _open(self):
+        self._file = open(self.path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, self._started_at))
+        self._file.flush()
+        self._size = HEADER.size
+
+    def record(self, direction, data, channel=0):
+        """
+        Adds the data to the trace.
+
+        :param direction: RECEIVED or WRITTEN
+        :param data: raw bytes of the serial interface
+        :param channel: number of the serial loop, if the interface is multiplexed
+        :type direction: int
+        :type data: bytes
+        :type channel: int
+        :return: nothing
+        """
+
+        with self._condition:
+            if self._closed:
+                return
+
+            elapsed = int((time.monotonic() - self._start) * 1e6)
+            for start in range(0, len(data), 0xFFFF):
+                chunk = data[start:start + 0xFFFF]
+                self._buffer += RECORD.pack(channel << 1 | direction, elapsed, len(chunk))
+                self._buffer += chunk
+
+            if len(self._buffer) >= FLUSH_SIZE:
+                self._condition.notify()
+
+    def _write_loop(self):
+        """
+        Writes the buffer when it is full or the flush interval passed, until the recorder is closed.
+
+        :return: nothing
+        """
+
+        while True:
+            with self._condition:
+                if not self._closed and len(self._buffer) < FLUSH_SIZE:
+                    self._condition.wait(self.flush_interval)
+                if self._closed:
+                    return
+
+            self._flush()
+
+    def _flush(self):
+        with self._io_lock:
+            with self._condition:
+                data, self._buffer = self._buffer, bytearray()
+
+            if not data or self._file is None:
+                return
+
+            try:
+                self._file.write(data)
+                self._file.flush()
+                self._size += len(data)
+
+                if self._size >= self.max_size:
+                    self._file.close()
+                    os.replace(self.path, self.path + '.1')
+                    self._open()
+            except OSError as e:
+                logger.error('Sim800', 'TraceError({})'.format(e))
+
+    def flush(self):
+        """
+        Writes the buffered records to the file.
+
+        :return: nothing
+        """
+
+        self._flush()
+
+    def close(self):
+        """
+        Stops the writer thread, writes the buffered records and closes the file.
+
+        :return: nothing
+        """
+
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+
+        self._writer.join()
+        self._flush()
+
+        with self._io_lock:
+            self._file.close()
+            self._file = None
+
+
+def read_trace(path):
+    """
+    Reads the records of a trace file.
+
+    :param path: path of the trace file
+    :type path: str
+    :return: generator of TraceRecord objects, the time is in seconds since the start of the recording
+    :raise ValueError: raises if the file is no trace
+    """
+
+    with open(path, 'rb') as f:
+        magic, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('Invalid trace file: {}'.format(path))
+
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+
+            kind, elapsed, length = RECORD.unpack(header)
+            yield TraceRecord(elapsed / 1e6, kind >> 1, kind & 1, f.read(length))
+
+
+class TraceReplayer(threading.Thread):
+    """
+    Plays the received data of a trace back on a pseudo-terminal, that can be opened by 'Sim800(serial_port=...)'.
+
+    The received data that followed a written record is only sent after the same bytes were written again,
+    so the responses arrive in the same order relative to the commands as in the recording. Written bytes that
+    differ from the recording are collected in mismatches. The delays between the records are divided by the
+    speed, a speed of None sends the data as fast as possible.
+    """
+
+    def __init__(self, path, speed=1.0, channel=0):
+        """
+        Construct a new 'TraceReplayer' object.
+
+        :param path: path of the trace file
+        :param speed: factor the replay is accelerated with or None for no delays
+        :param channel: channel of the trace that is replayed
+        :type path: str
+        :type speed: float
+        :type channel: int
+        :return: returns nothing
+        """
+
+        super().__init__()
+        self.daemon = True
+
+        self.records = [record for record in read_trace(path) if record.channel == channel]
+        self.speed = speed
+
+        # Pairs of the recorded and the actually written bytes, that differ
+        self.mismatches = []
+        # Set when all records were replayed
+        self.done = threading.Event()
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+
+        # Port that can be opened by 'Sim800(serial_port=...)'
+        self.port = os.ttyname(self._slave)
+
+        self._written = bytearray()
+        self._running = threading.Event()
+
+    def commands(self):
+        """
+        Returns the command lines that were written in the recording.
+
+        :return: list of commands without the carriage return e.g. ['AT+CSQ']
+        :rtype: list
+        """
+
+        data = b''.join(record.data for record in self.records if record.direction == WRITTEN)
+        return [line.decode() for line in data.split(b'\r') if line.strip()]
+
+    def close(self):
+        """
+        Stops the replay and closes both ends of the pseudo-terminal.
+
+        :return: nothing
+        """
+
+        self._running.set()
+        if self._slave is not None:
+            os.close(self._slave)
+            self._slave = None
+
+        # Closing the slave fails the read of the master, so the thread stops before the master is closed
+        if self.is_alive():
+            self.join(1)
+
+        if self._master is not None:
+            os.close(self._master)
+            self._master = None
+
+    def _wait_written(self, expected):
+        """
+        Reads from the pseudo-terminal until the expected bytes were written.
+
+        :param expected: recorded bytes
+        :type expected: bytes
+        :return: boolean that indicates if the bytes arrived before the replay was stopped
+        """
+
+        while len(self._written) < len(expected):
+            try:
+                self._written += os.read(self._master, 1024)
+            except OSError:
+                return False
+
+        actual = bytes(self._written[:len(expected)])
+        del self._written[:len(expected)]
+        if actual != expected:
+            self.mismatches.append((expected, actual))
+        return True
+
+    def run(self):
+        # Times of the last record that the replay waited for, in the recording and in the replay
+        anchor = self.records[0].time if self.records else 0
+        anchor_replay = time.monotonic()
+
+        for record in self.records:
+            if self._running.is_set():
+                break
+
+            if record.direction == WRITTEN:
+                if not self._wait_written(record.data):
+                    break
+                anchor, anchor_replay = record.time, time.monotonic()
+                continue
+
+            if self.speed:
+                delay = anchor_replay + (record.time - anchor) / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            try:
+                os.write(self._master, record.data)
+            except OSError:
+                break
+
+        self.done.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prints the records of a serial trace.')
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    for record in read_trace(args.path):
+        print('{:12.6f} {} {} {}'.format(record.time, record.channel, '<' if record.direction == RECEIVED else '>',
+                                         record.data))
+
+
+if __name__ == '__main__':
+    main()
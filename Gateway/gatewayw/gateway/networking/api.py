@@ -140,6 +140,18 @@ class API(EventEmitter):
         if status != 200:
             logger.error('API', 'BroadcastError')
 
+    def push_sms(self, sms):
+        data, status = self.broadcast_notification('incomingSMS', data={
+            'number': sms.address,
+            'message': sms.message,
+            'time': sms.time.isoformat() if sms.time else None,
+            'gateway': self.id
+        }, silent=True)
+
+        if status != 200:
+            logger.error('API', 'PushSMSError')
+        return status == 200
+
     def push_error(self, code, message):
         data, status = self.broadcast_notification('gatewayError', data={
             'code': code,
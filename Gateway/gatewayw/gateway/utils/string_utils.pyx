@@ -2,6 +2,11 @@
 # distutils: include_dirs = lib/stringlib/
 # cython: language_level=3
 
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from cpython.mem cimport PyMem_Malloc, PyMem_Free
+from cpython.unicode cimport PyUnicode_DecodeUTF8, PyUnicode_AsUTF8AndSize
+from libc.string cimport memchr
+
 import re
 
 #
@@ -18,25 +23,92 @@ cdef extern from "../../lib/stringlib/stringlib.h":
 
     args_t *split_command(char *command, short buffer_size)
     void dealloc_args(args_t * args)
+    size_t split_fields(const char *data, size_t length, size_t *bounds, size_t capacity)
+
+
+# Number of fields whose bounds fit on the stack, longer lines allocate the bounds once
+cdef enum:
+    STACK_FIELDS = 32
+
+
+cdef list _split(data, const char *begin, Py_ssize_t start, Py_ssize_t length, bint decode):
+    cdef size_t stack_bounds[2 * STACK_FIELDS]
+    cdef size_t *bounds = stack_bounds
+    cdef size_t count
+    cdef size_t i
+    cdef list fields = []
+
+    if length <= 0:
+        return ['' if decode else data[start:start]]
 
+    begin += start
+    count = split_fields(begin, length, bounds, STACK_FIELDS)
 
-cpdef split_str(s):
+    if count > STACK_FIELDS:
+        bounds = <size_t *> PyMem_Malloc(2 * count * sizeof(size_t))
+        if bounds == NULL:
+            raise MemoryError()
+        split_fields(begin, length, bounds, count)
+
+    try:
+        for i in range(count):
+            if decode:
+                fields.append(PyUnicode_DecodeUTF8(begin + bounds[2 * i], bounds[2 * i + 1] - bounds[2 * i], NULL))
+            elif type(data) is bytes:
+                fields.append(PyBytes_FromStringAndSize(begin + bounds[2 * i], bounds[2 * i + 1] - bounds[2 * i]))
+            else:
+                fields.append(data[start + bounds[2 * i]:start + bounds[2 * i + 1]])
+    finally:
+        if bounds != stack_bounds:
+            PyMem_Free(bounds)
+
+    return fields
+
+
+cpdef list split_fields_bytes(data, Py_ssize_t start=0):
     """
-    Splits the passed str after the colon by comma character.
+    Splits the passed bytes by comma character, but commas within double quotes do not split.
+
+    The fields are slices of data, so the fields of a memoryview are memoryviews of the same buffer.
+
+    :param data: bytes, bytearray or memoryview
+    :param start: offset of the first field e.g. after the colon
+    :return: list of slices of data
+    """
+
+    cdef const unsigned char[:] view
+
+    if start < 0:
+        raise ValueError('Negative start: {}'.format(start))
+
+    if type(data) is bytes:
+        return _split(data, <const char *> data, start, len(data) - start, False)
+
+    view = data
+    if view.shape[0] == 0:
+        return [data[0:0]]
+    return _split(data, <const char *> &view[0], start, view.shape[0] - start, False)
+
+
+cpdef split_str(s, Py_ssize_t start=-1):
+    """
+    Splits the passed str after the colon by comma character, but commas within double quotes do not split.
+    Without a colon the whole str is split.
 
     :param s: string that should be split
+    :param start: offset of the first field instead of the colon, the characters before must be ascii
     :return: array of strings
     """
 
-    cdef args_t * args_ptr = split_command(s.encode(), 10)
-
-    splitted = []
-    for i in range(args_ptr.size):
-        splitted.append(args_ptr.args[i].decode("utf-8"))
+    cdef Py_ssize_t size
+    cdef const char *begin = PyUnicode_AsUTF8AndSize(s, &size)
+    cdef const char *colon
 
-    dealloc_args(args_ptr)
+    if start < 0:
+        colon = <const char *> memchr(begin, b':', size)
+        start = colon - begin + 1 if colon != NULL else 0
 
-    return splitted
+    return _split(s, begin, start, size - start, True)
 
 
 def clear_str(string):
@@ -0,0 +1,17 @@
+"""
+Loads the operators module of the gateway by its path, so the helper scripts run standalone without importing the
+gateway package and its compiled extensions.
+"""
+
+import importlib.util
+import os
+
+PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'gateway', 'io', 'sim800', 'operators.py')
+
+_spec = importlib.util.spec_from_file_location('apn_operators', PATH)
+_operators = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_operators)
+
+merge_operator = _operators.merge_operator
+write_index = _operators.write_index
+OperatorIndex = _operators.OperatorIndex
@@ -1,44 +1,82 @@
 #!/usr/local/bin/python3.6
+"""
+Converts an xhtml table of the mobile country and network codes into the apn-conf.json of the gateway and optionally
+its binary operator index.
+
+The script runs standalone, the operators module is loaded by its path instead of importing the gateway package:
+
+    python3.6 gatewayw/helper/parse-xhtml-apns.py -i mcc-mnc.xhtml -o etc/apn-conf.json --index etc/apn-conf.idx
+
+The index of an existing apn-conf.json is written with:
+
+    python3.6 gatewayw/gateway/io/sim800/operators.py etc/apn-conf.json etc/apn-conf.idx
+
+The build script writes the index into the package, it is installed to /etc/gateway with the apn-conf.json.
+"""
 
 import json
 import argparse
 from xml.etree import ElementTree
 
-apns = {}
+from apn_operators import merge_operator, write_index
+
+
+def parse(path, apns):
+    """
+    Merges the rows of a xhtml table of mcc and mnc into the operators. The table is parsed as a stream and every
+    row is cleared after it was read, so the table is never loaded at once.
+    """
+
+    context = ElementTree.iterparse(path, events=('start', 'end'))
+    _, table = next(context)
+
+    headers = None
+    depth = 1
+
+    for event, element in context:
+        if event == 'start':
+            depth += 1
+            continue
+
+        depth -= 1
+        # The rows are the children of the table
+        if depth != 1:
+            continue
+
+        values = [col.text for col in element]
+        if headers is None:
+            headers = values
+        else:
+            a = dict(zip(headers, values))
+            merge_operator(apns, a['MCC'], a['MNC'], a['Network'], a['Country'], a['ISO'])
+
+        table.clear()
 
 
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='XHTML APN to Json Parser.')
-    parser.add_argument('--input', '-i')
+    parser.add_argument('--input', '-i', action='append', help='xhtml table, can be given multiple times')
     parser.add_argument('--output', '-o')
+    parser.add_argument('--merge', '-m', help='existing json whose operators are merged with the input')
+    parser.add_argument('--indent', type=int, help='indentation of the json, compact if omitted')
+    parser.add_argument('--index', help='path of the binary operator index that is written as well')
 
     args = parser.parse_args()
 
-    INPUT_FILE = args.input or 'apn-conf.xhtml'
+    INPUT_FILES = args.input or ['apn-conf.xhtml']
     OUTPUT_FILE = args.output or 'apn-conf.json'
 
-    with open(INPUT_FILE, 'r') as f:
-        s = f.read()
-
-    table = ElementTree.XML(s)
-    rows = iter(table)
-    headers = [col.text for col in next(rows)]
-    for row in rows:
-        values = [col.text for col in row]
-        a = dict(zip(headers, values))
-        ctr_code = a['MCC']
-        oper_code = a['MNC']
-        network = a['Network']
-        country = a['Country']
-        iso = a['ISO']
+    apns = {}
+    if args.merge:
+        with open(args.merge) as file:
+            apns = json.load(file)
 
-        if ctr_code not in apns:
-            apns[ctr_code] = {}
-
-        apns[ctr_code][oper_code] = network
-        apns[ctr_code]['country'] = country
-        apns[ctr_code]['iso'] = iso
+    for input_file in INPUT_FILES:
+        parse(input_file, apns)
 
     with open(OUTPUT_FILE, 'w') as file:
-        json.dump(apns, file, indent=4)
+        json.dump(apns, file, indent=args.indent, separators=None if args.indent else (',', ':'))
+
+    if args.index:
+        write_index(apns, args.index)
@@ -1,36 +1,64 @@
 #!/usr/local/bin/python3.6
+"""
+Converts an android apn configuration into the apn-conf.json of the gateway and optionally its binary operator index.
+
+The script runs standalone, the operators module is loaded by its path instead of importing the gateway package:
+
+    python3.6 gatewayw/helper/parse-xml-apns.py -i apn-conf.xml -o etc/apn-conf.json --index etc/apn-conf.idx
+
+The index of an existing apn-conf.json is written with:
+
+    python3.6 gatewayw/gateway/io/sim800/operators.py etc/apn-conf.json etc/apn-conf.idx
+
+The build script writes the index into the package, it is installed to /etc/gateway with the apn-conf.json.
+"""
 
 import json
 import xml.etree.ElementTree
 import argparse
 
-apns = {}
+from apn_operators import merge_operator, write_index
+
+
+def parse(path, apns):
+    """
+    Merges the apns of an android apn configuration into the operators. The file is parsed as a stream and the
+    elements are cleared after they were read, so the tree is never loaded at once.
+    """
+
+    context = xml.etree.ElementTree.iterparse(path, events=('start', 'end'))
+    _, root = next(context)
+
+    for event, element in context:
+        if event == 'end' and element.tag == 'apn':
+            merge_operator(apns, element.get('mcc'), element.get('mnc'), element.get('carrier'))
+            root.clear()
 
 
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='XML APN to Json Parser.')
-    parser.add_argument('--input', '-i')
+    parser.add_argument('--input', '-i', action='append', help='apn configuration, can be given multiple times')
     parser.add_argument('--output', '-o')
+    parser.add_argument('--merge', '-m', help='existing json whose operators are merged with the input')
+    parser.add_argument('--indent', type=int, help='indentation of the json, compact if omitted')
+    parser.add_argument('--index', help='path of the binary operator index that is written as well')
 
     args = parser.parse_args()
 
-    INPUT_FILE = args.input or 'apn-conf.xml'
+    INPUT_FILES = args.input or ['apn-conf.xml']
     OUTPUT_FILE = args.output or 'apn-conf.json'
 
-    e = xml.etree.ElementTree.parse(INPUT_FILE).getroot()
+    apns = {}
+    if args.merge:
+        with open(args.merge) as file:
+            apns = json.load(file)
 
-    for t in e.findall('apn'):
-        ctr_code = t.get('mcc')
-        oper_code = t.get('mnc')
-        carrier = t.get('carrier')
-
-        if ctr_code not in apns:
-            apns[ctr_code] = {}
-
-        apns[ctr_code][oper_code] = carrier
-        apns[ctr_code]['iso'] = None
-        apns[ctr_code]['country'] = None
+    for input_file in INPUT_FILES:
+        parse(input_file, apns)
 
     with open(OUTPUT_FILE, 'w') as file:
-                json.dump(apns, file, indent=4)
+        json.dump(apns, file, indent=args.indent, separators=None if args.indent else (',', ':'))
+
+    if args.index:
+        write_index(apns, args.index)
@@ -16,7 +16,46 @@ void dealloc_args(args_t *args)
     free(args);
 }
 
-/* Returns all args in a string after a ':' that are seperatet with ','.
+/* Splits data into fields that are seperated with ','. Commas within double quotes do not seperate fields.
+   The start and end offsets of the first capacity fields are written to bounds, field i is
+   data[bounds[2 * i]] until data[bounds[2 * i + 1]]. Nothing is allocated and data is not changed.
+   Returns the number of fields, if it is larger than capacity call it again with more bounds. */
+size_t split_fields(const char *data, size_t length, size_t *bounds, size_t capacity)
+{
+    size_t count = 0;
+    size_t start = 0;
+    int quoted = 0;
+
+    for (size_t i = 0; i < length; i++)
+    {
+        if (data[i] == '"')
+        {
+            quoted = !quoted;
+        }
+        else if (data[i] == ',' && !quoted)
+        {
+            if (count < capacity)
+            {
+                bounds[2 * count] = start;
+                bounds[2 * count + 1] = i;
+            }
+            count++;
+            start = i + 1;
+        }
+    }
+
+    if (count < capacity)
+    {
+        bounds[2 * count] = start;
+        bounds[2 * count + 1] = length;
+    }
+
+    return count + 1;
+}
+
+/* Returns all args in a string after a ':' that are seperatet with ','. Without a ':' the whole string is split.
+   Commas within double quotes do not seperate args. The buffer_size is only a hint,
+   the args are counted before, so any number of args fits into the struct.
    The args struct must be freed with dealloc_args() after using it. */
 args_t *split_command(char *command, short buffer_size)
 {
@@ -25,36 +64,38 @@ args_t *split_command(char *command, short buffer_size)
     for (arg_index = 0; command[arg_index] != '\0' && command[arg_index] != ':'; arg_index++)
         ;
 
-    char *args_start = command + arg_index + 1;
+    char *args_start = command[arg_index] == ':' ? command + arg_index + 1 : command;
+    size_t len = strlen(args_start);
+    size_t arg_count = split_fields(args_start, len, NULL, 0);
+
+    if (arg_count < (size_t)buffer_size)
+        arg_count = (size_t)buffer_size;
 
     args_t *ret = malloc(sizeof(args_t));
-    ret->arg_str = malloc((strlen(args_start) + 1) * sizeof(char));
-    ret->args = malloc(buffer_size * sizeof(char *));
+    ret->arg_str = malloc((len + 1) * sizeof(char));
+    ret->args = malloc(arg_count * sizeof(char *));
 
     strcpy(ret->arg_str, args_start);
     char *arg_str = ret->arg_str;
 
-    char *current_pos = arg_str;
-
-    char **args = ret->args;
-    char **current_args = args;
-
-    *current_args = current_pos;
+    char **current_args = ret->args;
+    *current_args = arg_str;
     current_args++;
 
-    size_t len = strlen(arg_str);
-
-    size_t arg_count = 1;
+    arg_count = 1;
+    int quoted = 0;
 
-    int k;
-    for (k = 0; k < len; k++)
+    for (size_t k = 0; k < len; k++)
     {
-        current_pos++;
-        if (arg_str[k] == ',')
+        if (arg_str[k] == '"')
+        {
+            quoted = !quoted;
+        }
+        else if (arg_str[k] == ',' && !quoted)
         {
             arg_count++;
             arg_str[k] = '\0';
-            *current_args = current_pos;
+            *current_args = arg_str + k + 1;
             current_args++;
         }
     }
@@ -28,6 +28,8 @@ typedef struct args_t
 
 args_t *split_command(char *command, short buffer_size);
 
+size_t split_fields(const char *data, size_t length, size_t *bounds, size_t capacity);
+
 void dealloc_args(args_t *args);
 
 #endif
\ No newline at end of file
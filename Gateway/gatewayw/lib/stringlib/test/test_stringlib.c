@@ -37,8 +37,30 @@ void test_split_command()
 }
 
 
+void test_split_fields()
+{
+    size_t bounds[2 * 4];
+
+    char *str = "1,\"REC READ\",\"+436501234567\",\"Doe, John\",\"19/03/14,12:30:45+04\"";
+    size_t len = strlen(str);
+
+    printf("Testing with string: %s\n", str);
+
+    size_t count = split_fields(str, len, bounds, 4);
+
+    printf("Number of fields: %zu\n", count);
+
+    for (size_t i = 0; i < count && i < 4; i++)
+    {
+        printf("Field [%zu]; %.*s\n", i, (int)(bounds[2 * i + 1] - bounds[2 * i]), str + bounds[2 * i]);
+    }
+}
+
+
 int main()
 {
     printf("Testing split commands...\n");
     test_split_command();
+    printf("Testing split fields...\n");
+    test_split_fields();
 }
@@ -0,0 +1,198 @@
+from gateway.io.sim800.async_serial_loop import AsyncSerialLoop
+from gateway.io.sim800 import ATEvent, ATCommand, at_parser
+from gateway.io.sim800.at_tokenizer import Token, TokenType
+import asyncio
+import os
+import pytest
+from unittest.mock import Mock, patch
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def pipe():
+    read_fd, write_fd = os.pipe()
+    yield read_fd, write_fd
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+@pytest.fixture
+def emitter_mock():
+    mock = Mock()
+    attrs = {'emit.return_value': None}
+    mock.configure_mock(**attrs)
+    return mock
+
+
+@pytest.fixture
+def serial_mock(pipe):
+    mock = Mock()
+    attrs = {'write.return_value': None, 'fileno.return_value': pipe[0]}
+    mock.configure_mock(**attrs)
+    return mock
+
+
+def make_event(loop, command, name='Test', data=None, timeout=10):
+    return ATEvent(name, ATCommand(command, name=name, data=data, timeout=timeout), loop=loop, threadsafe=False)
+
+
+def test_put_writes_immediately(loop, emitter_mock, serial_mock):
+    serialloop = AsyncSerialLoop(emitter_mock, serial_mock, False, loop)
+    first = make_event(loop, 'AT+CSQ\r\n')
+    second = make_event(loop, 'AT+CREG?\r\n')
+
+    serialloop.put(first)
+    serialloop.put(second)
+
+    # The second command has to wait for the response of the first one
+    serial_mock.write.assert_called_once_with(b'AT+CSQ\r')
+    assert serialloop.command_queue.qsize() == 1
+
+
+def test_response(loop, pipe, emitter_mock, serial_mock):
+    serialloop = AsyncSerialLoop(emitter_mock, serial_mock, False, loop)
+    first = make_event(loop, 'AT+CSQ\r\n')
+    second = make_event(loop, 'AT+CREG?\r\n')
+    serialloop.put(first)
+    serialloop.put(second)
+
+    os.write(pipe[1], b'AT+CSQ\r\r\n+CSQ: 15,0\r\n\r\nO')
+    serialloop._on_readable()
+    assert not first.is_set()
+
+    os.write(pipe[1], b'K\r\n')
+    serialloop._on_readable()
+
+    assert first.is_set()
+    assert not first.error
+    assert first.content == ['+CSQ: 15,0']
+    serial_mock.write.assert_called_with(b'AT+CREG?\r')
+
+
+def test_prompt(loop, pipe, emitter_mock, serial_mock):
+    serialloop = AsyncSerialLoop(emitter_mock, serial_mock, False, loop)
+    serialloop.echo = False
+    event = make_event(loop, 'AT+CMGS="+43660"\r', data='Hello\x1A')
+    serialloop.put(event)
+
+    os.write(pipe[1], b'\r\n> ')
+    serialloop._on_readable()
+
+    serial_mock.write.assert_called_with(b'Hello\x1A')
+
+
+def test_wrong_echo(loop, pipe, emitter_mock, serial_mock):
+    serialloop = AsyncSerialLoop(emitter_mock, serial_mock, False, loop)
+    event = make_event(loop, 'AT+CSQ\r\n')
+    serialloop.put(event)
+
+    os.write(pipe[1], b'wrong echo\r\n')
+    serialloop._on_readable()
+
+    assert event.is_set()
+    assert event.error
+    assert serialloop._event is None
+
+
+def test_ring_before_echo(loop, pipe, emitter_mock, serial_mock):
+    serialloop = AsyncSerialLoop(emitter_mock, serial_mock, False, loop)
+    event = make_event(loop, 'AT+CSQ\r\n')
+    serialloop.put(event)
+
+    os.write(pipe[1], b'\r\nRING\r\nAT+CSQ\r\r\n+CSQ: 15,0\r\n\r\nOK\r\n')
+    serialloop._on_readable()
+
+    emitter_mock.emit.assert_called_once_with('ring', None)
+    assert event.is_set()
+    assert not event.error
+    assert event.content == ['+CSQ: 15,0']
+
+
+def test_ring_without_command(loop, pipe, emitter_mock, serial_mock):
+    serialloop = AsyncSerialLoop(emitter_mock, serial_mock, False, loop)
+
+    os.write(pipe[1], b'\r\nRING\r\n')
+    serialloop._on_readable()
+
+    emitter_mock.emit.assert_called_once_with('ring', None)
+
+
+def test_timeout_and_resync(loop, pipe, emitter_mock, serial_mock):
+    serialloop = AsyncSerialLoop(emitter_mock, serial_mock, False, loop)
+    serialloop.start()
+    first = make_event(loop, 'AT+CSQ\r\n', timeout=0.05)
+    second = make_event(loop, 'AT+CREG?\r\n')
+    serialloop.put(first)
+    serialloop.put(second)
+
+    loop.run_until_complete(asyncio.wait_for(first.wait(), 1))
+    assert first.error
+    assert first.error_message.startswith('ResponseTimeout')
+
+    # A late response is drained before the module gets confirmed with a bare AT command
+    os.write(pipe[1], b'AT+CSQ\r\r\n+CSQ: 15,0\r\n')
+    loop.run_until_complete(asyncio.sleep(0.15))
+    serial_mock.write.assert_called_with(b'AT\r')
+    assert serialloop._event is None
+
+    os.write(pipe[1], b'AT\r\r\nOK\r\n')
+    loop.run_until_complete(asyncio.sleep(0.01))
+    serial_mock.write.assert_called_with(b'AT+CREG?\r')
+    assert serialloop._event is second
+
+    serialloop.stop()
+
+
+def test_resync_failed(loop, pipe, emitter_mock, serial_mock):
+    serialloop = AsyncSerialLoop(emitter_mock, serial_mock, False, loop)
+    serialloop.start()
+    first = make_event(loop, 'AT+CSQ\r\n', timeout=0.01)
+    second = make_event(loop, 'AT+CREG?\r\n')
+    serialloop.put(first)
+    serialloop.put(second)
+
+    with patch('gateway.io.sim800.async_serial_loop.RESYNC_TIMEOUT', 0.01):
+        loop.run_until_complete(asyncio.sleep(0.5))
+
+    # After all attempts the loop gives up and continues with the next command
+    assert [c[0][0] for c in serial_mock.write.call_args_list] == [b'AT+CSQ\r'] + [b'AT\r'] * 3 + [b'AT+CREG?\r']
+
+    serialloop.stop()
+
+
+def test_cancelled_event_is_skipped(loop, emitter_mock, serial_mock):
+    serialloop = AsyncSerialLoop(emitter_mock, serial_mock, False, loop)
+    first = make_event(loop, 'AT+CSQ\r\n')
+    second = make_event(loop, 'AT+CREG?\r\n')
+    third = make_event(loop, 'AT+CPIN?\r\n')
+    serialloop.put(first)
+    serialloop.put(second)
+    serialloop.put(third)
+    second.cancelled = True
+
+    serialloop._on_token(Token(TokenType.Line, b'AT+CSQ'))
+    serialloop._on_token(Token(TokenType.Ok, b'OK'))
+
+    serial_mock.write.assert_called_with(b'AT+CPIN?\r')
+    serialloop.stop()
+
+
+def test_parser_error(loop, pipe, emitter_mock, serial_mock):
+    serialloop = AsyncSerialLoop(emitter_mock, serial_mock, False, loop)
+    serialloop.echo = False
+    event = ATEvent('SignalQuality', ATCommand('AT+CSQ\r\n', parser=at_parser.SignalQualityParser), loop=loop,
+                    threadsafe=False)
+    serialloop.put(event)
+
+    os.write(pipe[1], b'\r\n+CSQ\r\n\r\nOK\r\n')
+    serialloop._on_readable()
+
+    assert event.is_set()
+    assert event.error
+    assert event.error_message.startswith('ParserError')
@@ -0,0 +1,78 @@
+from gateway.io.sim800.at_parser import FieldSplitter, PARSERS, ATParser, SMSListParser, SignalQualityParser, \
+    SubscriberNumberParser, NetworkStatusParser, IncomingSMSParser, PinStatusParser, ReadSMSParser
+from gateway.io.sim800 import ATCommand, SMS, NetworkStatus
+import attr
+import pytest
+
+
+def test_field_splitter():
+    fields = FieldSplitter('+CMGL')
+
+    assert fields.split('+CSQ: 15,0') == ['15', '0']
+    assert fields.split('+CMGL: 1,"REC READ","+436501234567","","19/03/14,12:30:45+04"') == [
+        '1', '"REC READ"', '"+436501234567"', '""', '"19/03/14,12:30:45+04"']
+    assert fields.split('+CMGL: 1,",",,"a,b,c"') == ['1', '","', '', '"a,b,c"']
+
+
+def test_list_parser_text_mode():
+    sms = SMSListParser.parse([
+        '+CMGL: 1,"REC READ","+436501234567","Alice","19/03/14,12:30:45+04"', 'Hello, world',
+        '+CMGL: 2,"REC UNREAD","+436507654321",""', 'Hi'
+    ])
+
+    assert sms[0].address_name == 'Alice'
+    assert sms[0].time.hour == 12
+    assert sms[0].message == 'Hello, world'
+    assert sms[1].status == SMS.Status.Unread
+    assert sms[1].address_name == ''
+
+
+def test_parsers():
+    status = NetworkStatusParser.parse(['+CREG: 0,5,"00C1","1A2B"'])
+    assert status == NetworkStatus('0', NetworkStatus.Status.RegisteredRoaming, '00C1', '1A2B')
+
+    number = SubscriberNumberParser.parse(['+CNUM: "Me","+436501234567",145,7,4'])
+    assert (number.alpha, number.number, number.type, number.service) == ('"Me"', '+436501234567', '145', '4')
+
+    sms = IncomingSMSParser.parse(['+CMT: "+436501234567","","19/03/14,12:30:45+04"', 'Hello'])
+    assert sms.time.second == 45
+
+
+def test_registry():
+    assert PARSERS.get(b'+CSQ') is SignalQualityParser
+    assert PARSERS.get(b'+XYZ') is ATParser
+    assert PARSERS.for_command('AT+CSQ\r\n') is SignalQualityParser
+    assert PARSERS.for_command('AT+CMGL="ALL"\r\n') is SMSListParser
+    assert PARSERS.for_command('ATE0\r\n') is ATParser
+
+    # The parser of a command defaults to the registered one
+    assert ATCommand('AT+CNUM\r\n').parser is SubscriberNumberParser
+    assert ATCommand('AT+CNUM\r\n', parser=ATParser).parser is ATParser
+
+
+def test_registry_forms():
+    # Only the forms that answer with the response get its parser
+    assert PARSERS.for_command('AT+CREG?\r\n') is NetworkStatusParser
+    assert PARSERS.for_command('AT+CREG=1\r\n') is ATParser
+    assert PARSERS.for_command('AT+CREG=?\r\n') is ATParser
+    assert PARSERS.for_command('AT+CPIN?\r\n') is PinStatusParser
+    assert PARSERS.for_command('AT+CPIN="1234"\r\n') is ATParser
+    assert PARSERS.for_command('AT+CSQ=?\r\n') is ATParser
+    assert PARSERS.for_command('AT+CMGR=1\r\n') is ReadSMSParser
+    assert PARSERS.for_command('AT+CSQ;+CREG?\r\n') is SignalQualityParser
+
+
+def test_subscriber_number_empty():
+    # Without a stored number the module answers with OK only
+    assert SubscriberNumberParser.parse([]) is None
+
+
+def test_models():
+    signal = SignalQualityParser.parse(['+CSQ: 15,0'])
+
+    # Cached responses are shared, so they can not be changed
+    with pytest.raises(attr.exceptions.FrozenInstanceError):
+        signal.rssi = '0'
+
+    assert not hasattr(signal, '__dict__')
+    assert not hasattr(SMS(1, 'REC READ', '+4366', ''), '__dict__')
@@ -0,0 +1,114 @@
+from gateway.io.sim800.at_tokenizer import ATTokenizer, TokenType, response_prefixes, line_prefix
+
+
+def types(tokens):
+    return [token.type for token in tokens]
+
+
+def test_split_chunks():
+    tokenizer = ATTokenizer()
+
+    tokens = tokenizer.feed(b'AT+CSQ\r\r\n+CS')
+    assert types(tokens) == [TokenType.Line]
+    tokens = tokenizer.feed(b'Q: 15,0\r\n\r\nOK\r')
+    tokens += tokenizer.feed(b'\n')
+
+    assert types(tokens) == [TokenType.Line, TokenType.Ok]
+    assert tokens[0].text == '+CSQ: 15,0'
+
+
+def test_final_results():
+    tokenizer = ATTokenizer()
+
+    tokens = tokenizer.feed(b'\r\nERROR\r\n\r\n+CME ERROR: 10\r\n\r\n+CMS ERROR: 500\r\n\r\nOK: no result\r\n')
+
+    assert types(tokens) == [TokenType.Error, TokenType.Error, TokenType.Error, TokenType.Line]
+
+
+def test_prompt():
+    tokenizer = ATTokenizer()
+
+    assert tokenizer.feed(b'\r\n> ') == []
+
+    tokenizer.expect_prompt = True
+    tokens = tokenizer.feed(b'')
+
+    assert types(tokens) == [TokenType.Prompt]
+    assert not tokenizer.expect_prompt
+
+
+def test_sms_body():
+    tokenizer = ATTokenizer()
+    tokenizer.responses = response_prefixes('AT+CMGL="ALL"')
+
+    tokens = tokenizer.feed(b'+CMGL: 1,"REC READ","+43","",""\r\nOK\r\n+CMGL: 2,"REC READ","+43","",""\r\n'
+                            b'ERROR\r\n\r\nOK\r\n')
+
+    assert types(tokens) == [TokenType.Line, TokenType.Line, TokenType.Line, TokenType.Line, TokenType.Ok]
+
+
+def test_unsolicited():
+    tokenizer = ATTokenizer(unsolicited={b'RING', b'+CREG'})
+
+    tokens = tokenizer.feed(b'\r\nRING\r\n\r\n+CREG: 1\r\n')
+    assert types(tokens) == [TokenType.Unsolicited, TokenType.Unsolicited]
+
+    # The response of a command is not unsolicited
+    tokenizer.responses = response_prefixes('AT+CREG?')
+    tokens = tokenizer.feed(b'\r\n+CREG: 0,1\r\n')
+    assert types(tokens) == [TokenType.Line]
+
+
+def test_prefixes():
+    assert line_prefix(b'+CMTI: "SM",3') == b'+CMTI'
+    assert line_prefix(b'RING') == b'RING'
+    assert response_prefixes('AT+CSQ') == {b'+CSQ'}
+    assert response_prefixes('AT+CSQ;+CREG?;+CPIN?') == {b'+CSQ', b'+CREG', b'+CPIN'}
+    assert response_prefixes('ATD+43660;') == {b'NO CARRIER', b'NO DIALTONE', b'BUSY', b'NO ANSWER'}
+    assert response_prefixes('ATH') == set()
+
+
+def test_call_results():
+    tokenizer = ATTokenizer(unsolicited={b'NO CARRIER', b'BUSY'})
+
+    # The result codes end a call command with an error, without one they are unsolicited
+    tokenizer.responses = response_prefixes('ATD+43660;')
+    tokens = tokenizer.feed(b'\r\nBUSY\r\n\r\nNO DIALTONE\r\n')
+    assert types(tokens) == [TokenType.Error, TokenType.Error]
+
+    tokenizer.responses = set()
+    tokens = tokenizer.feed(b'\r\nNO CARRIER\r\n')
+    assert types(tokens) == [TokenType.Unsolicited]
+
+
+def test_numeric_results():
+    tokenizer = ATTokenizer()
+    tokenizer.numeric = True
+    tokenizer.responses = {b'+CSQ'}
+
+    tokens = tokenizer.feed(b'+CSQ: 15,0\r\n0')
+    tokens += tokenizer.feed(b'\r4\r2\r+CME ERROR: 10\r\n')
+
+    assert types(tokens) == [TokenType.Line, TokenType.Ok, TokenType.Error, TokenType.Unsolicited, TokenType.Error]
+    assert [token.data for token in tokens[1:4]] == [b'OK', b'ERROR', b'RING']
+
+
+def test_numeric_verbose_responses():
+    tokenizer = ATTokenizer()
+    tokenizer.numeric = True
+
+    # The response of ATV0 itself or a module that resets to verbose result codes
+    tokens = tokenizer.feed(b'AT+CSQ\r\r\n+CSQ: 15,0\r\n\r\nOK\r\n')
+
+    assert types(tokens) == [TokenType.Line, TokenType.Line, TokenType.Ok]
+    assert tokens[1].text == '+CSQ: 15,0'
+
+
+def test_status_report():
+    tokenizer = ATTokenizer(unsolicited={b'+CDS'})
+
+    # In pdu mode the report is followed by its pdu, in text mode it is a single line
+    tokens = tokenizer.feed(b'\r\n+CDS: 25\r\n00062A0C91\r\n\r\n+CDS: 6,42,"+436501234567",145,"",""\r\n')
+    assert types(tokens) == [TokenType.Unsolicited, TokenType.Unsolicited]
+    assert tokens[0].data == b'+CDS: 25\r\n00062A0C91'
+    assert tokens[1].data == b'+CDS: 6,42,"+436501234567",145,"",""'
@@ -0,0 +1,207 @@
+from gateway.io.sim800.cmux import FrameDecoder, CMUX, encode_frame, encode_msc, decode_messages, SABM, UA, DISC, UIH, \
+    PF, MSC, FC, V24_READY, CHANNEL_BUFFER_SIZE
+from gateway.io.sim800 import Sim800
+from serial import Serial
+import asyncio
+import os
+import socket
+import threading
+import time
+import tty
+import pytest
+
+
+class CMUXModem(threading.Thread):
+    """
+    Answers AT+CMUX=0 and then the commands on every channel in a separate thread like the module.
+    """
+
+    def __init__(self, responses):
+        super().__init__()
+        self.daemon = True
+
+        # Maps a command to the response and the time in seconds the module needs for it
+        self.responses = responses
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        self.port = os.ttyname(self._slave)
+
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self.closed = threading.Event()
+
+        # Messages of the control channel and the data of the other channels in the order they were received
+        self.messages = []
+        self.received = []
+
+    def send(self, dlci, data):
+        with self._lock:
+            os.write(self._master, encode_frame(dlci, UIH, data, command=False))
+
+    def _answer(self, dlci, command):
+        response, latency = self.responses.get(command, (b'\r\nOK\r\n', 0))
+        time.sleep(latency)
+        self.send(dlci, response)
+
+    def run(self):
+        data = b''
+        while b'AT+CMUX=0\r' not in data:
+            data += os.read(self._master, 1024)
+        os.write(self._master, b'AT+CMUX=0\r\r\nOK\r\n')
+
+        decoder = FrameDecoder()
+        while True:
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                break
+
+            for frame in decoder.feed(data):
+                if frame.control == SABM:
+                    with self._lock:
+                        os.write(self._master, encode_frame(frame.dlci, UA | PF, command=False))
+                elif frame.control == DISC and frame.dlci == 0:
+                    self.closed.set()
+                elif frame.control == UIH and frame.dlci == 0:
+                    self.messages += decode_messages(frame.data)
+                elif frame.control == UIH:
+                    self.received.append((frame.dlci, frame.data))
+                    buffer = self._buffers.get(frame.dlci, b'') + frame.data
+                    while b'\r' in buffer:
+                        command, buffer = buffer.split(b'\r', 1)
+                        threading.Thread(target=self._answer, args=(frame.dlci, command), daemon=True).start()
+                    self._buffers[frame.dlci] = buffer
+
+    def close(self):
+        os.close(self._slave)
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def cmux_modem():
+    modem = CMUXModem({
+        b'AT+CMGL="ALL"': (b'\r\n+CMGL: 1,"REC READ","+436501234567",""\r\nHello\r\n\r\nOK\r\n', 0.5),
+        b'AT+CSQ': (b'\r\n+CSQ: 15,0\r\n\r\nOK\r\n', 0)
+    })
+    modem.start()
+    yield modem
+    modem.close()
+
+
+def test_frame_encoding():
+    # Well-known frames of the start of a multiplexer session
+    assert encode_frame(0, SABM | PF) == bytes.fromhex('f9033f011cf9')
+    assert encode_frame(0, UA | PF) == bytes.fromhex('f9037301d7f9')
+
+
+def test_frame_decoding():
+    decoder = FrameDecoder()
+    data = encode_frame(1, UIH, b'AT+CSQ\r') + b'\xf9\x07\xef\x05\x00\xf9' + encode_frame(2, UIH, bytes(200))
+
+    frames = decoder.feed(data[:5])
+    frames += decoder.feed(data[5:])
+
+    # The corrupted frame in the middle gets dropped
+    assert [(frame.dlci, frame.control) for frame in frames] == [(1, UIH), (2, UIH)]
+    assert frames[0].data == b'AT+CSQ\r'
+    assert len(frames[1].data) == 200
+
+
+@pytest.mark.parametrize('backend', ['thread', 'asyncio'])
+def test_channels_do_not_block(loop, cmux_modem, backend):
+    sim = Sim800(serial_port=cmux_modem.port, loop=loop, backend=backend, cmux=True)
+    for serial_loop in sim._serial_loops:
+        serial_loop.echo = False
+    rings = []
+    sim.on('ring', lambda data: rings.append(data))
+
+    async def run():
+        listing = asyncio.ensure_future(sim.request_all_sms())
+        await asyncio.sleep(0.05)
+
+        # Call control and status queries run next to the sms listing on their own channels
+        start = time.monotonic()
+        hang_up = await sim.hang_up_call()
+        signal = await sim.request_signal_quality()
+        elapsed = time.monotonic() - start
+
+        assert not listing.done()
+        return elapsed, hang_up, signal, await listing
+
+    elapsed, hang_up, signal, listing = loop.run_until_complete(run())
+
+    assert elapsed < 0.3
+    assert not hang_up.error
+    assert signal.data.rssi == '15'
+    assert listing.data[0].message == 'Hello'
+
+    cmux_modem.send(3, b'\r\nRING\r\n')
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert rings == [None]
+
+    sim.close()
+    assert cmux_modem.closed.wait(1)
+
+
+@pytest.fixture
+def mux(cmux_modem):
+    serial = Serial(cmux_modem.port, timeout=1)
+    mux = CMUX(serial)
+    mux.start()
+    yield mux
+    mux.stop()
+    serial.close()
+
+
+def test_msc_encoding():
+    assert encode_msc(1, V24_READY | FC) == bytes.fromhex('e305078f')
+    assert decode_messages(encode_msc(1, V24_READY) + encode_msc(2, V24_READY, command=False)) == [
+        (MSC, True, bytes([0x07, 0x8d])), (MSC, False, bytes([0x0b, 0x8d]))]
+
+
+def test_modem_flow_control(cmux_modem, mux):
+    # The module can not accept frames on channel 1
+    cmux_modem.send(0, encode_msc(1, V24_READY | FC))
+    time.sleep(0.1)
+    mux.write(1, b'AT+CSQ\r')
+    mux.write(2, b'AT\r')
+    time.sleep(0.1)
+
+    # The command is answered and only the other channel gets frames
+    assert (MSC, False, bytes([0x07, V24_READY | FC])) in cmux_modem.messages
+    assert cmux_modem.received == [(2, b'AT\r')]
+
+    cmux_modem.send(0, encode_msc(1, V24_READY))
+    time.sleep(0.1)
+    assert cmux_modem.received == [(2, b'AT\r'), (1, b'AT+CSQ\r')]
+
+
+def test_stalled_channel(cmux_modem, mux):
+    stalled, other = mux.channels[1], mux.channels[2]
+    stalled._peer.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+
+    for _ in range(40):
+        cmux_modem.send(1, bytes(1000))
+    cmux_modem.send(2, b'\r\nOK\r\n')
+
+    # The consumer of channel 1 does not read, but the other channel still gets its data
+    assert other.read(6) == b'\r\nOK\r\n'
+    assert stalled.pending >= CHANNEL_BUFFER_SIZE
+    assert (MSC, True, bytes([0x07, V24_READY | FC])) in cmux_modem.messages
+
+    data = b''
+    while len(data) < 40000:
+        data += stalled.read(4096)
+    time.sleep(0.1)
+
+    # Nothing was dropped and the module may send on the channel again
+    assert data == bytes(40000)
+    assert stalled.pending == 0
+    assert cmux_modem.messages[-1] == (MSC, True, bytes([0x07, V24_READY]))
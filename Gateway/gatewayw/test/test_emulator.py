@@ -0,0 +1,135 @@
+from gateway.io.sim800 import Sim800, ATCommand, PINStatus, NetworkStatus, SMS
+from gateway.io.sim800.emulator import Emulator
+import asyncio
+import time
+import pytest
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def emulator():
+    emulator = Emulator(pin='1234')
+    emulator.start()
+    yield emulator
+    emulator.close()
+
+
+@pytest.fixture
+def sim(loop, emulator):
+    sim = Sim800(serial_port=emulator.port, loop=loop, backend='asyncio')
+    yield sim
+    sim.close()
+
+
+def test_setup(loop, sim, emulator):
+    loop.run_until_complete(sim.setup(pin='1234'))
+
+    signal, network, pin, imsi = loop.run_until_complete(sim.request_status())
+    assert (signal.data.rssi, signal.data.ber) == ('15', '0')
+    assert network.data.stat == NetworkStatus.Status.RegisteredHome
+    assert pin.data == PINStatus.Ready
+    assert imsi.data.msin == '1234567890'
+
+    # Low overhead mode and pdu mode with error codes
+    assert (emulator.echo, emulator.numeric, emulator.sms_mode, emulator.error_mode) == (False, True, 0, 1)
+
+
+def test_sms(loop, sim, emulator):
+    loop.run_until_complete(sim.setup(pin='1234'))
+    indications = []
+    sim.on('new_sms', indications.append)
+
+    text = 'The quick brown fox jumps over the lazy dog. ' * 5
+    indexes = emulator.receive_sms('+436501234567', text)
+    loop.run_until_complete(asyncio.sleep(0.1))
+
+    assert indexes == [1, 2]
+    assert [indication.index for indication in indications] == indexes
+
+    event = loop.run_until_complete(sim.request_all_sms())
+    assert [(sms.address, sms.message, sms.indexes) for sms in event.data] == [('+436501234567', text, [1, 2])]
+    assert event.data[0].status == SMS.Status.Unread
+    assert {sms.status for sms in emulator.storage.values()} == {'REC READ'}
+
+    loop.run_until_complete(sim.send_sms('+436507654321', 'Hello'))
+    assert emulator.sent == 1
+
+
+def test_registration_invalidates_cache(loop, sim, emulator):
+    loop.run_until_complete(sim.setup(pin='1234'))
+    assert emulator.registration_mode == 1
+
+    event = loop.run_until_complete(sim.request_network_status())
+    assert event.data.stat == NetworkStatus.Status.RegisteredHome
+    assert 'AT+CREG?' in sim.cache
+
+    # The result code of the change drops the cached registration before it expires
+    emulator.register(5)
+    loop.run_until_complete(asyncio.sleep(0.1))
+    event = loop.run_until_complete(sim.request_network_status())
+    assert event.data.stat == NetworkStatus.Status.RegisteredRoaming
+
+
+def test_ring_and_error_storm(loop, sim, emulator):
+    loop.run_until_complete(sim.setup(pin='1234'))
+    callers = []
+    sim.on('caller_identification', callers.append)
+
+    emulator.ring('+436501234567')
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert callers == ['+436501234567']
+
+    emulator.error_storm(2)
+    events = [loop.run_until_complete(sim.write(ATCommand('AT+GSN\r\n', name='IMEI'))) for _ in range(3)]
+    assert [event.error for event in events[:2]] == [True, True]
+    assert events[2].data.imei == emulator.imei
+
+
+def test_baudrate_pacing(loop):
+    emulator = Emulator(responses={'AT+CMGL=4': ['x' * 200] * 5}, baudrate=9600)
+    emulator.start()
+    sim = Sim800(serial_port=emulator.port, loop=loop, backend='asyncio')
+
+    try:
+        start = time.perf_counter()
+        loop.run_until_complete(sim.write(ATCommand('AT+CMGL=4\r\n', name='ListAllSMS')))
+        # About 1000 bytes need at least one second with 10 bits per byte
+        assert time.perf_counter() - start > 1
+    finally:
+        sim.close()
+        emulator.close()
+
+
+@pytest.mark.parametrize('backend', ['thread', 'asyncio'])
+def test_call_results(loop, emulator, backend):
+    sim = Sim800(serial_port=emulator.port, loop=loop, backend=backend)
+    urcs = []
+    for name in ('busy', 'call_ended'):
+        sim.on(name, lambda data=None, name=name: urcs.append(name))
+    loop.run_until_complete(sim.setup(pin='1234'))
+
+    # A failed call attempt ends the command at once instead of timing out
+    emulator.call_results['+436507654321'] = 'BUSY'
+    event = loop.run_until_complete(asyncio.wait_for(sim.dial_number('+436507654321'), 2))
+    assert event.error and event.error_message == 'BUSY'
+
+    event = loop.run_until_complete(asyncio.wait_for(sim.answer_call(), 2))
+    assert event.error and event.error_message == 'NO CARRIER'
+    assert urcs == []
+
+    # Without a call command the result codes are unsolicited
+    emulator.ring('+436501234567')
+    event = loop.run_until_complete(asyncio.wait_for(sim.answer_call(), 2))
+    assert not event.error
+    emulator.inject('NO CARRIER')
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert urcs == ['call_ended']
+
+    sim.close()
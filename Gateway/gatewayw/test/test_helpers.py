@@ -0,0 +1,61 @@
+from gateway.io.sim800.operators import OperatorIndex
+import json
+import os
+import subprocess
+import sys
+
+
+HELPER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'helper')
+
+XML = '''<?xml version="1.0" encoding="utf-8"?>
+<apns version="8">
+  <apn carrier="A1" mcc="232" mnc="01" apn="a1.net" />
+  <apn carrier="T-Mobile" mcc="232" mnc="03" apn="gprsinternet" />
+  <apn carrier="AT&amp;T" mcc="310" mnc="410" apn="phone" />
+</apns>
+'''
+
+XHTML = '''<table xmlns="http://www.w3.org/1999/xhtml">
+  <tr><th>MCC</th><th>MNC</th><th>ISO</th><th>Country</th><th>Network</th></tr>
+  <tr><td>232</td><td>01</td><td>at</td><td>Austria</td><td>A1 Telekom</td></tr>
+  <tr><td>232</td><td>05</td><td>at</td><td>Austria</td><td>Drei</td></tr>
+</table>
+'''
+
+
+def run_helper(tmpdir, name, *args):
+    # The helpers have to run standalone, without the gateway package on the path
+    env = dict(os.environ)
+    env.pop('PYTHONPATH', None)
+    subprocess.run([sys.executable, os.path.join(HELPER_DIR, name)] + list(args), cwd=str(tmpdir), env=env,
+                   check=True, timeout=30)
+
+
+def test_parse_xml_apns(tmpdir):
+    tmpdir.join('apn-conf.xml').write(XML)
+    run_helper(tmpdir, 'parse-xml-apns.py', '-i', 'apn-conf.xml', '-o', 'apn-conf.json', '--index', 'apn-conf.idx')
+
+    with open(str(tmpdir.join('apn-conf.json'))) as f:
+        assert json.load(f) == {'232': {'01': 'A1', '03': 'T-Mobile', 'country': None, 'iso': None},
+                                '310': {'410': 'AT&T', 'country': None, 'iso': None}}
+
+    index = OperatorIndex.open(str(tmpdir.join('apn-conf.idx')))
+    assert index.lookup('232', '03') == ('T-Mobile', None, None)
+    assert index.lookup('310', '410') == ('AT&T', None, None)
+    assert index.lookup('232', '99') == (None, None, None)
+    index.close()
+
+
+def test_parse_xhtml_apns(tmpdir):
+    tmpdir.join('mcc-mnc.xhtml').write(XHTML)
+    tmpdir.join('apn-conf.xml').write(XML)
+    run_helper(tmpdir, 'parse-xml-apns.py', '-i', 'apn-conf.xml', '-o', 'apn-conf.json')
+    run_helper(tmpdir, 'parse-xhtml-apns.py', '-i', 'mcc-mnc.xhtml', '-m', 'apn-conf.json', '-o', 'merged.json',
+               '--index', 'apn-conf.idx')
+
+    index = OperatorIndex.open(str(tmpdir.join('apn-conf.idx')))
+    assert index.lookup('232', '01') == ('A1 Telekom', 'Austria', 'at')
+    assert index.lookup('232', '03') == ('T-Mobile', 'Austria', 'at')
+    assert index.lookup('232', '05') == ('Drei', 'Austria', 'at')
+    assert index.lookup('310', '410') == ('AT&T', None, None)
+    index.close()
@@ -0,0 +1,202 @@
+from gateway.io.sim800 import Sim800, Inbox
+from gateway.io.sim800.emulator import Emulator
+from gateway.io.sim800.pdu import encode_sms, decode_sms
+import attr
+import asyncio
+import os
+import pytest
+from unittest.mock import patch
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def pipe():
+    read_fd, write_fd = os.pipe()
+    yield read_fd, write_fd
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+@pytest.fixture
+def modem(pipe):
+    """
+    Answers every command written to the serial mock with the response that is registered for it.
+    """
+
+    responses = {}
+
+    def write(data):
+        os.write(pipe[1], responses.get(data, b'\r\nOK\r\n'))
+
+    with patch('gateway.io.sim800.sim800.Serial') as serial_class:
+        serial = serial_class.return_value
+        serial.fileno.return_value = pipe[0]
+        serial.write.side_effect = write
+        yield serial, responses
+
+
+@pytest.fixture
+def sim(loop, modem):
+    sim = Sim800(loop=loop, backend='asyncio')
+    sim.serial_loop.echo = False
+    yield sim
+    sim.close()
+
+
+def written(serial):
+    return [call[0][0] for call in serial.write.call_args_list]
+
+
+def upload_to(uploads, confirmed=True):
+    async def upload(sms):
+        uploads.append(sms)
+        return confirmed
+    return upload
+
+
+def deliver_pdu(submit):
+    """
+    Converts a SMS-SUBMIT pdu to the SMS-DELIVER pdu, that the recipient stores.
+    """
+
+    # Smsc, first octet, message reference, then the address, protocol identifier and data coding scheme
+    end = 10 + (int(submit[6:8], 16) + 1) // 2 * 2 + 4
+    deliver = '00' + '44' + submit[6:end] + '91300141031100' + submit[end:]
+
+    assert decode_sms(deliver).address == '+4366'
+    return deliver
+
+
+def test_receive(loop, pipe, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CMGR=3\r'] = b'\r\n+CMGR: "REC UNREAD","+436501234567","","19/03/14,12:30:45+04"\r\nHello\r\n' \
+                                b'\r\nOK\r\n'
+    uploads = []
+    inbox = Inbox(sim, upload_to(uploads))
+    inbox.start()
+
+    os.write(pipe[1], b'\r\n+CMTI: "SM",3\r\n')
+    loop.run_until_complete(asyncio.sleep(0.05))
+
+    # One short read of the new slot, which gets deleted after the upload
+    assert written(serial) == [b'AT+CMGR=3\r', b'AT+CMGD=3\r']
+    assert [(sms.index, sms.address, sms.message) for sms in uploads] == [(3, '+436501234567', 'Hello')]
+    assert uploads[0].time.minute == 30
+    assert inbox.slots == {}
+
+
+def test_upload_failed(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CMGR=3\r'] = b'\r\n+CMGR: "REC UNREAD","+436501234567",""\r\nHello\r\n\r\nOK\r\n'
+    uploads = []
+    inbox = Inbox(sim, upload_to(uploads, confirmed=False))
+
+    loop.run_until_complete(inbox.receive(3))
+    loop.run_until_complete(inbox.receive(3))
+
+    # The sms stays in the storage and the duplicate indication is ignored
+    assert b'AT+CMGD=3\r' not in written(serial)
+    assert len(uploads) == 1
+    assert 3 in inbox.slots
+
+    inbox.upload = upload_to(uploads)
+    loop.run_until_complete(inbox.sync())
+
+    # The sync retries the upload
+    assert len(uploads) == 2
+    assert written(serial)[-3:] == [b'AT+CMGD=3\r', b'AT+CMGL="REC READ"\r', b'AT+CMGL="REC UNREAD"\r']
+    assert inbox.slots == {}
+
+
+def test_receive_concatenated(loop, sim, modem):
+    serial, responses = modem
+    sim.pdu_mode = True
+
+    # The module stores SMS-DELIVER pdus, which are built from the submitted parts
+    for index, (length, data) in zip((5, 6), encode_sms('+4366', 'a' * 100 + 'b' * 100, reference=9)):
+        responses['AT+CMGR={}\r'.format(index).encode()] = '\r\n+CMGR: 0,,{}\r\n{}\r\n\r\nOK\r\n'.format(
+            length, deliver_pdu(data)).encode()
+
+    uploads = []
+    inbox = Inbox(sim, upload_to(uploads))
+
+    loop.run_until_complete(inbox.receive(6))
+    assert uploads == []
+
+    loop.run_until_complete(inbox.receive(5))
+
+    # The parts are uploaded as one sms and both slots are deleted
+    assert len(uploads) == 1
+    assert uploads[0].message == 'a' * 100 + 'b' * 100
+    assert uploads[0].indexes == [5, 6]
+    assert written(serial)[-2:] == [b'AT+CMGD=5\r', b'AT+CMGD=6\r']
+
+
+def test_sync(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CMGL="REC READ"\r'] = b'\r\n+CMGL: 1,"REC READ","+436501234567",""\r\nHello\r\n\r\nOK\r\n'
+    responses[b'AT+CMGL="REC UNREAD"\r'] = b'\r\n+CMGL: 2,"REC UNREAD","+436507654321",""\r\nWorld\r\n\r\nOK\r\n'
+    responses[b'AT+CMGD=2\r'] = b'\r\nERROR\r\n'
+    uploads = []
+    inbox = Inbox(sim, upload_to(uploads))
+
+    loop.run_until_complete(inbox.sync())
+
+    assert [sms.message for sms in uploads] == ['Hello', 'World']
+    assert inbox.uploaded == {2}
+
+    # The slot that could not be deleted is still listed, but not uploaded again
+    responses[b'AT+CMGL="REC READ"\r'] = b'\r\n+CMGL: 2,"REC READ","+436507654321",""\r\nWorld\r\n\r\nOK\r\n'
+    del responses[b'AT+CMGL="REC UNREAD"\r']
+    loop.run_until_complete(inbox.sync())
+
+    assert len(uploads) == 2
+    assert inbox.uploaded == {2}
+
+    del responses[b'AT+CMGD=2\r']
+    del responses[b'AT+CMGL="REC READ"\r']
+    loop.run_until_complete(inbox.sync())
+
+    assert len(uploads) == 2
+    assert inbox.slots == {} and inbox.uploaded == set()
+
+
+def test_sync_skips_stored_sms(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CMGL="ALL"\r'] = b'\r\n+CMGL: 1,"STO SENT","+436501234567",""\r\nDraft\r\n' \
+                                    b'\r\n+CMGL: 2,"REC UNREAD","+436507654321",""\r\nWorld\r\n\r\nOK\r\n'
+    responses[b'AT+CMGL="REC UNREAD"\r'] = b'\r\n+CMGL: 2,"REC UNREAD","+436507654321",""\r\nWorld\r\n\r\nOK\r\n'
+    uploads = []
+    inbox = Inbox(sim, upload_to(uploads))
+
+    loop.run_until_complete(inbox.sync())
+
+    # The sent sms is neither uploaded nor deleted
+    assert [sms.message for sms in uploads] == ['World']
+    assert b'AT+CMGL="ALL"\r' not in written(serial)
+    assert b'AT+CMGD=1\r' not in written(serial)
+
+
+def test_sync_pdu_mode(loop):
+    emulator = Emulator()
+    emulator.start()
+    sim = Sim800(serial_port=emulator.port, loop=loop, backend='asyncio')
+    try:
+        loop.run_until_complete(sim.setup())
+        emulator.receive_sms('+436507654321', 'World')
+        emulator.storage[2] = attr.evolve(emulator.storage[1], status='STO SENT')
+
+        uploads = []
+        loop.run_until_complete(Inbox(sim, upload_to(uploads)).sync())
+
+        assert [sms.message for sms in uploads] == ['World']
+        assert list(emulator.storage) == [2]
+    finally:
+        sim.close()
+        emulator.close()
@@ -0,0 +1,88 @@
+from gateway.io.sim800 import Sim800, ATCommand, Priority
+from gateway.io.sim800.emulator import Emulator
+from gateway.io.sim800.metrics import Histogram, _bucket, _lowest
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def emulator():
+    emulator = Emulator(latency=0.02)
+    emulator.start()
+    yield emulator
+    emulator.close()
+
+
+def test_histogram():
+    for value in range(0, 1 << 20, 997):
+        assert _lowest(_bucket(value)) <= value < _lowest(_bucket(value) + 1)
+
+    histogram = Histogram()
+    for millisecond in range(1, 101):
+        histogram.record(millisecond / 1000)
+
+    assert histogram.count == 100
+    assert histogram.percentile(50) == pytest.approx(0.050, rel=0.04)
+    assert histogram.percentile(99) == pytest.approx(0.099, rel=0.04)
+    assert histogram.percentile(100) == 0.1
+    assert histogram.as_dict()['mean'] == pytest.approx(50.5)
+    assert Histogram().percentile(50) == 0
+
+
+@pytest.mark.parametrize('backend', ['thread', 'asyncio'])
+def test_command_metrics(loop, emulator, backend):
+    sim = Sim800(serial_port=emulator.port, loop=loop, backend=backend)
+
+    async def run():
+        # Three commands at once, so two of them wait in the queue
+        await asyncio.gather(*(sim.write(ATCommand('AT\r\n', name='Attention')) for _ in range(3)))
+        emulator.error_storm(1)
+        await sim.write(ATCommand('AT+CNUM\r\n', name='SubscriberNumber'))
+        # The thread backend only checks the deadline if the serial interface is quiet
+        if backend == 'asyncio':
+            await sim.write(ATCommand('AT+CSQ\r\n', name='SignalQuality', timeout=0.01))
+
+    try:
+        loop.run_until_complete(run())
+        snapshot = sim.metrics.snapshot()
+    finally:
+        sim.close()
+
+    attention = snapshot['commands']['Attention']
+    assert attention['count'] == 3 and attention['errors'] == 0
+    # The emulator answers after 20 ms, the echo is the first byte
+    assert 20 <= attention['first_byte']['p50'] <= attention['response']['p50']
+    assert attention['queued']['max'] >= 20
+    assert attention['total']['max'] >= attention['response']['max']
+
+    assert snapshot['commands']['SubscriberNumber']['errors'] == 1
+    if backend == 'asyncio':
+        assert snapshot['commands']['SignalQuality']['timeouts'] == 1
+        assert (snapshot['errors'], snapshot['timeouts'], snapshot['echo_errors']) == (2, 1, 0)
+    assert snapshot['queues']['Interactive']['max'] >= 1
+    assert snapshot['queues']['Interactive']['depth'] == 0
+
+
+def test_queued_full_class(loop, emulator):
+    sim = Sim800(serial_port=emulator.port, loop=loop, backend='asyncio', queue_limits={Priority.Interactive: 1})
+
+    async def run():
+        # The second command waits for the slot of the first one, that counts to the time it is queued
+        await asyncio.gather(*(sim.write(ATCommand('AT\r\n', name='Attention')) for _ in range(2)))
+
+    try:
+        loop.run_until_complete(run())
+        snapshot = sim.metrics.snapshot()
+    finally:
+        sim.close()
+
+    attention = snapshot['commands']['Attention']
+    assert attention['queued']['max'] >= 20
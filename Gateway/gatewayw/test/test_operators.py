@@ -0,0 +1,77 @@
+from gateway.core import config
+from gateway.io.sim800 import operators, IMSI
+from gateway.io.sim800.at_parser import IMSIParser, PARSERS
+from gateway.io.sim800.operators import OperatorIndex, build_index, write_index
+import configparser
+import json
+import pytest
+
+
+APNS = {
+    '232': {'01': 'A1 ', '03': 'T-Mobile ', 'country': 'Austria', 'iso': 'at'},
+    '310': {'260': 'T-Mobile ', '410': 'AT&T ', 'country': 'United States', 'iso': 'us'},
+    '901': {'01': 'ICO ', 'country': None, 'iso': None}
+}
+
+
+@pytest.fixture
+def index(tmpdir):
+    path = str(tmpdir.join('apn-conf.idx'))
+    write_index(APNS, path)
+
+    index = OperatorIndex.open(path)
+    yield index
+    index.close()
+
+
+def test_lookup(index):
+    assert index.count == 8
+    assert index.lookup('232', '01') == ('A1 ', 'Austria', 'at')
+    assert index.lookup('310', '260') == ('T-Mobile ', 'United States', 'us')
+    assert index.lookup('232', '99') == (None, 'Austria', 'at')
+    assert index.lookup('901', '01') == ('ICO ', None, None)
+    assert index.lookup('999', '01') == (None, None, None)
+    assert index.lookup('000', '00') == (None, None, None)
+
+
+def test_invalid_index():
+    with pytest.raises(ValueError):
+        OperatorIndex(b'\0' * 16)
+
+
+def test_imsi_parser(monkeypatch):
+    monkeypatch.setattr(operators, '_index', OperatorIndex(build_index(APNS)))
+
+    assert PARSERS.for_command('AT+CIMI\r\n') is IMSIParser
+    assert IMSIParser.parse(['232011234567890']) == IMSI('232', '01', '1234567890', 'A1 ', 'Austria', 'at')
+    assert IMSIParser.parse(['310260123456789']) == IMSI('310', '260', '123456789', 'T-Mobile ', 'United States',
+                                                         'us')
+    assert IMSIParser.parse(['232991234567890']) == IMSI('232', '99', '1234567890', None, 'Austria', 'at')
+
+
+def test_merge_operator():
+    apns = {}
+    operators.merge_operator(apns, '232', '01', 'A1 ', 'Austria', 'at')
+    # Sources without the country do not remove it
+    operators.merge_operator(apns, '232', '03', 'T-Mobile ')
+    operators.merge_operator(apns, '901', '01', 'ICO ')
+
+    assert apns == {'232': {'01': 'A1 ', '03': 'T-Mobile ', 'country': 'Austria', 'iso': 'at'},
+                    '901': {'01': 'ICO ', 'country': None, 'iso': None}}
+
+
+@pytest.mark.parametrize('content', [None, b'\0' * 16])
+def test_index_fallback(tmpdir, monkeypatch, content):
+    apnfile = tmpdir.join('apn-conf.json')
+    apnfile.write(json.dumps(APNS))
+    apnindex = tmpdir.join('apn-conf.idx')
+    if content is not None:
+        apnindex.write_binary(content)
+
+    parser = configparser.ConfigParser()
+    parser['DEFAULT'] = {'apnfile': str(apnfile), 'apnindex': str(apnindex)}
+    monkeypatch.setattr(config, 'config', parser)
+    monkeypatch.setattr(operators, '_index', None)
+
+    # A missing or invalid index is built from the apn file
+    assert operators.get_index().lookup('232', '01') == ('A1 ', 'Austria', 'at')
@@ -0,0 +1,229 @@
+from gateway.io.sim800 import Sim800, Sim800Error, ATEvent
+from gateway.io.sim800.outbox import Outbox
+from gateway.io.sim800 import pdu
+from gateway.io.sim800.pdu import PDUError
+import asyncio
+import json
+import os
+import time
+import pytest
+from unittest.mock import patch
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def pipe():
+    read_fd, write_fd = os.pipe()
+    yield read_fd, write_fd
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+@pytest.fixture
+def modem(pipe):
+    """
+    Prompts for the message of every sms and answers the messages with the registered results in turn.
+    """
+
+    results = {}
+    sent = []
+
+    def write(data):
+        if data.startswith(b'AT+CMGS='):
+            os.write(pipe[1], b'\r\n> ')
+        elif data.endswith(b'\x1a'):
+            message = data[:-1].decode()
+            sent.append((message, time.monotonic()))
+            result = results.get(message, [])
+            os.write(pipe[1], result.pop(0) if result else b'\r\n+CMGS: 1\r\n\r\nOK\r\n')
+
+    with patch('gateway.io.sim800.sim800.Serial') as serial_class:
+        serial = serial_class.return_value
+        serial.fileno.return_value = pipe[0]
+        serial.write.side_effect = write
+        yield sent, results
+
+
+@pytest.fixture
+def sim(loop, modem):
+    sim = Sim800(loop=loop, backend='asyncio')
+    sim.serial_loop.echo = False
+    yield sim
+    sim.close()
+
+
+def send(loop, outbox):
+    outbox.start()
+    loop.run_until_complete(asyncio.wait_for(outbox.join(), 2))
+    loop.run_until_complete(outbox.stop())
+
+
+def test_send(loop, sim, modem):
+    sent, results = modem
+    outbox = Outbox(sim, pacing=0)
+    for i in range(5):
+        outbox.put('+4366{}'.format(i), 'sms {}'.format(i))
+
+    send(loop, outbox)
+
+    assert [message for message, _ in sent] == ['sms {}'.format(i) for i in range(5)]
+    assert outbox.stats.sent == 5
+    assert outbox.stats.throughput() == 5
+    assert outbox.stats.latency(50) < 1
+    assert not outbox.pending
+
+
+def test_retry(loop, sim, modem):
+    sent, results = modem
+    results['first'] = [b'\r\n+CMS ERROR: 42\r\n', b'\r\n+CMS ERROR: 331\r\n']
+    results['second'] = [b'\r\n+CMS ERROR: 304\r\n']
+
+    outbox = Outbox(sim, pacing=0, retries=2, retry_delay=0.01)
+    outbox.put('+4366', 'first')
+    outbox.put('+4377', 'second')
+
+    send(loop, outbox)
+
+    # Congestion and no network service are temporary, an invalid pdu parameter is not
+    assert [message for message, _ in sent].count('first') == 3
+    assert [message for message, _ in sent].count('second') == 1
+    assert outbox.stats.as_dict()['sent'] == 1
+    assert outbox.stats.failed == 1
+    assert outbox.stats.retries == 2
+
+
+def test_retries_exhausted(loop, sim, modem):
+    sent, results = modem
+    results['first'] = [b'\r\n+CMS ERROR: 42\r\n'] * 3
+
+    outbox = Outbox(sim, pacing=0, retries=1, retry_delay=0.01)
+    outbox.put('+4366', 'first')
+
+    send(loop, outbox)
+
+    assert len(sent) == 2
+    assert outbox.stats.failed == 1
+
+
+def test_pacing(loop, sim, modem):
+    sent, results = modem
+    outbox = Outbox(sim, pacing=0.2)
+    outbox.put('+4366', 'first')
+    outbox.put('+4366', 'second')
+    outbox.put('+4377', 'other')
+
+    send(loop, outbox)
+
+    # The sms to the other number does not wait for the pacing
+    times = dict(sent)
+    assert [message for message, _ in sent] == ['first', 'other', 'second']
+    assert times['second'] - times['first'] >= 0.2
+
+
+def test_persisted(loop, sim, modem, tmp_path):
+    sent, results = modem
+    path = str(tmp_path / 'outbox.json')
+
+    outbox = Outbox(sim, path=path, pacing=0)
+    outbox.put('+4366', 'first')
+    outbox.put('+4377', 'second')
+
+    with open(path) as f:
+        assert [sms['text'] for sms in json.load(f)] == ['first', 'second']
+
+    # The pending sms are sent after a restart
+    outbox = Outbox(sim, path=path, pacing=0)
+    send(loop, outbox)
+
+    assert [message for message, _ in sent] == ['first', 'second']
+    with open(path) as f:
+        assert json.load(f) == []
+
+    assert outbox.put('+4366', 'third').id == 3
+
+
+def test_invalid_number(loop, sim, modem, tmp_path):
+    sent, results = modem
+    path = str(tmp_path / 'outbox.json')
+
+    outbox = Outbox(sim, path=path, pacing=0)
+    with pytest.raises(PDUError):
+        outbox.put('+43 650 abc', 'invalid')
+    assert outbox.put('+43 (650) 123-45', 'valid').number == '+4365012345'
+    assert len(outbox.pending) == 1
+
+    # A persisted sms that can not be encoded fails without stopping the workers
+    with open(path, 'w') as f:
+        json.dump([{'id': 1, 'number': '+43 650 abc', 'text': 'invalid', 'created': time.time(), 'attempts': 0},
+                   {'id': 2, 'number': '+4366', 'text': 'valid', 'created': time.time(), 'attempts': 0}], f)
+    sim.pdu_mode = True
+    outbox = Outbox(sim, path=path, pacing=0, concurrency=1)
+    send(loop, outbox)
+
+    assert outbox.stats.failed == 1
+    assert outbox.stats.sent == 1
+    assert not outbox.pending
+
+
+def test_send_exception(loop, sim, modem):
+    sent, results = modem
+    outbox = Outbox(sim, pacing=0, retries=1, retry_delay=0.01, concurrency=1)
+    outbox.put('+4366', 'first')
+
+    send_sms = sim.send_sms
+    errors = [Sim800Error('ModemPool', 'No modem available')]
+
+    async def fail_once(number, text, sent=None):
+        if errors:
+            raise errors.pop()
+        return await send_sms(number, text, sent)
+
+    # E.g. no modem of a pool is available, the sms is sent again
+    with patch.object(sim, 'send_sms', side_effect=fail_once):
+        send(loop, outbox)
+
+    assert outbox.stats.retries == 1
+    assert outbox.stats.sent == 1
+
+
+def test_retry_multipart(loop, sim, modem):
+    sent, results = modem
+    sim.pdu_mode = True
+    parts = [data for _, data in pdu.encode_sms('+4366', 'a' * 400, 1)]
+    results[parts[1]] = [b'\r\n+CMS ERROR: 42\r\n']
+
+    outbox = Outbox(sim, pacing=0, retries=2, retry_delay=0.01)
+    outbox.put('+4366', 'a' * 400)
+
+    send(loop, outbox)
+
+    # The first part was accepted, so the temporary error of the second part is not retried
+    assert [message for message, _ in sent] == parts[:2]
+    assert outbox.stats.retries == 0
+    assert outbox.stats.failed == 1
+
+
+def test_retry_timeout(loop, sim, modem):
+    outbox = Outbox(sim, pacing=0, retries=2, retry_delay=0.01)
+    outbox.put('+4366', 'first')
+
+    async def timeout(number, text, sent=None):
+        event = ATEvent('SendSMS', None)
+        event.error = True
+        event.error_message = 'ResponseTimeout(No response within the deadline)'
+        return event
+
+    # The network may have accepted the sms before the timeout, so it is not sent again
+    with patch.object(sim, 'send_sms', side_effect=timeout) as send_sms:
+        send(loop, outbox)
+
+    assert send_sms.call_count == 1
+    assert outbox.stats.retries == 0
+    assert outbox.stats.failed == 1
@@ -0,0 +1,169 @@
+from gateway.io.sim800.pdu import encode_sms, decode_sms, pack_septets, unpack_septets, is_gsm7, normalize_number, \
+    decode_status_report, PDUError
+from gateway.io.sim800.at_parser import SMSListParser, SMSStreamParser, IncomingSMSParser, SMSStatusReportParser
+from gateway.io.sim800 import SMS
+from datetime import datetime, timedelta, timezone
+import pytest
+
+
+def test_septets():
+    # 'hellohello' from the well-known example of the gsm 03.40 pdu format
+    septets = [ord(char) for char in 'hellohello']
+    assert pack_septets(septets).hex().upper() == 'E8329BFD4697D9EC37'
+    assert unpack_septets(bytes.fromhex('E8329BFD4697D9EC37'), 10) == septets
+
+
+def test_decode_deliver():
+    sms = decode_sms('07917283010010F5040BC87238880900F10000993092516195800AE8329BFD4697D9EC37')
+
+    assert sms.address == '27838890001'
+    assert sms.message == 'hellohello'
+    assert sms.time == datetime(1999, 3, 29, 15, 16, 59, tzinfo=timezone(timedelta(hours=2)))
+    assert sms.parts == 1
+
+
+def test_decode_alphanumeric_address():
+    address = pack_septets([ord(char) for char in 'FONIC'])
+    data = '000409D0' + address.hex() + '00009101010000003A' + '0AE8329BFD4697D9EC37'
+
+    sms = decode_sms(data)
+
+    # The zone of -23 quarter hours has the sign bit set
+    assert sms.address == 'FONIC'
+    assert sms.time == datetime(2019, 10, 10, tzinfo=timezone(-timedelta(minutes=15 * 23)))
+
+
+def test_encode_single():
+    (length, data), = encode_sms('+436501234567', 'hellohello')
+
+    assert data == '0001000C9134561032547600000AE8329BFD4697D9EC37'
+    assert length == len(data) // 2 - 1
+
+
+def test_encode_extension_chars():
+    (length, data), = encode_sms('+4366', '[€]')
+
+    # Every char of the extension table needs an escape septet
+    assert data[18:20] == '06'
+    assert decode_sms(data).message == '[€]'
+
+
+def test_encode_concatenated_gsm7():
+    text = 'a' * 200 + '€'
+    pdus = encode_sms('+4366', text, reference=42)
+
+    parts = [decode_sms(data) for _, data in pdus]
+    assert [(part.reference, part.parts, part.part) for part in parts] == [(42, 2, 1), (42, 2, 2)]
+    assert len(parts[0].message) == 153
+    assert ''.join(part.message for part in parts) == text
+
+
+def test_encode_ucs2():
+    text = 'Grüße 😀 ' * 10
+    assert not is_gsm7(text)
+
+    pdus = encode_sms('+4366', text, reference=1)
+
+    assert all(length <= 140 + 12 for length, _ in pdus)
+    assert ''.join(decode_sms(data).message for _, data in pdus) == text
+
+
+def test_invalid():
+    with pytest.raises(PDUError):
+        encode_sms('+43 660', 'hello')
+    with pytest.raises(PDUError):
+        decode_sms('0791')
+
+
+def test_normalize_number():
+    assert normalize_number(' +43 (650) 123-45.6/7 ') == '+436501234567'
+    assert normalize_number('0650 1234') == '06501234'
+    for number in ('', '+', '+43 650 abc', '43+650', '1' * 21, '+43６５０'):
+        with pytest.raises(PDUError):
+            normalize_number(number)
+
+
+def test_list_parser_concatenated():
+    first, second = encode_sms('+4366', 'b' * 170, reference=3)
+    single = encode_sms('+4377', 'hello')[0]
+
+    # Stored SMS-SUBMIT pdus in the order the module lists them
+    sms = SMSListParser.parse([
+        '+CMGL: 4,3,,{}'.format(second[0]), second[1],
+        '+CMGL: 5,2,,{}'.format(single[0]), single[1],
+        '+CMGL: 7,3,,{}'.format(first[0]), first[1]
+    ])
+
+    assert len(sms) == 2
+    assert sms[0].message == 'b' * 170
+    assert sms[0].indexes == [7, 4]
+    assert sms[0].index == 7
+    assert sms[0].status == SMS.Status.Sent
+    assert sms[1].address == '+4377'
+    assert sms[1].status == SMS.Status.Unsent
+
+
+def test_stream_parser_concatenated():
+    first, second = encode_sms('+4366', 'b' * 170, reference=3)
+    single = encode_sms('+4377', 'hello')[0]
+    lines = [
+        '+CMGL: 4,3,,{}'.format(second[0]), second[1],
+        '+CMGL: 5,2,,{}'.format(single[0]), single[1],
+        '+CMGL: 7,3,,{}'.format(first[0]), first[1]
+    ]
+
+    parser = SMSStreamParser()
+    sms = [[s.index for s in parser.feed(line)] for line in lines]
+
+    # The single sms is returned at once and the concatenated sms with its last part
+    assert sms == [[], [], [], [5], [], [7]]
+    assert parser.close() == []
+
+
+def test_stream_parser_incomplete():
+    first = encode_sms('+4366', 'b' * 170, reference=3)[0]
+
+    parser = SMSStreamParser()
+    assert parser.feed('+CMGL: 7,3,,{}'.format(first[0])) == []
+    assert parser.feed(first[1]) == []
+
+    # Parts that are missing in the storage do not hold back the rest
+    sms = parser.close()
+    assert len(sms) == 1
+    assert sms[0].message == 'b' * 153
+
+
+def test_incoming_sms_parser_pdu():
+    sms = IncomingSMSParser.parse([
+        '+CMT: ,28',
+        '07917283010010F5040BC87238880900F10000993092516195800AE8329BFD4697D9EC37'
+    ])
+
+    assert sms.address == '27838890001'
+    assert sms.message == 'hellohello'
+    assert sms.status == SMS.Status.Unread
+
+
+# Status report of the message reference 42 to +436501234567, delivered two seconds after it was accepted
+STATUS_REPORT = '0006' '2A' '0C91345610325476' '91304121035480' '91304121037480' '00'
+
+
+def test_decode_status_report():
+    report = decode_status_report(STATUS_REPORT)
+
+    assert (report.reference, report.address, report.address_type, report.status) == (42, '+436501234567', 0x91, 0)
+    assert report.time == datetime(2019, 3, 14, 12, 30, 45, tzinfo=timezone(timedelta(hours=2)))
+    assert report.discharge_time - report.time == timedelta(seconds=2)
+
+    # A sms pdu is no status report
+    with pytest.raises(PDUError):
+        decode_status_report('07917283010010F5040BC87238880900F10000993092516195800AE8329BFD4697D9EC37')
+    with pytest.raises(PDUError):
+        decode_status_report(STATUS_REPORT[:20])
+
+
+def test_status_report_parser_pdu():
+    report = SMSStatusReportParser.parse(['+CDS: 25', STATUS_REPORT])
+
+    assert (report.mr, report.ra, report.tora, report.st) == (42, '+436501234567', '145', 0)
+    assert report.dt.second == 47
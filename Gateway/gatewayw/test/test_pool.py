@@ -0,0 +1,102 @@
+from gateway.io.sim800 import Sim800, Outbox
+from gateway.io.sim800.emulator import Emulator
+from gateway.io.sim800.pool import Modem, ModemPool, Policy, PoolError
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def emulators():
+    emulators = [Emulator(), Emulator(pin='1234')]
+    for emulator in emulators:
+        emulator.start()
+    yield emulators
+    for emulator in emulators:
+        emulator.close()
+
+
+@pytest.fixture
+def pool(loop, emulators):
+    modems = [
+        Modem('a', Sim800(serial_port=emulators[0].port, loop=loop, backend='asyncio'), cost=2, prefixes=['+43650']),
+        Modem('b', Sim800(serial_port=emulators[1].port, loop=loop, backend='asyncio'), cost=1, pin='1234',
+              carrier='Magenta')
+    ]
+    pool = ModemPool(modems, loop=loop)
+    loop.run_until_complete(pool.setup())
+    yield pool
+    pool.close()
+
+
+def test_policies(loop, pool, emulators):
+    assert [modem.available for modem in pool] == [True, True]
+    assert pool['b'].carrier == 'Magenta'
+
+    # Equally loaded modems are used in turn
+    loop.run_until_complete(asyncio.gather(*[pool.send_sms('+436641234567', 'Hello') for _ in range(4)]))
+    assert [emulator.sent for emulator in emulators] == [2, 2]
+
+    assert pool.select(policy=Policy.Cost).name == 'b'
+    assert pool.select('+436507654321', Policy.Carrier).name == 'a'
+    # Without a modem of the carrier the least busy modem is used
+    assert pool.select('+436641234567', Policy.Carrier).name == 'a'
+
+    pool['a'].pending = 3
+    assert pool.select().name == 'b'
+    assert pool.select(policy=Policy.Cost).name == 'b'
+    pool['a'].pending = 0
+
+    # Modems that could not be set up are skipped
+    pool['b'].available = False
+    assert pool.select(policy=Policy.Cost).name == 'a'
+
+
+def test_calls(loop, pool, emulators):
+    rings = []
+    ended = []
+    pool.on('caller_identification', lambda modem, number: rings.append((modem.name, number)))
+    pool.on('call_ended', lambda modem, data: ended.append(modem.name))
+
+    modem, event = loop.run_until_complete(pool.dial_number('+436507654321'))
+    assert not event.error
+    assert modem.in_call
+
+    # The second call goes over the other modem, a third one has no free line
+    other, event = loop.run_until_complete(pool.dial_number('+436507654322'))
+    assert other is not modem and other.in_call
+    with pytest.raises(PoolError):
+        loop.run_until_complete(pool.dial_number('+436507654323'))
+
+    loop.run_until_complete(pool.hang_up_call(modem))
+    assert not modem.in_call
+    assert pool.select(call=True) is modem
+
+    # Incoming calls are reported with their modem and take its line until the call ended
+    emulators[1].ring('+436501234567')
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert ('b', '+436501234567') in rings
+
+    emulators[1].inject('NO CARRIER')
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert ended == ['b'] and not pool['b'].in_call
+
+
+def test_outbox(loop, pool, emulators):
+    outbox = Outbox(pool, pacing=0, concurrency=2)
+    outbox.start()
+    for i in range(6):
+        outbox.put('+43664{:07d}'.format(i), 'Message {}'.format(i))
+    loop.run_until_complete(asyncio.wait_for(outbox.join(), 5))
+    loop.run_until_complete(outbox.stop())
+
+    assert outbox.stats.sent == 6
+    assert sum(emulator.sent for emulator in emulators) == 6
+    assert all(emulator.sent for emulator in emulators)
@@ -0,0 +1,20 @@
+from gateway.io.sim800.scts import parse_scts, timezone_of
+from datetime import datetime, timedelta, timezone
+import pytest
+
+
+def test_parse_scts():
+    assert parse_scts('19/03/14,12:30:45+04') == datetime(2019, 3, 14, 12, 30, 45, tzinfo=timezone(timedelta(hours=1)))
+    assert parse_scts('99/12/31,23:59:59-22').utcoffset() == -timedelta(hours=5, minutes=30)
+    assert parse_scts('19/03/14,12:30:45').tzinfo is None
+
+
+def test_parse_scts_malformed():
+    with pytest.raises(ValueError):
+        parse_scts('19-03-14 12:30:45+04')
+    with pytest.raises(ValueError):
+        parse_scts('19/13/14,12:30:45+04')
+
+
+def test_timezone_shared():
+    assert timezone_of(8) is timezone_of(8)
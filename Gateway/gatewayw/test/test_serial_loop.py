@@ -1,7 +1,12 @@
-from gateway.io.sim800.serial_loop import SerialLoop, EchoError, SerialError
-from gateway.io.sim800 import ATEvent, ATCommand, at_parser
+from gateway.io.sim800.serial_loop import SerialLoop, EchoError, SerialError, ResponseTimeout
+from gateway.io.sim800.command_queue import CommandQueue
+from gateway.io.sim800 import ATEvent, ATCommand, Priority, at_parser
+import os
 import queue
+import threading
+import time
 import pytest
+import unittest.mock
 from unittest.mock import Mock
 
 
@@ -41,7 +46,7 @@ def emitter_mock():
 @pytest.fixture
 def serial_mock():
     mock = Mock()
-    attrs = {'write.return_value': '', 'readline.side_effect': ['']}
+    attrs = {'write.return_value': '', 'in_waiting': 0, 'read.side_effect': [b'']}
     mock.configure_mock(**attrs)
     return mock
 
@@ -66,22 +71,31 @@ def test_get_event_from_queue(command_queue, emitter_mock, serial_mock):
 
 
 def test_verify_echo_success(sms_command, emitter_mock, serial_mock):
-    ret = sms_command.command.encode('utf-8')
-    serial_mock.readline.side_effect = [ret]
+    ret = sms_command.command.encode('utf-8') + b'\r\r\n'
+    serial_mock.read.side_effect = [ret]
     serialloop = SerialLoop(emitter_mock, serial_mock, False)
 
     serialloop._verify_echo(sms_command)
-    serial_mock.readline.assert_called_once()
+    serial_mock.read.assert_called_once()
 
 
 def test_verify_echo_failure(serial_mock, emitter_mock, sms_command):
     serialloop = SerialLoop(emitter_mock, serial_mock, False)
-    serial_mock.readline.side_effect = [b'wrong echo']
+    serial_mock.read.side_effect = [b'wrong echo\r\n']
 
     with pytest.raises(EchoError):
         serialloop._verify_echo(sms_command)
 
-    serial_mock.readline.assert_called_once()
+    serial_mock.read.assert_called_once()
+
+
+def test_verify_echo_after_ring(serial_mock, emitter_mock, sms_command):
+    serial_mock.read.side_effect = [b'\r\nRING\r\n', sms_command.command.encode('utf-8') + b'\r\r\n']
+    serialloop = SerialLoop(emitter_mock, serial_mock, False)
+
+    # The result code is dispatched and the echo is still verified
+    serialloop._verify_echo(sms_command)
+    emitter_mock.emit.assert_called_once_with('ring', None)
 
 
 def test_verify_echo_off(emitter_mock, serial_mock, sms_command):
@@ -89,11 +103,11 @@ def test_verify_echo_off(emitter_mock, serial_mock, sms_command):
 
     serialloop.echo = False
     serialloop._verify_echo(sms_command)
-    serial_mock.readline.assert_not_called()
+    serial_mock.read.assert_not_called()
 
 
 def test_read_response_ok(event, emitter_mock, serial_mock):
-    serial_mock.readline.side_effect = [b'Line1', b'Line2', b'Line3', b'OK: Some Message']
+    serial_mock.read.side_effect = [b'Line1\r\n', b'Line2\r\nLine3\r\n', b'\r\nO', b'K\r\n']
     serialloop = SerialLoop(emitter_mock, serial_mock, False)
 
     assert type(event.content) == list
@@ -109,19 +123,19 @@ def test_read_response_ok(event, emitter_mock, serial_mock):
 
 
 def test_read_response_error(event, emitter_mock, serial_mock):
-    serial_mock.readline.side_effect = [b'Line1', b'Line3', b'ERROR<Error Code>']
+    serial_mock.read.side_effect = [b'Line1\r\n', b'Line3\r\n', b'+CMS ERROR: 321\r\n']
     serialloop = SerialLoop(emitter_mock, serial_mock, False)
 
     serialloop._read_response(event)
 
     assert len(event.content) == 2
     assert event.error
-    assert event.error_message == 'ERROR<Error Code>'
+    assert event.error_message == '+CMS ERROR: 321'
     assert event.content[0] == 'Line1'
 
 
 def test_read_response_interruption(event, emitter_mock, serial_mock):
-    serial_mock.readline.side_effect = [b'Line1', b'Line2', b'RING', b'Line3', b'OK: Some Message']
+    serial_mock.read.side_effect = [b'Line1\r\n', b'Line2\r\n', b'\r\nRING\r\n', b'Line3\r\n', b'\r\nOK\r\n']
     serialloop = SerialLoop(emitter_mock, serial_mock, False)
 
     assert type(event.content) == list
@@ -139,7 +153,7 @@ def test_read_response_interruption(event, emitter_mock, serial_mock):
 
 
 def test_read_response_serial_error(event, emitter_mock, serial_mock):
-    serial_mock.readline.side_effect = [b'Line1', b'\xde\xad\xbe\xef', b'OK']
+    serial_mock.read.side_effect = [b'Line1\r\n', b'\xde\xad\xbe\xef\r\n', b'OK\r\n']
     serialloop = SerialLoop(emitter_mock, serial_mock, False)
 
     with pytest.raises(SerialError):
@@ -166,11 +180,11 @@ def test_emit_serial_event(serial_mock, emitter_mock):
 def test_read(serial_mock, emitter_mock):
     data = b'Test'
     serialloop = SerialLoop(emitter_mock, serial_mock, False)
-    serial_mock.readline.side_effect = [data]
+    serial_mock.read.side_effect = [data]
 
     ret_data = serialloop._read()
 
-    serial_mock.readline.assert_called_once()
+    serial_mock.read.assert_called_once_with(1)
     assert type(ret_data) == bytes
     assert data == ret_data
 
@@ -189,3 +203,181 @@ def test_write_value_error(serial_mock, emitter_mock):
         serialloop._write(object())
 
     serial_mock.write.assert_not_called()
+
+
+def test_run_wakes_up_on_put(event, emitter_mock, serial_mock):
+    read_fd, write_fd = os.pipe()
+    written = threading.Event()
+    serial_mock.fileno.return_value = read_fd
+    serial_mock.write.side_effect = lambda data: written.set()
+    serial_mock.read.side_effect = [b'OK\r\n']
+    event.set = Mock()
+
+    serialloop = SerialLoop(emitter_mock, serial_mock, False)
+    serialloop.echo = False
+    serialloop.start()
+
+    # Give the loop time to fall asleep in the selector
+    time.sleep(0.05)
+    start = time.monotonic()
+    serialloop.put(event)
+
+    assert written.wait(1)
+    assert time.monotonic() - start < 0.1
+
+    serialloop.stop()
+    serialloop.join(1)
+    assert not serialloop.is_alive()
+    event.set.assert_called_once()
+
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+def test_read_response_sms_body(event, emitter_mock, serial_mock):
+    serial_mock.read.side_effect = [b'+CMGL: 1,"REC READ","+436501234567","","19/03/14,12:30:45+04"\r\n',
+                                    b'OK\r\n', b'\r\nOK\r\n']
+    serialloop = SerialLoop(emitter_mock, serial_mock, False)
+
+    serialloop._read_response(event)
+
+    # The message of the sms must not end the response
+    assert len(event.content) == 2
+    assert event.content[1] == 'OK'
+    assert not event.error
+
+
+def test_read_response_unsolicited(event, emitter_mock, serial_mock):
+    serial_mock.read.side_effect = [b'Line1\r\n\r\n+CMTI: "SM",3\r\n', b'\r\n+CLIP: "+436501234567",145,"",0,"",0\r\n',
+                                    b'\r\nNO CARRIER\r\n\r\nOK\r\n']
+    serialloop = SerialLoop(emitter_mock, serial_mock, False)
+    serialloop.tokenizer.responses = {b'+CMGL'}
+
+    serialloop._read_response(event)
+
+    assert event.content == ['Line1']
+    assert [c[0][0] for c in emitter_mock.emit.call_args_list] == ['new_sms', 'caller_identification', 'call_ended']
+
+    indication = emitter_mock.emit.call_args_list[0][0][1]
+    assert indication.storage == 'SM'
+    assert indication.index == 3
+    assert emitter_mock.emit.call_args_list[1][0][1] == '+436501234567'
+
+
+def test_emit_incoming_sms(serial_mock, emitter_mock):
+    serial_mock.read.side_effect = [b'\r\n+CMT: "+436501234567","","19/03/14,12:30:45+04"\r\nOK\r\n']
+    serialloop = SerialLoop(emitter_mock, serial_mock, False)
+
+    serialloop._read_idle()
+
+    emitter_mock.emit.assert_called_once()
+    name, sms = emitter_mock.emit.call_args[0]
+    assert name == 'sms'
+    assert sms.address == '+436501234567'
+    assert sms.message == 'OK'
+    assert sms.time.hour == 12
+
+
+def test_command_queue_priority(event):
+    command_queue = CommandQueue()
+    hang_up = ATEvent('HangUpCall', ATCommand('ATH\r\n', name='HangUpCall', priority=Priority.CallControl))
+    signal = ATEvent('SignalQuality', ATCommand('AT+CSQ\r\n', name='SignalQuality'))
+    event.command.priority = Priority.Background
+
+    command_queue.put(event)
+    command_queue.put(signal)
+    command_queue.put(hang_up)
+
+    assert command_queue.qsize() == 3
+    assert command_queue.depth(Priority.Background) == 1
+    assert command_queue.get() is hang_up
+    assert command_queue.get() is signal
+    assert command_queue.get() is event
+    assert command_queue.empty()
+
+    with pytest.raises(queue.Empty):
+        command_queue.get()
+
+
+def test_command_queue_limits():
+    command_queue = CommandQueue({Priority.Interactive: 2})
+    events = [ATEvent('SignalQuality', ATCommand('AT+CSQ\r\n', name='SignalQuality')) for _ in range(3)]
+    hang_up = ATEvent('HangUpCall', ATCommand('ATH\r\n', name='HangUpCall', priority=Priority.CallControl))
+
+    command_queue.put(events[0])
+    command_queue.put(events[1])
+    with pytest.raises(queue.Full):
+        command_queue.put(events[2])
+
+    # Other classes are not limited and cancelled events free their place
+    command_queue.put(hang_up)
+    events[0].cancelled = True
+    command_queue.put(events[2])
+
+    assert command_queue.depth(Priority.Interactive) == 2
+    assert [command_queue.get() for _ in range(3)] == [hang_up, events[1], events[2]]
+
+
+def test_next_token_timeout(emitter_mock, serial_mock):
+    serial_mock.read.side_effect = None
+    serial_mock.read.return_value = b''
+    serialloop = SerialLoop(emitter_mock, serial_mock, False)
+    serialloop._deadline = time.monotonic() + 0.01
+
+    with pytest.raises(ResponseTimeout):
+        serialloop._next_token()
+
+
+def test_fail_event(event, emitter_mock, serial_mock):
+    serialloop = SerialLoop(emitter_mock, serial_mock, False)
+    serialloop.tokenizer.responses = {b'+CMGL'}
+    event.set = Mock()
+
+    serialloop._fail_event(event, ResponseTimeout('No response'))
+
+    event.set.assert_called_once()
+    assert event.error
+    assert event.error_message == 'ResponseTimeout(No response)'
+    assert not serialloop.tokenizer.responses
+
+
+def test_resync(emitter_mock, serial_mock):
+    # The rest of a late response is drained, then the module answers the bare AT command
+    serial_mock.read.side_effect = [b'+CMGL: 1,"REC', b'', b'\r\nRING\r\n', b'OK\r\n']
+    serialloop = SerialLoop(emitter_mock, serial_mock, False)
+
+    assert serialloop._resync()
+
+    serial_mock.reset_input_buffer.assert_called_once()
+    serial_mock.write.assert_called_once_with(b'AT\r')
+    emitter_mock.emit.assert_called_once_with('ring', None)
+    assert serialloop._deadline is None
+
+
+def test_resync_failed(emitter_mock, serial_mock):
+    serial_mock.read.side_effect = None
+    serial_mock.read.return_value = b''
+    serialloop = SerialLoop(emitter_mock, serial_mock, False)
+
+    with unittest.mock.patch('gateway.io.sim800.serial_loop.RESYNC_TIMEOUT', 0.01):
+        assert not serialloop._resync()
+
+    assert serial_mock.write.call_count == 3
+
+
+def test_run_skips_cancelled_event(event, emitter_mock, serial_mock):
+    read_fd, write_fd = os.pipe()
+    serial_mock.fileno.return_value = read_fd
+    event.cancelled = True
+
+    serialloop = SerialLoop(emitter_mock, serial_mock, False)
+    serialloop.put(event)
+    serialloop.start()
+    time.sleep(0.05)
+
+    serialloop.stop()
+    serialloop.join(1)
+    serial_mock.write.assert_not_called()
+
+    os.close(read_fd)
+    os.close(write_fd)
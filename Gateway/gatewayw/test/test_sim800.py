@@ -0,0 +1,518 @@
+from gateway.io.sim800 import Sim800, Sim800Error, ATCommand, Priority, SignalQuality, PINStatus, NetworkStatus, SMS
+from gateway.io.sim800 import ATEvent, at_parser, pdu
+import asyncio
+import os
+import queue
+import pytest
+from unittest.mock import patch
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def pipe():
+    read_fd, write_fd = os.pipe()
+    yield read_fd, write_fd
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+@pytest.fixture
+def modem(pipe):
+    """
+    Answers every command written to the serial mock with the response that is registered for it.
+    """
+
+    responses = {}
+
+    def write(data):
+        if data in responses:
+            os.write(pipe[1], responses[data])
+
+    with patch('gateway.io.sim800.sim800.Serial') as serial_class:
+        serial = serial_class.return_value
+        serial.fileno.return_value = pipe[0]
+        serial.write.side_effect = write
+        yield serial, responses
+
+
+@pytest.fixture
+def sim(loop, modem):
+    sim = Sim800(loop=loop, backend='asyncio')
+    sim.serial_loop.echo = False
+    yield sim
+    sim.close()
+
+
+def test_batch(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CSQ;+CREG?;+CPIN?;+CIMI\r'] = b'\r\n+CSQ: 15,0\r\n\r\n+CREG: 0,1\r\n\r\n+CPIN: READY\r\n' \
+                                                 b'\r\n232011234567890\r\n\r\nOK\r\n'
+
+    signal, network, pin, imsi = loop.run_until_complete(sim.request_status())
+
+    serial.write.assert_called_once_with(b'AT+CSQ;+CREG?;+CPIN?;+CIMI\r')
+    assert signal.data == SignalQuality('15', '0')
+    assert network.data.stat == NetworkStatus.Status.RegisteredHome
+    assert pin.data == PINStatus.Ready
+    assert imsi.content == ['232011234567890']
+    assert (imsi.data.mcc, imsi.data.mnc, imsi.data.msin) == ('232', '01', '1234567890')
+    assert not any(event.error for event in (signal, network, pin, imsi))
+
+
+def test_batch_error(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CSQ;+CPIN?\r'] = b'\r\n+CSQ: 15,0\r\n\r\n+CME ERROR: 10\r\n'
+
+    signal, pin = loop.run_until_complete(sim.batch([
+        ATCommand('AT+CSQ\r\n', name='SignalQuality', parser=at_parser.SignalQualityParser),
+        ATCommand('AT+CPIN?\r\n', name='PINStatus', parser=at_parser.PinStatusParser)
+    ]))
+
+    assert not signal.error
+    assert signal.data.rssi == '15'
+    assert pin.error
+    assert pin.error_message == '+CME ERROR: 10'
+
+
+def test_batch_malformed(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CSQ;+CREG?;+CPIN?;+CIMI\r'] = b'\r\n+CSQ: 15\r\n\r\n+CREG: 0,1\r\n\r\n+CPIN: READY\r\n' \
+                                                 b'\r\n232011234567890\r\n\r\nOK\r\n'
+
+    signal, network, pin, imsi = loop.run_until_complete(asyncio.wait_for(sim.request_status(), 1))
+
+    # Only the malformed answer fails, the other commands are parsed
+    assert signal.error
+    assert signal.error_message.startswith('ParserError(')
+    assert network.data.stat == NetworkStatus.Status.RegisteredHome
+    assert pin.data == PINStatus.Ready
+    assert not any(event.error for event in (network, pin, imsi))
+    assert all(event.is_set() for event in (signal, network, pin, imsi))
+
+
+def test_batch_basic_command(loop, sim):
+    with pytest.raises(ValueError):
+        loop.run_until_complete(sim.batch([ATCommand('ATA\r\n', name='AnswerCall')]))
+
+
+def test_queue_limit(loop, modem):
+    serial, responses = modem
+    sim = Sim800(loop=loop, backend='asyncio', queue_limits={Priority.Background: 1})
+    sim.serial_loop.echo = False
+
+    async def run():
+        first = asyncio.ensure_future(sim.write(ATCommand('AT+CMGL="ALL"\r\n', priority=Priority.Background)))
+        second = asyncio.ensure_future(sim.write(ATCommand('AT+CMGL="ALL"\r\n', priority=Priority.Background)))
+        await asyncio.sleep(0.01)
+
+        # The second command waits in the coroutine instead of the queue
+        assert serial.write.call_count == 1
+        assert sim.serial_loop.command_queue.empty()
+
+        first.cancel()
+        second.cancel()
+
+    loop.run_until_complete(run())
+    sim.close()
+
+
+def test_queue_limit_direct_put(loop, modem):
+    serial, responses = modem
+    sim = Sim800(loop=loop, backend='asyncio', queue_limits={Priority.Background: 1})
+    sim.serial_loop.echo = False
+
+    async def run():
+        # The command queue enforces the limit for commands that bypass Sim800.write
+        sim.serial_loop.put(ATEvent('Busy', ATCommand('AT\r\n', name='Busy'), loop=loop, threadsafe=False))
+        sim.serial_loop.put(ATEvent('List', ATCommand('AT+CMGL="ALL"\r\n', priority=Priority.Background),
+                                    loop=loop, threadsafe=False))
+        with pytest.raises(queue.Full):
+            sim.serial_loop.put(ATEvent('List', ATCommand('AT+CMGL="ALL"\r\n', priority=Priority.Background),
+                                        loop=loop, threadsafe=False))
+        return await sim.write(ATCommand('AT+CMGD=1\r\n', priority=Priority.Background))
+
+    event = loop.run_until_complete(run())
+    assert event.error
+    assert event.error_message == 'QueueFull(Background)'
+    sim.close()
+
+
+def test_subscriber_number_not_stored(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CNUM\r'] = b'\r\nOK\r\n'
+    responses[b'AT+CREG=1\r'] = b'\r\nOK\r\n'
+
+    event = loop.run_until_complete(sim.request_subscriber_number())
+    assert not event.error
+    assert event.data is None
+
+    # The set form of a command with a registered response has no data to parse
+    event = loop.run_until_complete(sim.write(ATCommand('AT+CREG=1\r\n')))
+    assert not event.error
+
+
+def test_write_timeout(loop, sim, modem):
+    serial, responses = modem
+
+    event = loop.run_until_complete(asyncio.wait_for(sim.write(ATCommand('AT+CSQ\r\n', timeout=0.01)), 1))
+
+    # The caller gets the failure as soon as the deadline passed
+    assert event.error
+    assert event.error_message.startswith('ResponseTimeout')
+
+
+def test_write_cancelled(loop, pipe, sim, modem):
+    serial, responses = modem
+
+    async def run():
+        first = asyncio.ensure_future(sim.write(ATCommand('AT+CSQ\r\n')))
+        second = asyncio.ensure_future(sim.write(ATCommand('AT+CREG?\r\n')))
+        await asyncio.sleep(0.01)
+        second.cancel()
+
+        os.write(pipe[1], b'\r\n+CSQ: 15,0\r\n\r\nOK\r\n')
+        event = await first
+
+        assert not event.error
+        assert second.cancelled()
+
+    loop.run_until_complete(run())
+
+    # The cancelled command is skipped instead of written
+    serial.write.assert_called_once_with(b'AT+CSQ\r')
+
+
+def test_cache(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CSQ\r'] = b'\r\n+CSQ: 15,0\r\n\r\nOK\r\n'
+
+    first = loop.run_until_complete(sim.request_signal_quality())
+    second = loop.run_until_complete(sim.request_signal_quality())
+
+    # The second request is answered without the serial interface
+    serial.write.assert_called_once_with(b'AT+CSQ\r')
+    assert second is first
+    assert second.data.rssi == '15'
+
+
+def test_cache_expired(loop, modem):
+    serial, responses = modem
+    responses[b'AT+CSQ\r'] = b'\r\n+CSQ: 15,0\r\n\r\nOK\r\n'
+    sim = Sim800(loop=loop, backend='asyncio', cache_ttls={'AT+CSQ': 0.01})
+    sim.serial_loop.echo = False
+
+    loop.run_until_complete(sim.request_signal_quality())
+    loop.run_until_complete(asyncio.sleep(0.02))
+    loop.run_until_complete(sim.request_signal_quality())
+
+    assert serial.write.call_count == 2
+    sim.close()
+
+
+def test_cache_error(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+GSN\r'] = b'\r\nERROR\r\n'
+
+    loop.run_until_complete(sim.request_imei())
+    loop.run_until_complete(sim.request_imei())
+
+    # Failed commands are never cached
+    assert serial.write.call_count == 2
+
+
+def test_cache_invalidated_by_urc(loop, pipe, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CPIN?\r'] = b'\r\n+CPIN: SIM PIN\r\n\r\nOK\r\n'
+    responses[b'AT+CIMI\r'] = b'\r\n232011234567890\r\n\r\nOK\r\n'
+
+    loop.run_until_complete(sim.request_pin_status())
+    loop.run_until_complete(sim.request_imsi())
+    assert 'AT+CPIN?' in sim.cache
+    assert 'AT+CIMI' in sim.cache
+
+    os.write(pipe[1], b'\r\n+CPIN: READY\r\n')
+    loop.run_until_complete(asyncio.sleep(0.01))
+
+    assert 'AT+CPIN?' not in sim.cache
+    assert 'AT+CIMI' not in sim.cache
+
+
+def test_cache_invalidated_by_enter_pin(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CPIN?\r'] = b'\r\n+CPIN: SIM PIN\r\n\r\nOK\r\n'
+    responses[b'AT+CPIN=1234\r'] = b'\r\nOK\r\n'
+
+    loop.run_until_complete(sim.request_pin_status())
+    event = loop.run_until_complete(sim.enter_pin('1234'))
+
+    assert not event.error
+    assert 'AT+CPIN?' not in sim.cache
+
+
+def test_single_flight(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CSQ\r'] = b'\r\n+CSQ: 15,0\r\n\r\nOK\r\n'
+
+    async def run():
+        return await asyncio.gather(*(sim.request_signal_quality() for _ in range(5)))
+
+    events = loop.run_until_complete(run())
+
+    # The burst costs one round trip
+    serial.write.assert_called_once_with(b'AT+CSQ\r')
+    assert all(event is events[0] for event in events)
+    assert not sim._in_flight
+
+
+def test_single_flight_full_class(loop, pipe, modem):
+    serial, responses = modem
+    responses[b'AT+CSQ\r'] = b'\r\n+CSQ: 15,0\r\n\r\nOK\r\n'
+    sim = Sim800(loop=loop, backend='asyncio', queue_limits={Priority.Interactive: 1})
+    sim.serial_loop.echo = False
+
+    async def run():
+        # The only slot of the class is taken, so the signal requests wait for it
+        busy = asyncio.ensure_future(sim.write(ATCommand('AT\r\n')))
+        await asyncio.sleep(0.01)
+        requests = asyncio.gather(*(sim.request_signal_quality() for _ in range(5)))
+        await asyncio.sleep(0.01)
+
+        os.write(pipe[1], b'\r\nOK\r\n')
+        await busy
+        return await requests
+
+    events = loop.run_until_complete(asyncio.wait_for(run(), 2))
+
+    assert [call[0][0] for call in serial.write.call_args_list] == [b'AT\r', b'AT+CSQ\r']
+    assert all(event is events[0] for event in events)
+    assert not sim._in_flight
+    sim.close()
+
+
+def test_single_flight_cancelled_before_slot(loop, pipe, modem):
+    serial, responses = modem
+    responses[b'AT+CSQ\r'] = b'\r\n+CSQ: 15,0\r\n\r\nOK\r\n'
+    sim = Sim800(loop=loop, backend='asyncio', queue_limits={Priority.Interactive: 1})
+    sim.serial_loop.echo = False
+
+    async def run():
+        busy = asyncio.ensure_future(sim.write(ATCommand('AT\r\n')))
+        await asyncio.sleep(0.01)
+        first = asyncio.ensure_future(sim.request_signal_quality())
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(sim.request_signal_quality())
+        await asyncio.sleep(0.01)
+
+        # The second caller writes the command itself, if the first one gives up before it was written
+        first.cancel()
+        os.write(pipe[1], b'\r\nOK\r\n')
+        await busy
+        return await second
+
+    event = loop.run_until_complete(asyncio.wait_for(run(), 2))
+
+    assert event.data.rssi == '15'
+    assert [call[0][0] for call in serial.write.call_args_list] == [b'AT\r', b'AT+CSQ\r']
+    sim.close()
+
+
+def test_single_flight_cancelled(loop, pipe, sim, modem):
+    serial, responses = modem
+
+    async def run():
+        first = asyncio.ensure_future(sim.request_imei())
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(sim.request_imei())
+        await asyncio.sleep(0.01)
+
+        # The shared command stays queued, as long as one task waits for it
+        first.cancel()
+        await asyncio.sleep(0.01)
+        os.write(pipe[1], b'\r\n123456789012345\r\n\r\nOK\r\n')
+        return await second
+
+    event = loop.run_until_complete(run())
+
+    serial.write.assert_called_once_with(b'AT+GSN\r')
+    assert not event.cancelled
+    assert event.data.imei == '123456789012345'
+
+
+def test_write_not_shared(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CPIN=1234\r'] = b'\r\nOK\r\n'
+
+    async def run():
+        return await asyncio.gather(sim.enter_pin('1234'), sim.enter_pin('1234'))
+
+    loop.run_until_complete(run())
+
+    # Commands that change the state are always written
+    assert serial.write.call_count == 2
+
+
+@pytest.fixture
+def baud_modem(pipe, modem):
+    """
+    Answers a bare AT command and switches its baud rate with AT+IPR, but only if the baud rates match.
+    On an unstable baud rate only the bare AT commands get garbled.
+    """
+
+    serial, responses = modem
+    state = {'baudrate': 9600, 'unstable': set()}
+    serial.baudrate = 9600
+
+    def write(data):
+        if serial.baudrate != state['baudrate']:
+            os.write(pipe[1], b'\xff\xfe\r\n')
+        elif data == b'AT\r' and serial.baudrate in state['unstable']:
+            os.write(pipe[1], b'\xff\xfe\r\n')
+        elif data == b'AT\r':
+            os.write(pipe[1], b'\r\nOK\r\n')
+        elif data.startswith(b'AT+IPR='):
+            os.write(pipe[1], b'\r\nOK\r\n')
+            state['baudrate'] = int(data[7:-1])
+
+    serial.write.side_effect = write
+    with patch('gateway.io.sim800.async_serial_loop.RESYNC_TIMEOUT', 0.01), \
+            patch('gateway.io.sim800.async_serial_loop.RESYNC_QUIET', 0.01):
+        yield serial, state
+
+
+def test_negotiate_baudrate(loop, sim, baud_modem):
+    serial, state = baud_modem
+
+    baudrate = loop.run_until_complete(sim.negotiate_baudrate())
+
+    assert baudrate == 115200
+    assert state['baudrate'] == 115200
+    assert serial.baudrate == 115200
+
+
+def test_negotiate_baudrate_probe(loop, sim, baud_modem):
+    serial, state = baud_modem
+    state['baudrate'] = 57600
+
+    baudrate = loop.run_until_complete(sim.negotiate_baudrate([57600, 19200]))
+
+    # The module already uses the fastest allowed baud rate
+    assert baudrate == 57600
+    assert not any(c[0][0].startswith(b'AT+IPR') for c in serial.write.call_args_list)
+
+
+def test_negotiate_baudrate_fallback(loop, sim, baud_modem):
+    serial, state = baud_modem
+    state['unstable'] = {115200}
+
+    baudrate = loop.run_until_complete(sim.negotiate_baudrate())
+
+    assert baudrate == 57600
+    assert serial.baudrate == 57600
+    assert state['baudrate'] == 57600
+
+
+def test_negotiate_baudrate_no_answer(loop, sim, baud_modem):
+    serial, state = baud_modem
+    state['baudrate'] = 4800
+
+    with pytest.raises(Sim800Error):
+        loop.run_until_complete(sim.negotiate_baudrate())
+
+
+def test_link_mode(loop, sim, modem):
+    serial, responses = modem
+    responses[b'ATE0\r'] = b'\r\nOK\r\n'
+    responses[b'ATV0\r'] = b'0\r'
+    responses[b'AT+CSQ\r'] = b'+CSQ: 15,0\r\n0\r'
+    responses[b'AT+CPIN?\r'] = b'+CME ERROR: 10\r\n'
+    responses[b'AT+GSN\r'] = b'4\r'
+
+    loop.run_until_complete(sim.set_link_mode(True))
+    assert not sim.serial_loop.echo
+    assert sim.serial_loop.tokenizer.numeric
+
+    signal = loop.run_until_complete(sim.request_signal_quality())
+    pin = loop.run_until_complete(sim.request_pin_status())
+    imei = loop.run_until_complete(sim.request_imei())
+
+    assert signal.data.rssi == '15'
+    assert pin.error_message == '+CME ERROR: 10'
+    assert imei.error
+    assert imei.error_message == 'ERROR'
+
+
+def test_send_sms_pdu(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CMGF=0\r'] = b'\r\nOK\r\n'
+    pdus = pdu.encode_sms('+436501234567', 'x' * 200, reference=1)
+    for reference, (length, data) in enumerate(pdus, 7):
+        responses['AT+CMGS={}\r'.format(length).encode()] = b'\r\n> '
+        responses[data.encode() + b'\x1a'] = '\r\n+CMGS: {}\r\n\r\nOK\r\n'.format(reference).encode()
+
+    loop.run_until_complete(sim.set_sms_mode(0))
+    sent = []
+    event = loop.run_until_complete(sim.send_sms('+436501234567', 'x' * 200, sent))
+
+    # The text is sent as concatenated sms in two parts
+    assert not event.error
+    assert event.data == 8
+    assert sent == [7, 8]
+    assert [c[0][0] for c in serial.write.call_args_list[1:]] == [
+        b'AT+CMGS=153\r', pdus[0][1].encode() + b'\x1a', b'AT+CMGS=61\r', pdus[1][1].encode() + b'\x1a']
+
+
+def test_iter_sms(loop, pipe, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CMGL="ALL"\r'] = b'\r\n+CMGL: 1,"REC READ","+436501234567",""\r\nHello\r\n'
+
+    async def run():
+        listing = sim.iter_sms()
+
+        # The first sms is available before the module finished the listing
+        first = await asyncio.wait_for(listing.__anext__(), 1)
+
+        os.write(pipe[1], b'\r\n+CMGL: 2,"REC UNREAD","+436501234567",""\r\nWorld\r\n\r\nOK\r\n')
+        return [first] + [sms async for sms in listing]
+
+    sms = loop.run_until_complete(run())
+
+    assert [(s.index, s.message) for s in sms] == [(1, 'Hello'), (2, 'World')]
+
+
+def test_iter_sms_backpressure(loop, pipe, sim, modem):
+    serial, responses = modem
+    lines = b''.join('\r\n+CMGL: {},"REC READ","+4366",""\r\nsms {}\r\n'.format(i, i).encode() for i in range(4))
+    responses[b'AT+CMGL="REC READ"\r'] = lines
+
+    async def run():
+        listing = sim.iter_sms(SMS.Status.Read, maxsize=2)
+        first = await listing.__anext__()
+
+        # The consumer is behind, so the serial interface is not read
+        assert sim.serial_loop.paused
+        os.write(pipe[1], b'\r\nOK\r\n')
+        await asyncio.sleep(0.01)
+
+        sms = [first] + [sms async for sms in listing]
+        assert not sim.serial_loop.paused
+        return sms
+
+    sms = loop.run_until_complete(run())
+    assert [s.message for s in sms] == ['sms 0', 'sms 1', 'sms 2', 'sms 3']
+
+
+def test_iter_sms_error(loop, sim, modem):
+    serial, responses = modem
+    responses[b'AT+CMGL="ALL"\r'] = b'\r\n+CMS ERROR: 321\r\n'
+
+    async def run():
+        return [sms async for sms in sim.iter_sms()]
+
+    with pytest.raises(Sim800Error):
+        loop.run_until_complete(run())
@@ -0,0 +1,29 @@
+from gateway.utils import split_str
+from gateway.utils.string_utils import split_fields_bytes
+import pytest
+
+
+def test_split_str():
+    assert split_str('+CMGL: 1,"REC READ","+436501234567","Doe, John","19/03/14,12:30:45+04"') == [
+        ' 1', '"REC READ"', '"+436501234567"', '"Doe, John"', '"19/03/14,12:30:45+04"']
+    assert split_str('+CMGL: 1,"Müller, Anna"', 7) == ['1', '"Müller, Anna"']
+    assert split_str('a,,b') == ['a', '', 'b']
+    assert split_str('+CSQ:') == ['']
+
+    # More fields than the bounds on the stack
+    assert split_str('+X:' + ','.join(str(i) for i in range(100))) == [str(i) for i in range(100)]
+
+
+def test_split_fields_bytes():
+    line = b'+CLIP: "+436501234567",145,"",0,"Doe, John",0'
+
+    assert split_fields_bytes(line, 7) == [b'"+436501234567"', b'145', b'""', b'0', b'"Doe, John"', b'0']
+    assert split_fields_bytes(bytearray(b'1,2')) == [bytearray(b'1'), bytearray(b'2')]
+    assert split_fields_bytes(b'1,2', 3) == [b'']
+
+    fields = split_fields_bytes(memoryview(line), 7)
+    assert isinstance(fields[0], memoryview) and fields[0].obj is line
+    assert [bytes(field) for field in fields][4] == b'"Doe, John"'
+
+    with pytest.raises(ValueError):
+        split_fields_bytes(line, -1)
@@ -0,0 +1,118 @@
+from gateway.io.sim800 import Sim800
+from gateway.io.sim800.emulator import Emulator
+from gateway.io.sim800.trace import TraceRecorder, TraceReplayer, read_trace, FLUSH_SIZE, RECEIVED, WRITTEN
+import asyncio
+import os
+import pytest
+import time
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+def session(loop, sim):
+    async def run():
+        await sim.setup()
+        return await sim.request_status() + [await sim.request_all_sms()]
+
+    return loop.run_until_complete(run())
+
+
+@pytest.mark.parametrize('backend', ['thread', 'asyncio'])
+def test_record_and_replay(loop, tmpdir, backend):
+    path = str(tmpdir.join('serial.trace'))
+
+    emulator = Emulator()
+    emulator.start()
+    emulator.receive_sms('+436501234567', 'Hello')
+    sim = Sim800(serial_port=emulator.port, loop=loop, backend=backend, trace=path)
+    recorded = session(loop, sim)
+    sim.close()
+    emulator.close()
+
+    records = list(read_trace(path))
+    assert records[0].direction == WRITTEN and records[0].data == b'ATE0\r'
+    assert b''.join(record.data for record in records if record.direction == RECEIVED).startswith(b'ATE0\r')
+    assert all(a.time <= b.time for a, b in zip(records, records[1:]))
+
+    # The same session against the replay gets the same responses
+    replayer = TraceReplayer(path, speed=None)
+    replayer.start()
+    assert replayer.commands()[:3] == ['ATE0', 'ATV0', 'AT+CMGF=0']
+
+    sim = Sim800(serial_port=replayer.port, loop=loop, backend=backend)
+    replayed = session(loop, sim)
+    assert replayer.done.wait(1)
+    sim.close()
+    replayer.close()
+
+    assert replayer.mismatches == []
+    assert [event.data for event in replayed] == [event.data for event in recorded]
+    assert replayed[-1].data[0].message == 'Hello'
+
+
+def test_recorder_rotates(tmpdir):
+    path = str(tmpdir.join('serial.trace'))
+    recorder = TraceRecorder(path, max_size=120)
+
+    for _ in range(10):
+        recorder.record(RECEIVED, b'\r\nRING\r\n', channel=2)
+        recorder.flush()
+    recorder.close()
+
+    # The file is moved after 6 records and the older file is kept
+    assert [len(list(read_trace(path + '.1'))), len(list(read_trace(path)))] == [6, 4]
+    records = list(read_trace(path + '.1')) + list(read_trace(path))
+    assert {(record.channel, record.direction, record.data) for record in records} == {(2, RECEIVED, b'\r\nRING\r\n')}
+
+
+def test_invalid_trace(tmpdir):
+    path = tmpdir.join('serial.trace')
+    path.write_binary(b'\0' * 32)
+
+    with pytest.raises(ValueError):
+        list(read_trace(str(path)))
+
+
+def test_recorder_flush_interval(tmpdir):
+    path = str(tmpdir.join('serial.trace'))
+    recorder = TraceRecorder(path, flush_interval=0.05)
+
+    recorder.record(RECEIVED, b'\r\nRING\r\n')
+    assert list(read_trace(path)) == []
+
+    # The writer thread writes the buffer after the interval, although it is far from full and nothing is recorded
+    time.sleep(0.2)
+    assert len(list(read_trace(path))) == 1
+
+    # A full buffer is written at once
+    recorder.flush_interval = 60
+    recorder.record(RECEIVED, b'x' * FLUSH_SIZE)
+    time.sleep(0.1)
+    assert len(list(read_trace(path))) == 3
+    recorder.close()
+
+
+def test_replayer_close(tmpdir):
+    path = str(tmpdir.join('serial.trace'))
+    recorder = TraceRecorder(path)
+    recorder.record(WRITTEN, b'AT\r')
+    recorder.record(RECEIVED, b'\r\nOK\r\n')
+    recorder.close()
+
+    replayer = TraceReplayer(path, speed=None)
+    master, slave = replayer._master, replayer._slave
+    replayer.start()
+    replayer.close()
+    replayer.close()
+
+    # The thread stopped while it waited for the command and both ends of the pseudo-terminal are closed
+    assert not replayer.is_alive()
+    for fd in (master, slave):
+        with pytest.raises(OSError):
+            os.fstat(fd)